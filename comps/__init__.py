@@ -69,7 +69,7 @@ from comps.cores.mega.gateway import (
 from comps.cores.telemetry.opea_telemetry import opea_telemetry
 
 # Statistics
-from comps.cores.mega.base_statistics import statistics_dict, register_statistics
+from comps.cores.mega.base_statistics import statistics_dict, register_statistics, record_stage, measure_stage
 
 # Logger
 from comps.cores.mega.logger import CustomLogger
@@ -1,67 +1,265 @@
 # Copyright (C) 2024 Intel Corporation
 # SPDX-License-Identifier: Apache-2.0
 
-import numpy as np
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+from prometheus_client.core import REGISTRY, GaugeMetricFamily
 
 # name => statistic dict
 statistics_dict = {}
 
+# relative error of the reported quantiles is at most (GAMMA - 1) / 2
+SKETCH_GAMMA = 1.02
+SKETCH_MIN_VALUE = 1e-6
+_LOG_GAMMA = math.log(SKETCH_GAMMA)
+
+# window name => (ring, number of slots); the 5s ring covers 5 minutes, the 1 minute ring covers 1 hour
+WINDOWS = {"1m": ("fine", 12), "5m": ("fine", 60), "1h": ("coarse", 60)}
+_RINGS = {"fine": (5, 60), "coarse": (60, 60)}  # ring => (slot seconds, slots)
+
+# pending samples are folded into the sketches once this many piled up, or when the stats are read
+_FOLD_THRESHOLD = 1024
+
+REPORTED_QUANTILES = (0.5, 0.9, 0.99)
+
+# statistics of the request being handled, lower layers report their stages to it with record_stage()
+_active_statistics: ContextVar[Optional["BaseStatistics"]] = ContextVar("active_statistics", default=None)
+
+
+class LatencySketch:
+    """Fixed-memory quantile sketch: a sparse histogram with logarithmic buckets (HDR-style).
+
+    Bucket ``i`` holds values in ``[MIN * GAMMA**i, MIN * GAMMA**(i+1))``, so the number of buckets only
+    depends on the range of the values (about 1200 from a microsecond to three hours), not on how many
+    values were added.
+    """
+
+    __slots__ = ("counts", "count", "total", "min", "max")
+
+    def __init__(self):
+        self.counts: Dict[int, int] = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value: float):
+        bucket = int(math.log(max(value, SKETCH_MIN_VALUE) / SKETCH_MIN_VALUE) / _LOG_GAMMA)
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, other: "LatencySketch"):
+        for bucket, count in other.counts.items():
+            self.counts[bucket] = self.counts.get(bucket, 0) + count
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def quantiles(self, qs) -> list:
+        if not self.count:
+            return [None] * len(qs)
+        buckets = sorted(self.counts.items())
+        results = []
+        for q in qs:
+            rank, seen = max(1, math.ceil(q * self.count)), 0
+            for bucket, count in buckets:
+                seen += count
+                if seen >= rank:
+                    break
+            value = SKETCH_MIN_VALUE * SKETCH_GAMMA ** (bucket + 0.5)
+            results.append(min(max(value, self.min), self.max))
+        return results
+
+    def summary(self, prefix: str = "", suffix: str = "") -> Dict:
+        p50, p90, p99 = self.quantiles(REPORTED_QUANTILES)
+        return {
+            f"{prefix}count{suffix}": self.count,
+            f"{prefix}p50_latency{suffix}": p50,
+            f"{prefix}p90_latency{suffix}": p90,
+            f"{prefix}p99_latency{suffix}": p99,
+            f"{prefix}average_latency{suffix}": self.total / self.count if self.count else None,
+        }
+
+
+class _LatencySeries:
+    """One latency metric: a lifetime sketch plus rings of per-slot sketches for the sliding windows."""
+
+    __slots__ = ("lifetime", "rings")
+
+    def __init__(self):
+        self.lifetime = LatencySketch()
+        # ring => [(slot number, sketch)] indexed by slot number modulo the ring size
+        self.rings = {ring: [(None, None)] * slots for ring, (_, slots) in _RINGS.items()}
+
+    def add(self, timestamp: float, value: float):
+        self.lifetime.add(value)
+        for ring, (seconds, slots) in _RINGS.items():
+            slot = int(timestamp // seconds)
+            entries = self.rings[ring]
+            number, sketch = entries[slot % slots]
+            if number != slot:
+                sketch = LatencySketch()
+                entries[slot % slots] = (slot, sketch)
+            sketch.add(value)
+
+    def window(self, name: str, now: float) -> LatencySketch:
+        ring, slots = WINDOWS[name]
+        current = int(now // _RINGS[ring][0])
+        merged = LatencySketch()
+        for number, sketch in self.rings[ring]:
+            if number is not None and current - slots < number <= current:
+                merged.merge(sketch)
+        return merged
+
 
 class BaseStatistics:
-    """Base class to store in-memory statistics of an entity for measurement in one service."""
+    """Base class to store in-memory statistics of an entity for measurement in one service.
+
+    Latencies are kept in fixed-memory quantile sketches, over the lifetime of the service and over
+    sliding windows of 1 minute, 5 minutes and 1 hour. Request handlers can also report the latency of
+    their stages (embed, search, parent fetch, ...) with ``append_stage_latency`` or ``stage``.
+
+    Appending never takes a lock: samples go to a deque (atomic append) and are folded into the sketches
+    when statistics are read, or by whichever appender finds the lock free once enough samples piled up.
+    """
 
     def __init__(
         self,
     ):
-        self.response_times = []  # store responses time for all requests
-        self.first_token_latencies = []  # store first token latencies for all requests
+        self._pending = deque()  # (series key, timestamp, latency)
+        self._series: Dict[str, _LatencySeries] = {}  # "" => responses, "first_token" => first tokens, stage names
+        self._lock = threading.Lock()
 
     def append_latency(self, latency, first_token_latency=None):
-        self.response_times.append(latency)
+        now = time.time()
+        self._pending.append(("", now, latency))
         if first_token_latency:
-            self.first_token_latencies.append(first_token_latency)
+            self._pending.append(("first_token", now, first_token_latency))
+        self._maybe_fold()
 
-    def calculate_statistics(self):
-        if not self.response_times:
-            return {
-                "p50_latency": None,
-                "p99_latency": None,
-                "average_latency": None,
-            }
-        # Calculate the P50 (median)
-        p50 = np.percentile(self.response_times, 50)
+    def append_stage_latency(self, stage: str, latency: float):
+        self._pending.append((f"stage:{stage}", time.time(), latency))
+        self._maybe_fold()
+
+    @contextmanager
+    def stage(self, stage: str):
+        """Times the enclosed block as one sample of ``stage``."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.append_stage_latency(stage, time.perf_counter() - start)
 
-        # Calculate the P99
-        p99 = np.percentile(self.response_times, 99)
+    @contextmanager
+    def activate(self):
+        """Makes this the statistics that ``record_stage`` / ``measure_stage`` report to in the current context."""
+        token = _active_statistics.set(self)
+        try:
+            yield self
+        finally:
+            _active_statistics.reset(token)
 
-        avg = np.average(self.response_times)
+    def _maybe_fold(self):
+        if len(self._pending) >= _FOLD_THRESHOLD and self._lock.acquire(blocking=False):
+            try:
+                self._fold()
+            finally:
+                self._lock.release()
 
+    def _fold(self):
+        pending = self._pending
+        while pending:
+            try:
+                key, timestamp, latency = pending.popleft()
+            except IndexError:
+                break
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = _LatencySeries()
+            series.add(timestamp, latency)
+
+    def _snapshot(self, key: str, window: Optional[str] = None, now: Optional[float] = None) -> LatencySketch:
+        with self._lock:
+            self._fold()
+            series = self._series.get(key)
+            if series is None:
+                return LatencySketch()
+            if window is not None:
+                return series.window(window, now or time.time())
+            snapshot = LatencySketch()
+            snapshot.merge(series.lifetime)
+            return snapshot
+
+    def calculate_statistics(self):
+        summary = self._snapshot("").summary()
+        return {key: summary[key] for key in ("p50_latency", "p99_latency", "average_latency")}
+
+    def calculate_first_token_statistics(self):
+        summary = self._snapshot("first_token").summary(suffix="_first_token")
         return {
-            "p50_latency": p50,
-            "p99_latency": p99,
-            "average_latency": avg,
+            key: summary[key]
+            for key in ("p50_latency_first_token", "p99_latency_first_token", "average_latency_first_token")
         }
 
-    def calculate_first_token_statistics(self):
-        if not self.first_token_latencies:
+    def calculate_window_statistics(self):
+        """Latency summaries over the sliding windows, of the whole request and of each stage."""
+        now = time.time()
+        with self._lock:
+            self._fold()
+            keys = list(self._series)
+        results = {}
+        for window in WINDOWS:
+            stats = self._snapshot("", window, now).summary()
+            first_token = self._snapshot("first_token", window, now)
+            if first_token.count:
+                stats.update(first_token.summary(suffix="_first_token"))
+            stats["stages"] = {
+                key[len("stage:"):]: self._snapshot(key, window, now).summary()
+                for key in keys
+                if key.startswith("stage:")
+            }
+            results[window] = stats
+        return results
+
+    def calculate_stage_statistics(self):
+        """Lifetime latency summaries of each stage."""
+        with self._lock:
+            self._fold()
             return {
-                "p50_latency_first_token": None,
-                "p99_latency_first_token": None,
-                "average_latency_first_token": None,
+                key[len("stage:"):]: series.lifetime.summary()
+                for key, series in self._series.items()
+                if key.startswith("stage:")
             }
-        # Calculate the P50 (median)
-        p50 = np.percentile(self.first_token_latencies, 50)
 
-        # Calculate the P99
-        p99 = np.percentile(self.first_token_latencies, 99)
 
-        avg = np.average(self.first_token_latencies)
+def record_stage(stage: str, latency: float):
+    """Reports a stage latency to the statistics activated for the current request, if any."""
+    statistics = _active_statistics.get()
+    if statistics is not None:
+        statistics.append_stage_latency(stage, latency)
 
-        return {
-            "p50_latency_first_token": p50,
-            "p99_latency_first_token": p99,
-            "average_latency_first_token": avg,
-        }
+
+@contextmanager
+def measure_stage(stage: str):
+    """Times the enclosed block as one sample of ``stage`` of the current request, see ``record_stage``."""
+    if _active_statistics.get() is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start)
 
 
 def register_statistics(
@@ -81,5 +279,42 @@ def collect_all_statistics():
         for name, statistic in statistics_dict.items():
             tmp_dict = statistic.calculate_statistics()
             tmp_dict.update(statistic.calculate_first_token_statistics())
+            tmp_dict["stages"] = statistic.calculate_stage_statistics()
+            tmp_dict["windows"] = statistic.calculate_window_statistics()
             results.update({name: tmp_dict})
     return results
+
+
+class StatisticsCollector:
+    """Exports the windowed latency quantiles of every registered statistics to Prometheus."""
+
+    def collect(self):
+        quantiles = GaugeMetricFamily(
+            "opea_statistics_latency_seconds",
+            "Latency quantiles over a sliding window",
+            labels=["service", "stage", "window", "quantile"],
+        )
+        counts = GaugeMetricFamily(
+            "opea_statistics_requests",
+            "Number of latency samples in a sliding window",
+            labels=["service", "stage", "window"],
+        )
+        now = time.time()
+        for name, statistic in list(statistics_dict.items()):
+            with statistic._lock:
+                statistic._fold()
+                keys = list(statistic._series)
+            for key in keys:
+                stage = key[len("stage:"):] if key.startswith("stage:") else (key or "request")
+                for window in WINDOWS:
+                    sketch = statistic._snapshot(key, window, now)
+                    counts.add_metric([name, stage, window], sketch.count)
+                    if not sketch.count:
+                        continue
+                    for q, value in zip(REPORTED_QUANTILES, sketch.quantiles(REPORTED_QUANTILES)):
+                        quantiles.add_metric([name, stage, window, str(q)], value)
+        yield quantiles
+        yield counts
+
+
+REGISTRY.register(StatisticsCollector())
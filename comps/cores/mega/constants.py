@@ -40,6 +40,7 @@ class MegaServiceEndpoint(Enum):
 
     # OPEA Exclusive
     CHAT_QNA = "/v1/chatqna"
+    CHAT_QNA_CACHE = "/v1/chatqna/cache"
     AUDIO_QNA = "/v1/audioqna"
     VISUAL_QNA = "/v1/visualqna"
     VIDEO_RAG_QNA = "/v1/videoqna"
@@ -1,19 +1,195 @@
 # Copyright (C) 2024 Intel Corporation
 # SPDX-License-Identifier: Apache-2.0
 
-from collections import OrderedDict, defaultdict
-from copy import deepcopy
+from collections import OrderedDict, defaultdict, deque
+from typing import Dict, List, Tuple
+
+
+class ExecutionPlan(object):
+    """Immutable snapshot of a DAG, compiled once and shared by all requests.
+
+    Successors and predecessors are precomputed per node, nodes keep their insertion
+    order and ``order`` holds a topological order, so per-request lookups never rescan
+    the graph.
+    """
+
+    __slots__ = ("nodes", "order", "rank", "successors", "predecessors", "ind_nodes", "leaves")
+
+    def __init__(self, graph: Dict[str, set]):
+        self.nodes: Tuple[str, ...] = tuple(graph)
+        predecessors = defaultdict(list)
+        for node, dependents in graph.items():
+            for dependent in dependents:
+                predecessors[dependent].append(node)
+        # successors keep a stable order across requests
+        self.successors: Dict[str, Tuple[str, ...]] = {
+            node: tuple(n for n in self.nodes if n in graph[node]) for node in self.nodes
+        }
+        self.predecessors: Dict[str, Tuple[str, ...]] = {
+            node: tuple(predecessors.get(node, ())) for node in self.nodes
+        }
+        self.ind_nodes: Tuple[str, ...] = tuple(node for node in self.nodes if not self.predecessors[node])
+        self.leaves: Tuple[str, ...] = tuple(node for node in self.nodes if not self.successors[node])
+        self.order: Tuple[str, ...] = tuple(_kahn(self.nodes, self.successors))
+        self.rank: Dict[str, int] = {node: i for i, node in enumerate(self.order)}
+
+
+def _kahn(nodes, successors) -> List[str]:
+    in_degree = {node: 0 for node in nodes}
+    for node in nodes:
+        for dependent in successors[node]:
+            in_degree[dependent] += 1
+    ready = deque(node for node in nodes if not in_degree[node])
+    result = []
+    while ready:
+        node = ready.popleft()
+        result.append(node)
+        for dependent in successors[node]:
+            in_degree[dependent] -= 1
+            if in_degree[dependent] == 0:
+                ready.append(dependent)
+    if len(result) != len(in_degree):
+        raise ValueError("graph is not acyclic")
+    return result
+
+
+def _reachable(start, successors) -> set:
+    seen = set()
+    stack = [start]
+    while stack:
+        for node in successors(stack.pop()):
+            if node not in seen:
+                seen.add(node)
+                stack.append(node)
+    return seen
+
+
+class RuntimeGraph(object):
+    """Per-request view of an ExecutionPlan.
+
+    Implements the read and edit methods of ``DAG`` that are used while a request runs.
+    Edits (skipping a node, dropping or rerouting an edge) are recorded in a small overlay,
+    so creating one per request costs a few empty containers instead of a graph copy.
+    ``context`` is scratch space of the request, the align hooks of one node can leave data
+    there for the hooks of a later node (e.g. retrieval metadata that the rerank service
+    does not echo back).
+    """
+
+    __slots__ = ("plan", "context", "_removed_nodes", "_removed_edges", "_added_edges")
+
+    def __init__(self, plan: ExecutionPlan):
+        self.plan = plan
+        self.context: Dict = {}
+        self._removed_nodes = set()
+        self._removed_edges = set()
+        self._added_edges: Dict[str, List[str]] = {}
+
+    def has_node(self, node) -> bool:
+        return node in self.plan.rank and node not in self._removed_nodes
+
+    def nodes(self) -> List[str]:
+        return [node for node in self.plan.nodes if node not in self._removed_nodes]
+
+    def downstream(self, node) -> list:
+        if not self.has_node(node):
+            raise KeyError("node %s is not in graph" % node)
+        result = [
+            n
+            for n in self.plan.successors[node]
+            if n not in self._removed_nodes and (node, n) not in self._removed_edges
+        ]
+        for n in self._added_edges.get(node, ()):
+            if n not in self._removed_nodes and n not in result:
+                result.append(n)
+        return result
+
+    def predecessors(self, node) -> list:
+        result = [
+            n
+            for n in self.plan.predecessors.get(node, ())
+            if n not in self._removed_nodes and (n, node) not in self._removed_edges
+        ]
+        for n, dependents in self._added_edges.items():
+            if node in dependents and n not in self._removed_nodes and n not in result:
+                result.append(n)
+        return result
+
+    def add_edge(self, ind_node, dep_node):
+        if not self.has_node(ind_node) or not self.has_node(dep_node):
+            raise KeyError("one or more nodes do not exist in graph")
+        if ind_node == dep_node or ind_node in _reachable(dep_node, self.downstream):
+            raise Exception("validation error!")
+        if (ind_node, dep_node) in self._removed_edges:
+            self._removed_edges.discard((ind_node, dep_node))
+        elif dep_node not in self.plan.successors[ind_node]:
+            dependents = self._added_edges.setdefault(ind_node, [])
+            if dep_node not in dependents:
+                dependents.append(dep_node)
+
+    def delete_edge(self, ind_node, dep_node):
+        if not self.has_node(ind_node) or dep_node not in self.downstream(ind_node):
+            raise KeyError("this edge does not exist in graph")
+        if dep_node in self._added_edges.get(ind_node, ()):
+            self._added_edges[ind_node].remove(dep_node)
+        else:
+            self._removed_edges.add((ind_node, dep_node))
+
+    def delete_node(self, node_name):
+        if not self.has_node(node_name):
+            raise KeyError("node %s does not exist" % node_name)
+        self._removed_nodes.add(node_name)
+
+    def delete_node_if_exists(self, node_name):
+        try:
+            self.delete_node(node_name)
+        except KeyError:
+            pass
+
+    def ind_nodes(self) -> List[str]:
+        return [node for node in self.nodes() if not self.predecessors(node)]
+
+    def all_leaves(self) -> List[str]:
+        return [node for node in self.nodes() if not self.downstream(node)]
+
+    def all_downstreams(self, node) -> List[str]:
+        seen = _reachable(node, self.downstream)
+        if not self._added_edges:
+            # edges of the plan only, its topological order still holds
+            return sorted(seen, key=self.plan.rank.__getitem__)
+        return [n for n in self.topological_sort() if n in seen]
+
+    def topological_sort(self) -> List[str]:
+        return _kahn(self.nodes(), {node: self.downstream(node) for node in self.nodes()})
+
+    @property
+    def graph(self) -> OrderedDict:
+        """Materialized adjacency sets, for code that still inspects ``DAG.graph``."""
+        return OrderedDict((node, set(self.downstream(node))) for node in self.nodes())
+
+    def size(self):
+        return len(self.nodes())
 
 
 class DAG(object):
     def __init__(self):
         self.reset_graph()
 
+    def compile(self) -> ExecutionPlan:
+        """Return the execution plan of the current graph, compiled once until the graph changes."""
+        if self._plan is None:
+            self._plan = ExecutionPlan(self.graph)
+        return self._plan
+
+    def runtime_graph(self) -> RuntimeGraph:
+        """A cheap per-request overlay on the compiled plan."""
+        return RuntimeGraph(self.compile())
+
     def add_node(self, node_name: str):
         graph = self.graph
         if node_name in graph:
             raise KeyError("node %s already exists" % node_name)
         graph[node_name] = set()
+        self._plan = None
 
     def add_node_if_not_exists(self, node_name):
         try:
@@ -30,6 +206,7 @@ class DAG(object):
         for node, edges in graph.items():
             if node_name in edges:
                 edges.remove(node_name)
+        self._plan = None
 
     def delete_node_if_exists(self, node_name):
         try:
@@ -41,23 +218,21 @@ class DAG(object):
         graph = self.graph
         if ind_node not in graph or dep_node not in graph:
             raise KeyError("one or more nodes do not exist in graph")
-        test_graph = deepcopy(graph)
-        test_graph[ind_node].add(dep_node)
-        is_valid = self.validate(test_graph)
-        if is_valid:
-            graph[ind_node].add(dep_node)
-        else:
+        # the new edge closes a cycle iff ind_node is already reachable from dep_node
+        if ind_node == dep_node or ind_node in _reachable(dep_node, graph.__getitem__):
             raise Exception("validation error!")
+        graph[ind_node].add(dep_node)
+        self._plan = None
 
     def delete_edge(self, ind_node, dep_node):
         graph = self.graph
         if dep_node not in graph.get(ind_node, []):
             raise KeyError("this edge does not exist in graph")
         graph[ind_node].remove(dep_node)
+        self._plan = None
 
     def predecessors(self, node):
-        graph = self.graph
-        return [key for key in graph if node in graph[key]]
+        return list(self.compile().predecessors.get(node, ()))
 
     def downstream(self, node) -> list:
         graph = self.graph
@@ -66,18 +241,9 @@ class DAG(object):
         return list(graph[node])
 
     def all_downstreams(self, node):
-        graph = self.graph
-        nodes = [node]
-        nodes_seen = set()
-        i = 0
-        while i < len(nodes):
-            downstreams = self.downstream(nodes[i])
-            for downstream_node in downstreams:
-                if downstream_node not in nodes_seen:
-                    nodes_seen.add(downstream_node)
-                    nodes.append(downstream_node)
-            i += 1
-        return list(filter(lambda node: node in nodes_seen, self.topological_sort(graph=graph)))
+        if node not in self.graph:
+            raise KeyError("node %s is not in graph" % node)
+        return sorted(_reachable(node, self.graph.__getitem__), key=self.compile().rank.__getitem__)
 
     def all_leaves(self):
         graph = self.graph
@@ -95,9 +261,11 @@ class DAG(object):
 
     def reset_graph(self):
         self.graph = OrderedDict()
+        self._plan = None
 
     def ind_nodes(self, graph=None):
-        graph = graph if graph is not None else self.graph
+        if graph is None:
+            return list(self.compile().ind_nodes)
 
         dependent_nodes = set(node for dependents in graph.values() for node in dependents)
         return [node for node in graph.keys() if node not in dependent_nodes]
@@ -116,27 +284,8 @@ class DAG(object):
 
     def topological_sort(self, graph=None):
         if graph is None:
-            graph = self.graph
-        result = []
-        in_degree = defaultdict(lambda: 0)
-
-        for u in graph:
-            for v in graph[u]:
-                in_degree[v] += 1
-        ready = [node for node in graph if not in_degree[node]]
-
-        while ready:
-            u = ready.pop()
-            result.append(u)
-            for v in graph[u]:
-                in_degree[v] -= 1
-                if in_degree[v] == 0:
-                    ready.append(v)
-
-        if len(result) == len(graph):
-            return result
-        else:
-            raise ValueError("graph is not acyclic")
+            return list(self.compile().order)
+        return _kahn(list(graph), graph)
 
     def size(self):
         return len(self.graph)
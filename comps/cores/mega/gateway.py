@@ -25,6 +25,7 @@ from ..proto.api_protocol import (
 from ..proto.docarray import DocSumDoc, LLMParams, LLMParamsDoc, RerankedDoc, RerankerParms, RetrieverParms, TextDoc
 from .constants import MegaServiceEndpoint, ServiceRoleType, ServiceType
 from .micro_service import MicroService
+from .semantic_cache import SemanticCache, capture_stream, replay_stream
 
 def read_pdf(file):
     from langchain.document_loaders import PyPDFLoader
@@ -198,10 +199,51 @@ class Gateway:
 
 class ChatQnAGateway(Gateway):
     def __init__(self, megaservice, host="0.0.0.0", port=8888):
+        # semantic answer cache, opt-in since cached answers are served without retrieval
+        self.semantic_cache = None
+        if os.getenv("SEMANTIC_CACHE_ENABLED", "false").lower() in ("true", "1", "yes"):
+            self.semantic_cache = SemanticCache(
+                threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", 0.95)),
+                ttl=int(os.getenv("SEMANTIC_CACHE_TTL", 3600)),
+                max_entries=int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", 1000)),
+            )
         super().__init__(
             megaservice, host, port, str(MegaServiceEndpoint.CHAT_QNA), ChatCompletionRequest, ChatCompletionResponse
         )
 
+    def define_routes(self):
+        super().define_routes()
+        self.service.app.router.add_api_route(
+            str(MegaServiceEndpoint.CHAT_QNA_CACHE), self.invalidate_cache, methods=["DELETE"]
+        )
+        self.service.app.router.add_api_route(str(MegaServiceEndpoint.CHAT_QNA_CACHE), self.cache_stats, methods=["GET"])
+
+    async def invalidate_cache(self, knowledge_name: str = ""):
+        """Called by dataprep when the files of a knowledge base change; an empty name drops everything."""
+        dropped = self.semantic_cache.invalidate(knowledge_name) if self.semantic_cache else 0
+        return {"knowledge_name": knowledge_name, "dropped": dropped}
+
+    async def cache_stats(self):
+        return self.semantic_cache.stats() if self.semantic_cache else {"enabled": False}
+
+    def _embedding_node(self):
+        # the cache needs the query embedding before retrieval, only possible when embedding runs first
+        for node in self.megaservice.ind_nodes():
+            if self.megaservice.services[node].service_type == ServiceType.EMBEDDING:
+                return node
+        return None
+
+    @staticmethod
+    def _chat_response(text):
+        choices = [
+            ChatCompletionResponseChoice(
+                index=0,
+                message=ChatMessage(role="assistant", content=text),
+                finish_reason="stop",
+            )
+        ]
+        return ChatCompletionResponse(model="chatqna", choices=choices, usage=UsageInfo())
+
     async def handle_request(self, request: Request):
         data = await request.json()
         print("data in handle request", data)
@@ -238,14 +280,60 @@ class ChatQnAGateway(Gateway):
         reranker_parameters = RerankerParms(
             top_n=chat_request.top_n if chat_request.top_n else 1,
         )
+
+        precomputed_outputs, remember = None, None
+        embedding_node = self._embedding_node() if self.semantic_cache else None
+        if embedding_node and retriever_parameters.knowledge_name and isinstance(prompt, str):
+            embedded = await self.megaservice.run_node(embedding_node, {"text": prompt}, parameters)
+            knowledge_name = retriever_parameters.knowledge_name
+            if isinstance(knowledge_name, list):
+                # a federated request is cached under the set of its knowledge bases
+                knowledge_name = tuple(sorted(set(knowledge_name)))
+            # answers are only shared between requests that would run the same chain
+            variant = (
+                parameters.model,
+                parameters.chat_template,
+                parameters.max_tokens,
+                parameters.temperature,
+                parameters.top_p,
+                parameters.top_k,
+                parameters.frequency_penalty,
+                parameters.presence_penalty,
+                parameters.repetition_penalty,
+                retriever_parameters.search_type,
+                retriever_parameters.k,
+                retriever_parameters.fetch_k,
+                retriever_parameters.lambda_mult,
+                retriever_parameters.distance_threshold,
+                retriever_parameters.score_threshold,
+                reranker_parameters.top_n,
+            )
+            # taken before retrieval: an answer finished after an invalidation is not cached
+            generation = self.semantic_cache.generation(knowledge_name)
+            answer = self.semantic_cache.get(knowledge_name, embedded["embedding"], variant)
+            if answer is not None:
+                if stream_opt:
+                    return StreamingResponse(replay_stream(answer), media_type="text/event-stream")
+                return self._chat_response(answer)
+            # the embedding node is not run again for this request
+            precomputed_outputs = {embedding_node: embedded}
+
+            def remember(text):
+                self.semantic_cache.put(knowledge_name, embedded["embedding"], text, variant, generation)
+
         result_dict, runtime_graph = await self.megaservice.schedule(
             initial_inputs={"text": prompt},
             llm_parameters=parameters,
+            precomputed_outputs=precomputed_outputs,
             retriever_parameters=retriever_parameters,
             reranker_parameters=reranker_parameters,
         )
         for node, response in result_dict.items():
             if isinstance(response, StreamingResponse):
+                if remember:
+                    return StreamingResponse(
+                        capture_stream(response.body_iterator, remember), media_type=response.media_type
+                    )
                 return response
         last_node = runtime_graph.all_leaves()[-1]
         print("result_dict=========\n")
@@ -253,16 +341,9 @@ class ChatQnAGateway(Gateway):
         print("last_node==============\n")
         print(json.dumps(last_node, indent=2))
         response = result_dict[last_node]["text"]
-        choices = []
-        usage = UsageInfo()
-        choices.append(
-            ChatCompletionResponseChoice(
-                index=0,
-                message=ChatMessage(role="assistant", content=response),
-                finish_reason="stop",
-            )
-        )
-        return ChatCompletionResponse(model="chatqna", choices=choices, usage=usage)
+        if remember:
+            remember(response)
+        return self._chat_response(response)
 
 
 class CodeGenGateway(Gateway):
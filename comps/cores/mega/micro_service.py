@@ -2,12 +2,16 @@
 # SPDX-License-Identifier: Apache-2.0
 
 import asyncio
+import itertools
 import multiprocessing
 import os
+import time
 from collections import defaultdict, deque
 from enum import Enum
 from typing import Any, List, Optional, Type
 
+from prometheus_client import Gauge, Histogram
+
 from ..proto.docarray import TextDoc
 from .constants import ServiceRoleType, ServiceType
 from .logger import CustomLogger
@@ -18,6 +22,30 @@ opea_microservices = {}
 logger = CustomLogger("micro_service")
 logflag = os.getenv("LOGFLAG", False)
 
+# with length bucketing, a batch is filled from this many times max_batch_size queued requests
+BUCKETING_LOOKAHEAD = 4
+
+
+class DynamicBatchingMetrics:
+    # Prometheus requires metrics to be singletons, several microservices can live in one process,
+    # so metrics are class members labelled with the service name and type
+    batch_size = Histogram(
+        "microservice_batch_size",
+        "Number of requests per dynamic batch (histogram)",
+        ["service", "service_type"],
+        buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256),
+    )
+    queue_wait = Histogram(
+        "microservice_batch_queue_wait",
+        "Time a request waited in the dynamic batching queue (histogram)",
+        ["service", "service_type"],
+    )
+    queue_depth = Gauge(
+        "microservice_batch_queue_depth",
+        "Requests waiting in the dynamic batching queue (gauge)",
+        ["service", "service_type"],
+    )
+
 
 class MicroService:
     """MicroService class to create a microservice."""
@@ -77,6 +105,8 @@ class MicroService:
             if self.dynamic_batching:
                 self.buffer_lock = asyncio.Lock()
                 self.request_buffer = defaultdict(deque)
+                self._batch_events = {}  # service type => event set when requests are queued
+                self._batch_schedulers = {}  # service type => scheduler task
 
                 @self.app.on_event("startup")
                 async def startup_event():
@@ -87,31 +117,134 @@ class MicroService:
             self.event_loop.run_until_complete(self._async_setup())
 
     async def _dynamic_batch_processor(self):
+        """Starts the batch schedulers of requests queued directly into ``request_buffer``.
+
+        Requests queued with ``submit_batch_request`` wake their scheduler at once; requests appended
+        to ``request_buffer`` by older handlers are noticed here within ``dynamic_batching_timeout``.
+        """
         if logflag:
             logger.info("dynamic batch processor looping...")
         while True:
             await asyncio.sleep(self.dynamic_batching_timeout)
-            runtime_batch: dict[Enum, list[dict]] = {}  # {ServiceType.Embedding: [{"request": xx, "response": yy}, {}]}
-
-            async with self.buffer_lock:
-                # prepare the runtime batch, access to buffer is locked
-                if self.request_buffer:
-                    for service_type, request_lst in self.request_buffer.items():
-                        batch = []
-                        # grab min(MAX_BATCH_SIZE, REQUEST_SIZE) requests from buffer
-                        for _ in range(min(self.dynamic_batching_max_batch_size, len(request_lst))):
-                            batch.append(request_lst.popleft())
-
-                        runtime_batch[service_type] = batch
-
-            # Run batched inference on the batch and set results
-            for service_type, batch in runtime_batch.items():
-                if not batch:
-                    continue
-                results = await self.dynamic_batching_infer(service_type, batch)
-
-                for req, result in zip(batch, results):
-                    req["response"].set_result(result)
+            for service_type, request_lst in list(self.request_buffer.items()):
+                if request_lst:
+                    self._wake_batch_scheduler(service_type)
+
+    def submit_batch_request(self, service_type: Enum, request) -> asyncio.Future:
+        """Queues a request for dynamic batching.
+
+        Returns a future resolved with the request's item of ``dynamic_batching_infer``'s results.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self.request_buffer[service_type].append(
+            {"request": request, "response": future, "enqueued": time.monotonic()}
+        )
+        self._wake_batch_scheduler(service_type)
+        return future
+
+    def _wake_batch_scheduler(self, service_type: Enum):
+        event = self._batch_events.get(service_type)
+        if event is None:
+            event = self._batch_events[service_type] = asyncio.Event()
+        scheduler = self._batch_schedulers.get(service_type)
+        if scheduler is None or scheduler.done():
+            self._batch_schedulers[service_type] = asyncio.create_task(self._batch_scheduler(service_type))
+        event.set()
+
+    async def _batch_scheduler(self, service_type: Enum):
+        """Dispatches the queue of one service type.
+
+        A batch is dispatched as soon as ``dynamic_batching_max_batch_size`` requests are queued or the
+        oldest request waited ``dynamic_batching_timeout`` seconds. Each service type has its own
+        scheduler, so batches of different types run concurrently.
+        """
+        queue = self.request_buffer[service_type]
+        event = self._batch_events[service_type]
+        labels = (self.name, getattr(service_type, "name", str(service_type)))
+        while True:
+            # drop requests whose client went away
+            while queue and queue[0]["response"].done():
+                queue.popleft()
+            DynamicBatchingMetrics.queue_depth.labels(*labels).set(len(queue))
+            if not queue:
+                event.clear()
+                await event.wait()
+                continue
+
+            now = time.monotonic()
+            deadline = queue[0].setdefault("enqueued", now) + self.dynamic_batching_timeout
+            if len(queue) < self.dynamic_batching_max_batch_size and now < deadline:
+                event.clear()
+                try:
+                    await asyncio.wait_for(event.wait(), deadline - now)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            batch = self._take_batch(service_type, queue)
+            now = time.monotonic()
+            DynamicBatchingMetrics.batch_size.labels(*labels).observe(len(batch))
+            for req in batch:
+                DynamicBatchingMetrics.queue_wait.labels(*labels).observe(now - req.get("enqueued", now))
+            await self._run_batch(service_type, batch)
+
+    def _take_batch(self, service_type: Enum, queue: deque) -> list:
+        """Pops the next batch: the oldest request plus the queued requests of the closest length buckets."""
+        size = self.dynamic_batching_max_batch_size
+        first = queue.popleft()
+        if len(queue) < size:
+            batch = [first] + [req for req in queue if not req["response"].done()]
+            queue.clear()
+            return batch
+
+        first_bucket = self._bucket(service_type, first)
+        if first_bucket is None:
+            batch = [first]
+            while queue and len(batch) < size:
+                req = queue.popleft()
+                if not req["response"].done():
+                    batch.append(req)
+            return batch
+
+        # requests of the same padded length share a batch; age breaks ties, so no request is starved
+        # for long: once it is the oldest it is always dispatched
+        window = [req for req in itertools.islice(queue, size * BUCKETING_LOOKAHEAD) if not req["response"].done()]
+        for _ in range(min(len(queue), size * BUCKETING_LOOKAHEAD)):
+            queue.popleft()
+        def distance(i):
+            bucket = self._bucket(service_type, window[i])
+            return (abs(bucket - first_bucket) if bucket is not None else float("inf"), i)
+
+        ranked = sorted(range(len(window)), key=distance)
+        chosen = set(ranked[: size - 1])
+        queue.extendleft(reversed([req for i, req in enumerate(window) if i not in chosen]))
+        return [first] + [req for i, req in enumerate(window) if i in chosen]
+
+    def _bucket(self, service_type: Enum, req: dict):
+        if "bucket" not in req:
+            req["bucket"] = self.dynamic_batching_bucket(service_type, req["request"])
+        return req["bucket"]
+
+    async def _run_batch(self, service_type: Enum, batch: list):
+        try:
+            results = await self.dynamic_batching_infer(service_type, batch)
+        except Exception as e:
+            logger.error(f"{service_type} batch of {len(batch)} requests failed: {e}")
+            for req in batch:
+                if not req["response"].done():
+                    req["response"].set_exception(e)
+            return
+        for req, result in zip(batch, results):
+            if not req["response"].done():
+                req["response"].set_result(result)
+
+    def dynamic_batching_bucket(self, service_type: Enum, request) -> Optional[int]:
+        """Length bucket of a request, e.g. its padded token length; None disables length bucketing.
+
+        Models that pad a batch to its longest input can override it, so that batches are formed
+        from requests of similar length.
+        """
+        return None
 
     async def dynamic_batching_infer(self, service_type: Enum, batch: list[dict]):
         """Need to implement."""
@@ -2,7 +2,6 @@
 # SPDX-License-Identifier: Apache-2.0
 
 import asyncio
-import copy
 import json
 import os
 import re
@@ -10,19 +9,24 @@ import time
 from typing import Dict, List
 
 import aiohttp
-import requests
 from fastapi.responses import StreamingResponse
 from prometheus_client import Gauge, Histogram
 from pydantic import BaseModel
 
 from ..proto.docarray import LLMParams
 from .constants import ServiceType
-from .dag import DAG
+from .dag import DAG, RuntimeGraph
 from .logger import CustomLogger
 
 logger = CustomLogger("comps-core-orchestrator")
 LOGFLAG = os.getenv("LOGFLAG", False)
 
+# connection pool of the shared client session: total and per service (host:port) limits
+MAX_CONNECTIONS = int(os.getenv("ORCHESTRATOR_MAX_CONNECTIONS", 1000))
+MAX_CONNECTIONS_PER_SERVICE = int(os.getenv("ORCHESTRATOR_MAX_CONNECTIONS_PER_SERVICE", 100))
+KEEPALIVE_TIMEOUT = float(os.getenv("ORCHESTRATOR_KEEPALIVE_TIMEOUT", 60))
+REQUEST_TIMEOUT = float(os.getenv("ORCHESTRATOR_REQUEST_TIMEOUT", 1000))
+
 
 class OrchestratorMetrics:
     # Because:
@@ -62,8 +66,32 @@ class ServiceOrchestrator(DAG):
     def __init__(self) -> None:
         self.metrics = OrchestratorMetrics()
         self.services = {}  # all services, id -> service
+        self._session = None
+        self._session_loop = None
         super().__init__()
 
+    def _get_session(self) -> aiohttp.ClientSession:
+        """The keep-alive client session shared by all requests of this orchestrator.
+
+        Created lazily on the serving event loop and recreated if that loop changes.
+        """
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._session_loop is not loop:
+            connector = aiohttp.TCPConnector(
+                limit=MAX_CONNECTIONS,
+                limit_per_host=MAX_CONNECTIONS_PER_SERVICE,
+                keepalive_timeout=KEEPALIVE_TIMEOUT,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector, trust_env=True, timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+            )
+            self._session_loop = loop
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
     def add(self, service):
         if service.name not in self.services:
             self.services[service.name] = service
@@ -80,74 +108,101 @@ class ServiceOrchestrator(DAG):
             logger.error(e)
             return False
 
-    async def schedule(self, initial_inputs: Dict | BaseModel, llm_parameters: LLMParams = LLMParams(), **kwargs):
+    async def run_node(self, node: str, inputs: Dict, llm_parameters: LLMParams = LLMParams(), **kwargs):
+        """Execute a single node outside of a DAG run and return its aligned output.
+
+        Used by gateways that need an intermediate result, e.g. the query embedding,
+        before deciding whether to schedule the whole DAG.
+        """
+        response, _ = await self.execute(
+            self._get_session(), time.time(), node, inputs, self.runtime_graph(), llm_parameters, **kwargs
+        )
+        return response
+
+    async def _precomputed(self, response, node: str):
+        return response, node
+
+    async def schedule(
+        self,
+        initial_inputs: Dict | BaseModel,
+        llm_parameters: LLMParams = LLMParams(),
+        precomputed_outputs: Dict = None,
+        **kwargs,
+    ):
+        """Run the DAG.
+
+        ``precomputed_outputs`` maps independent nodes to outputs the caller already has
+        (see ``run_node``); those nodes are not executed again.
+        """
+        precomputed_outputs = precomputed_outputs or {}
         req_start = time.time()
         self.metrics.pending_update(True)
 
         result_dict = {}
-        runtime_graph = DAG()
-        runtime_graph.graph = copy.deepcopy(self.graph)
+        # per-request overlay on the compiled plan, edits made while the request runs do not touch the DAG
+        runtime_graph = self.runtime_graph()
         if LOGFLAG:
             logger.info(initial_inputs)
 
-        timeout = aiohttp.ClientTimeout(total=1000)
-        async with aiohttp.ClientSession(trust_env=True, timeout=timeout) as session:
-            pending = {
-                asyncio.create_task(
-                    self.execute(session, req_start, node, initial_inputs, runtime_graph, llm_parameters, **kwargs)
-                )
-                for node in self.ind_nodes()
-            }
-            ind_nodes = self.ind_nodes()
-
-            while pending:
-                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
-                for done_task in done:
-                    response, node = await done_task
-                    result_dict[node] = response
-
-                    # traverse the current node's downstream nodes and execute if all one's predecessors are finished
-                    downstreams = runtime_graph.downstream(node)
-
-                    # remove all the black nodes that are skipped to be forwarded to
-                    if not isinstance(response, StreamingResponse) and "downstream_black_list" in response:
-                        for black_node in response["downstream_black_list"]:
-                            for downstream in reversed(downstreams):
-                                try:
-                                    if re.findall(black_node, downstream):
-                                        if LOGFLAG:
-                                            logger.info(f"skip forwardding to {downstream}...")
-                                        runtime_graph.delete_edge(node, downstream)
-                                        downstreams.remove(downstream)
-                                except re.error as e:
-                                    logger.error("Pattern invalid! Operation cancelled.")
-                            if len(downstreams) == 0 and llm_parameters.streaming:
-                                # turn the response to a StreamingResponse
-                                # to make the response uniform to UI
-                                def fake_stream(text):
-                                    yield "data: b'" + text + "'\n\n"
-                                    yield "data: [DONE]\n\n"
-
-                                result_dict[node] = StreamingResponse(
-                                    fake_stream(response["text"]), media_type="text/event-stream"
-                                )
+        session = self._get_session()
+        pending = {
+            asyncio.create_task(
+                self._precomputed(precomputed_outputs[node], node)
+                if node in precomputed_outputs
+                else self.execute(session, req_start, node, initial_inputs, runtime_graph, llm_parameters, **kwargs)
+            )
+            for node in runtime_graph.plan.ind_nodes
+        }
+        ind_nodes = runtime_graph.plan.ind_nodes
+
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for done_task in done:
+                response, node = await done_task
+                result_dict[node] = response
+
+                # traverse the current node's downstream nodes and execute if all one's predecessors are finished
+                downstreams = runtime_graph.downstream(node)
+
+                # remove all the black nodes that are skipped to be forwarded to
+                if not isinstance(response, StreamingResponse) and "downstream_black_list" in response:
+                    for black_node in response["downstream_black_list"]:
+                        for downstream in reversed(downstreams):
+                            try:
+                                if re.findall(black_node, downstream):
+                                    if LOGFLAG:
+                                        logger.info(f"skip forwardding to {downstream}...")
+                                    runtime_graph.delete_edge(node, downstream)
+                                    downstreams.remove(downstream)
+                            except re.error as e:
+                                logger.error("Pattern invalid! Operation cancelled.")
+                        if len(downstreams) == 0 and llm_parameters.streaming:
+                            # turn the response to a StreamingResponse
+                            # to make the response uniform to UI
+                            def fake_stream(text):
+                                yield "data: b'" + text + "'\n\n"
+                                yield "data: [DONE]\n\n"
+
+                            result_dict[node] = StreamingResponse(
+                                fake_stream(response["text"]), media_type="text/event-stream"
+                            )
 
-                    for d_node in downstreams:
-                        if all(i in result_dict for i in runtime_graph.predecessors(d_node)):
-                            inputs = self.process_outputs(runtime_graph.predecessors(d_node), result_dict)
-                            pending.add(
-                                asyncio.create_task(
-                                    self.execute(
-                                        session, req_start, d_node, inputs, runtime_graph, llm_parameters, **kwargs
-                                    )
+                for d_node in downstreams:
+                    if all(i in result_dict for i in runtime_graph.predecessors(d_node)):
+                        inputs = self.process_outputs(runtime_graph.predecessors(d_node), result_dict)
+                        pending.add(
+                            asyncio.create_task(
+                                self.execute(
+                                    session, req_start, d_node, inputs, runtime_graph, llm_parameters, **kwargs
                                 )
                             )
+                        )
         nodes_to_keep = []
         for i in ind_nodes:
             nodes_to_keep.append(i)
             nodes_to_keep.extend(runtime_graph.all_downstreams(i))
 
-        all_nodes = list(runtime_graph.graph.keys())
+        all_nodes = runtime_graph.nodes()
 
         for node in all_nodes:
             if node not in nodes_to_keep:
@@ -172,7 +227,7 @@ class ServiceOrchestrator(DAG):
         req_start: float,
         cur_node: str,
         inputs: Dict,
-        runtime_graph: DAG,
+        runtime_graph: RuntimeGraph,
         llm_parameters: LLMParams = LLMParams(),
         **kwargs,
     ):
@@ -190,17 +245,9 @@ class ServiceOrchestrator(DAG):
         inputs = self.align_inputs(inputs, cur_node, runtime_graph, llm_parameters_dict, **kwargs)
 
         if is_llm_vlm and llm_parameters.streaming:
-            # Still leave to sync requests.post for StreamingResponse
             if LOGFLAG:
                 logger.info(inputs)
-            response = requests.post(
-                url=endpoint,
-                data=json.dumps(inputs),
-                headers={"Content-type": "application/json"},
-                proxies={"http": None},
-                stream=True,
-                timeout=1000,
-            )
+            response = await session.post(endpoint, json=inputs)
             downstream = runtime_graph.downstream(cur_node)
             if downstream:
                 assert len(downstream) == 1, "Not supported multiple streaming downstreams yet!"
@@ -208,39 +255,39 @@ class ServiceOrchestrator(DAG):
                 hitted_ends = [".", "?", "!", "。", "，", "！"]
                 downstream_endpoint = self.services[downstream[0]].endpoint_path
 
-            def generate():
+            async def generate():
                 token_start = req_start
-                if response:
-                    # response.elapsed = time until first headers received
+                try:
                     buffered_chunk_str = ""
                     is_first = True
-                    for chunk in response.iter_content(chunk_size=None):
-                        if chunk:
-                            if downstream:
-                                chunk = chunk.decode("utf-8")
-                                buffered_chunk_str += self.extract_chunk_str(chunk)
-                                is_last = chunk.endswith("[DONE]\n\n")
-                                if (buffered_chunk_str and buffered_chunk_str[-1] in hitted_ends) or is_last:
-                                    res = requests.post(
-                                        url=downstream_endpoint,
-                                        data=json.dumps({"text": buffered_chunk_str}),
-                                        proxies={"http": None},
-                                    )
-                                    res_json = res.json()
-                                    if "text" in res_json:
-                                        res_txt = res_json["text"]
-                                    else:
-                                        raise Exception("Other response types not supported yet!")
-                                    buffered_chunk_str = ""  # clear
-                                    yield from self.token_generator(
-                                        res_txt, token_start, is_first=is_first, is_last=is_last
-                                    )
-                                    token_start = time.time()
-                            else:
-                                yield chunk
-                                token_start = self.metrics.token_update(token_start, is_first)
-                            is_first = False
+                    async for chunk in self.iter_events(response):
+                        if downstream:
+                            chunk = chunk.decode("utf-8")
+                            buffered_chunk_str += self.extract_chunk_str(chunk)
+                            is_last = chunk.endswith("[DONE]\n\n")
+                            if (buffered_chunk_str and buffered_chunk_str[-1] in hitted_ends) or is_last:
+                                async with session.post(
+                                    downstream_endpoint, json={"text": buffered_chunk_str}
+                                ) as res:
+                                    res_json = await res.json()
+                                if "text" in res_json:
+                                    res_txt = res_json["text"]
+                                else:
+                                    raise Exception("Other response types not supported yet!")
+                                buffered_chunk_str = ""  # clear
+                                for token in self.token_generator(
+                                    res_txt, token_start, is_first=is_first, is_last=is_last
+                                ):
+                                    yield token
+                                token_start = time.time()
+                        else:
+                            yield chunk
+                            token_start = self.metrics.token_update(token_start, is_first)
+                        is_first = False
                     self.metrics.request_update(req_start)
+                finally:
+                    # also reached when the client disconnects mid-stream
+                    response.release()
                     self.metrics.pending_update(False)
 
             return (
@@ -279,9 +326,25 @@ class ServiceOrchestrator(DAG):
         return data
 
     def align_generator(self, gen, *args, **kwargs):
-        """Override this method in megaservice definition."""
+        """Override this method in megaservice definition.
+
+        ``gen`` is an async generator of server-sent events (bytes, one complete event per item);
+        the override must return an async iterable as well.
+        """
         return gen
 
+    @staticmethod
+    async def iter_events(response: aiohttp.ClientResponse):
+        """Yield the streamed body one server-sent event (terminated by a blank line) at a time."""
+        buffer = b""
+        async for chunk in response.content.iter_any():
+            buffer += chunk
+            *events, buffer = buffer.split(b"\n\n")
+            for event in events:
+                yield event + b"\n\n"
+        if buffer:
+            yield buffer
+
     def get_all_final_outputs(self, result_dict, runtime_graph):
         final_output_dict = {}
         for leaf in runtime_graph.all_leaves():
@@ -0,0 +1,194 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import ast
+import codecs
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Dict, Hashable, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+
+from .logger import CustomLogger
+
+logger = CustomLogger("comps-core-semantic-cache")
+
+
+@dataclass
+class _Partition:
+    """One (knowledge_name, variant) partition: normalized query vectors stacked in a matrix.
+
+    ``knowledge_name`` is a name, or a sorted tuple of names for a request searching several knowledge bases.
+    """
+
+    vectors: Optional[np.ndarray] = None
+    answers: List[str] = field(default_factory=list)
+    created: List[float] = field(default_factory=list)
+
+
+class SemanticCache:
+    """Answer cache keyed by (knowledge_name, query embedding).
+
+    A lookup hits when a cached query of the same knowledge base and request variant
+    (model, template, retrieval parameters) has cosine similarity >= ``threshold`` and is
+    younger than ``ttl`` seconds. Each partition keeps at most ``max_entries`` answers,
+    the oldest are dropped first. ``invalidate`` drops every answer of a knowledge base,
+    including answers of federated requests that searched it, and is called when its files change.
+
+    An answer is only stored once the LLM finished it, possibly after an invalidation. Callers
+    take a ``generation`` before the lookup and pass it to ``put``, which discards answers of a
+    knowledge base invalidated in between, since they may have been built from old documents.
+    """
+
+    def __init__(self, threshold: float = 0.95, ttl: int = 3600, max_entries: int = 1000):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max(1, max_entries)
+        self._partitions: Dict[tuple, _Partition] = {}
+        # bumped by invalidate, per knowledge base and for invalidating every knowledge base
+        self._generations: Dict[str, int] = {}
+        self._global_generation = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _expire(self, partition: _Partition, now: float):
+        # entries are appended in creation order, expired ones are always a prefix
+        expired = 0
+        while expired < len(partition.created) and now - partition.created[expired] > self.ttl:
+            expired += 1
+        overflow = max(0, len(partition.created) - expired - self.max_entries)
+        drop = expired + overflow
+        if drop:
+            partition.vectors = partition.vectors[drop:]
+            del partition.answers[:drop]
+            del partition.created[:drop]
+
+    def _generation(self, knowledge_name: Union[str, Tuple[str, ...]]) -> tuple:
+        names = knowledge_name if isinstance(knowledge_name, tuple) else (knowledge_name,)
+        return (self._global_generation, *(self._generations.get(name, 0) for name in names))
+
+    def generation(self, knowledge_name: Union[str, Tuple[str, ...]]) -> tuple:
+        """Returns the invalidation generation of a knowledge base, to be passed to ``put``."""
+        with self._lock:
+            return self._generation(knowledge_name)
+
+    def get(self, knowledge_name: Union[str, Tuple[str, ...]], embedding, variant: Hashable = None) -> Optional[str]:
+        query = self._normalize(embedding)
+        with self._lock:
+            partition = self._partitions.get((knowledge_name, variant))
+            if partition is not None:
+                self._expire(partition, time.time())
+            if partition is None or not partition.answers or partition.vectors.shape[1] != query.shape[0]:
+                self.misses += 1
+                return None
+            similarities = partition.vectors @ query
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return partition.answers[best]
+
+    def put(
+        self,
+        knowledge_name: Union[str, Tuple[str, ...]],
+        embedding,
+        answer: str,
+        variant: Hashable = None,
+        generation: Optional[tuple] = None,
+    ):
+        if not answer:
+            return
+        query = self._normalize(embedding).reshape(1, -1)
+        with self._lock:
+            if generation is not None and generation != self._generation(knowledge_name):
+                logger.info(f"dropped an answer of {knowledge_name} finished after the cache was invalidated")
+                return
+            partition = self._partitions.setdefault((knowledge_name, variant), _Partition())
+            if partition.vectors is None or partition.vectors.shape[1] != query.shape[1]:
+                partition.vectors, partition.answers, partition.created = query, [answer], [time.time()]
+                return
+            partition.vectors = np.vstack([partition.vectors, query])
+            partition.answers.append(answer)
+            partition.created.append(time.time())
+            self._expire(partition, time.time())
+
+    def invalidate(self, knowledge_name: Optional[str] = None) -> int:
+        """Drops the answers of a knowledge base, or of every knowledge base when the name is empty."""
+        with self._lock:
+            if knowledge_name:
+                self._generations[knowledge_name] = self._generations.get(knowledge_name, 0) + 1
+            else:
+                self._global_generation += 1
+            keys = [
+                key
+                for key in self._partitions
+                if not knowledge_name
+                or key[0] == knowledge_name
+                or (isinstance(key[0], tuple) and knowledge_name in key[0])
+            ]
+            dropped = sum(len(self._partitions.pop(key).answers) for key in keys)
+        logger.info(f"invalidated {dropped} cached answers of {knowledge_name or 'all knowledge bases'}")
+        return dropped
+
+    def stats(self) -> Dict:
+        with self._lock:
+            entries = {}
+            for (knowledge_name, _), partition in self._partitions.items():
+                if isinstance(knowledge_name, tuple):
+                    knowledge_name = ",".join(knowledge_name)
+                entries[knowledge_name] = entries.get(knowledge_name, 0) + len(partition.answers)
+            return {
+                "entries": entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "threshold": self.threshold,
+                "ttl": self.ttl,
+            }
+
+
+_REPLAY_PIECE = re.compile(r"\s*\S{1,8}\s*|\s+", re.UNICODE)
+
+
+def replay_stream(answer: str) -> Iterator[str]:
+    """Replays a cached answer in the same server-sent event format as a live LLM stream."""
+    for piece in _REPLAY_PIECE.findall(answer):
+        yield f"data: {repr(piece.encode('utf-8'))}\n\n"
+    yield "data: [DONE]\n\n"
+
+
+async def capture_stream(body_iterator: AsyncIterator, on_complete) -> AsyncIterator:
+    """Passes a live answer stream through and calls ``on_complete(answer)`` once it finished.
+
+    The answer is only reported when the stream ended with ``[DONE]`` and every event could be
+    decoded, so interrupted or unexpected streams are never cached.
+    """
+    pieces, buffer, completed, valid = [], "", False, True
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    async for chunk in body_iterator:
+        yield chunk
+        buffer += decoder.decode(chunk) if isinstance(chunk, bytes) else chunk
+        *events, buffer = buffer.split("\n\n")
+        for event in events:
+            if not event.startswith("data: "):
+                continue
+            payload = event[len("data: "):]
+            if payload == "[DONE]":
+                completed = True
+                continue
+            try:
+                piece = ast.literal_eval(payload)
+                pieces.append(piece.decode("utf-8") if isinstance(piece, bytes) else str(piece))
+            except (ValueError, SyntaxError, UnicodeDecodeError):
+                valid = False
+    if completed and valid:
+        on_complete("".join(pieces))
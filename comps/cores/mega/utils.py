@@ -1,13 +1,15 @@
 # Copyright (C) 2024 Intel Corporation
 # SPDX-License-Identifier: Apache-2.0
 
+import asyncio
 import ipaddress
 import json
 import multiprocessing
 import os
 import random
+import time
 from socket import AF_INET, SOCK_STREAM, socket
-from typing import List, Optional, Union
+from typing import List, Optional, Tuple, Union
 
 import requests
 
@@ -226,8 +228,8 @@ def load_model_configs(model_configs: str) -> dict:
         raise
 
 
-def get_access_token(token_url: str, client_id: str, client_secret: str) -> str:
-    """Get access token using OAuth client credentials flow."""
+def fetch_access_token(token_url: str, client_id: str, client_secret: str) -> Tuple[str, Optional[float]]:
+    """Get access token and its lifetime in seconds (None if not reported) using OAuth client credentials flow."""
     logger = CustomLogger("tgi_or_tei_service_auth")
     data = {
         "client_id": client_id,
@@ -238,10 +240,55 @@ def get_access_token(token_url: str, client_id: str, client_secret: str) -> str:
     response = requests.post(token_url, data=data, headers=headers)
     if response.status_code == 200:
         token_info = response.json()
-        return token_info.get("access_token", "")
+        expires_in = token_info.get("expires_in")
+        return token_info.get("access_token", ""), float(expires_in) if expires_in else None
     else:
         logger.error(f"Failed to retrieve access token: {response.status_code}, {response.text}")
-        return ""
+        return "", None
+
+
+def get_access_token(token_url: str, client_id: str, client_secret: str) -> str:
+    """Get access token using OAuth client credentials flow."""
+    return fetch_access_token(token_url, client_id, client_secret)[0]
+
+
+class AccessTokenCache:
+    """Caches an OAuth client credentials access token for async services.
+
+    The token is fetched once (in a worker thread, the event loop is not blocked) and reused
+    until ``refresh_margin`` seconds before it expires; tokens without ``expires_in`` are kept
+    for ``default_ttl`` seconds. Concurrent callers share a single refresh.
+    """
+
+    def __init__(
+        self, token_url: str, client_id: str, client_secret: str, refresh_margin: float = 60, default_ttl: float = 300
+    ):
+        self.token_url = token_url
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.refresh_margin = refresh_margin
+        self.default_ttl = default_ttl
+        self._token = ""
+        self._refresh_at = 0.0
+        self._lock = None
+
+    async def get(self) -> str:
+        if self._token and time.monotonic() < self._refresh_at:
+            return self._token
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self._token and time.monotonic() < self._refresh_at:
+                return self._token
+            token, expires_in = await asyncio.to_thread(
+                fetch_access_token, self.token_url, self.client_id, self.client_secret
+            )
+            if token:
+                ttl = expires_in if expires_in is not None else self.default_ttl
+                self._token = token
+                self._refresh_at = time.monotonic() + max(ttl - self.refresh_margin, ttl / 2)
+            # on failure the previous token, if any, is still tried; the next call fetches again
+            return self._token
 
 
 class SafeContextManager:
@@ -268,8 +268,8 @@ class ChatCompletionRequest(BaseModel):
     # define
     request_type: Literal["chat"] = "chat"
 
-    # knowledge base chat
-    knowledge_name: Optional[str] = None
+    # knowledge base chat, one knowledge base or a list of knowledge bases searched together
+    knowledge_name: Optional[Union[str, List[str]]] = None
 
 
 class DocSumChatCompletionRequest(BaseModel):
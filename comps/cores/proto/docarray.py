@@ -101,7 +101,7 @@ class EmbedDoc(BaseDoc):
     fetch_k: int = 20
     lambda_mult: float = 0.5
     score_threshold: float = 0.2
-    knowledge_name: Optional[str] = None
+    knowledge_name: Optional[Union[str, List[str]]] = None
     constraints: Optional[Union[Dict[str, Any], List[Dict[str, Any]], None]] = None
 
 
@@ -136,6 +136,8 @@ class SearchedDoc(BaseDoc):
     retrieved_docs: DocList[TextDoc]
     initial_query: str
     top_n: int = 1
+    # optional per-document metadata aligned with retrieved_docs (chunk id, parent id, file, position)
+    metadata: Optional[List[Dict[str, Any]]] = None
 
     class Config:
         json_encoders = {np.ndarray: lambda x: x.tolist()}
@@ -245,7 +247,7 @@ class RetrieverParms(BaseDoc):
     fetch_k: int = 20
     lambda_mult: float = 0.5
     score_threshold: float = 0.2
-    knowledge_name: Optional[str] = None
+    knowledge_name: Optional[Union[str, List[str]]] = None
 
 
 class RerankerParms(BaseDoc):
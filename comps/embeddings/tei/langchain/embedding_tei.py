@@ -1,6 +1,7 @@
 # Copyright (C) 2024 Intel Corporation
 # SPDX-License-Identifier: Apache-2.0
 
+import asyncio
 import json
 import os
 import time
@@ -18,7 +19,7 @@ from comps import (
     register_statistics,
     statistics_dict,
 )
-from comps.cores.mega.utils import get_access_token
+from comps.cores.mega.utils import AccessTokenCache
 from comps.cores.proto.api_protocol import (
     ChatCompletionRequest,
     EmbeddingRequest,
@@ -35,6 +36,17 @@ TOKEN_URL = os.getenv("TOKEN_URL")
 CLIENTID = os.getenv("CLIENTID")
 CLIENT_SECRET = os.getenv("CLIENT_SECRET")
 TEI_EMBEDDING_ENDPOINT = os.getenv("TEI_EMBEDDING_ENDPOINT", "http://localhost:8080")
+# concurrent requests arriving within this window are merged into one TEI call, 0 disables coalescing
+EMBEDDING_COALESCE_WINDOW_MS = float(os.getenv("EMBEDDING_COALESCE_WINDOW_MS", 5))
+# at most this many texts per merged call, keep it <= TEI's --max-client-batch-size
+EMBEDDING_COALESCE_MAX_BATCH_SIZE = int(os.getenv("EMBEDDING_COALESCE_MAX_BATCH_SIZE", 32))
+
+access_token_cache = (
+    AccessTokenCache(TOKEN_URL, CLIENTID, CLIENT_SECRET) if TOKEN_URL and CLIENTID and CLIENT_SECRET else None
+)
+# the client is reused across requests and only rebuilt when the access token changes
+_async_client = None
+_async_client_token = None
 
 
 @register_microservice(
@@ -49,18 +61,14 @@ async def embedding(
     input: Union[TextDoc, EmbeddingRequest, ChatCompletionRequest]
 ) -> Union[EmbedDoc, EmbeddingResponse, ChatCompletionRequest]:
     start = time.time()
-    access_token = (
-        get_access_token(TOKEN_URL, CLIENTID, CLIENT_SECRET) if TOKEN_URL and CLIENTID and CLIENT_SECRET else None
-    )
-    async_client = get_async_inference_client(access_token)
     if logflag:
         logger.info(input)
     if isinstance(input, TextDoc):
-        embed_vector = await aembed_query(input.text, async_client)
+        embed_vector = await coalescer.embed([input.text] if isinstance(input.text, str) else input.text)
         embedding_res = embed_vector[0] if isinstance(input.text, str) else embed_vector
         res = EmbedDoc(text=input.text, embedding=embedding_res)
     else:
-        embed_vector = await aembed_query(input.input, async_client)
+        embed_vector = await coalescer.embed([input.input] if isinstance(input.input, str) else input.input)
         if input.dimensions is not None:
             embed_vector = [embed_vector[i][: input.dimensions] for i in range(len(embed_vector))]
 
@@ -98,8 +106,82 @@ async def aembed_documents(
 
 
 def get_async_inference_client(access_token: str) -> AsyncInferenceClient:
-    headers = {"Authorization": f"Bearer {access_token}"} if access_token else {}
-    return AsyncInferenceClient(model=TEI_EMBEDDING_ENDPOINT, token=HUGGINGFACEHUB_API_TOKEN, headers=headers)
+    global _async_client, _async_client_token
+    if _async_client is None or access_token != _async_client_token:
+        headers = {"Authorization": f"Bearer {access_token}"} if access_token else {}
+        _async_client = AsyncInferenceClient(
+            model=TEI_EMBEDDING_ENDPOINT, token=HUGGINGFACEHUB_API_TOKEN, headers=headers
+        )
+        _async_client_token = access_token
+    return _async_client
+
+
+async def get_client() -> AsyncInferenceClient:
+    access_token = await access_token_cache.get() if access_token_cache else None
+    return get_async_inference_client(access_token)
+
+
+class EmbeddingCoalescer:
+    """Merges concurrent embedding requests into batched TEI calls.
+
+    The first request of a batch waits at most ``window`` seconds for others; the batch is sent
+    earlier once it holds ``max_batch_size`` texts. Every request gets back the vectors of its own
+    texts, and a failed call fails all requests of its batch. Requests with more texts than
+    ``max_batch_size`` are sent on their own.
+    """
+
+    def __init__(self, window: float, max_batch_size: int):
+        self.window = window
+        self.max_batch_size = max(1, max_batch_size)
+        self._pending = []  # (texts, future)
+        self._pending_texts = 0
+        self._flush_handle = None
+        # the event loop only keeps weak references to tasks, keep the in-flight sends alive
+        self._tasks = set()
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        if self.window <= 0 or len(texts) >= self.max_batch_size:
+            return await aembed_documents(texts, await get_client())
+        if self._pending_texts + len(texts) > self.max_batch_size:
+            self._flush()
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((texts, future))
+        self._pending_texts += len(texts)
+        if self._pending_texts >= self.max_batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        pending, self._pending, self._pending_texts = self._pending, [], 0
+        if pending:
+            task = asyncio.create_task(self._send(pending))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, pending):
+        texts = [text for request_texts, _ in pending for text in request_texts]
+        try:
+            vectors = await aembed_documents(texts, await get_client())
+        except Exception as e:
+            for _, future in pending:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        if logflag:
+            logger.info(f"coalesced {len(pending)} requests into one call of {len(texts)} texts")
+        offset = 0
+        for request_texts, future in pending:
+            if not future.done():
+                future.set_result(vectors[offset : offset + len(request_texts)])
+            offset += len(request_texts)
+
+
+coalescer = EmbeddingCoalescer(EMBEDDING_COALESCE_WINDOW_MS / 1000, EMBEDDING_COALESCE_MAX_BATCH_SIZE)
 
 
 if __name__ == "__main__":
@@ -4,6 +4,7 @@
 import asyncio
 import math
 import os
+import threading
 from enum import Enum
 from pathlib import Path
 from typing import Union
@@ -36,6 +37,9 @@ PAD_SEQUENCE_TO_MULTIPLE_OF = int(os.environ.get("PAD_SEQUENCE_TO_MULTIPLE_OF",
 EMBEDDING_MODEL_ID = os.environ.get("EMBEDDING_MODEL_ID", "BAAI/bge-base-en-v1.5")
 RERANK_MODEL_ID = os.environ.get("RERANK_MODEL_ID", "BAAI/bge-reranker-base")
 
+# embedding and reranking batches are scheduled concurrently but share one device
+device_lock = threading.Lock()
+
 
 def round_up(number, k):
     return (number + k - 1) // k * k
@@ -112,10 +116,31 @@ def pad_batch(inputs: dict, max_input_len: int):
     return inputs
 
 
+def dynamic_batching_bucket(service_type: Enum, request):
+    # batches are padded to a multiple of PAD_SEQUENCE_TO_MULTIPLE_OF, group requests of similar length;
+    # the length in characters is a cheap proxy of the token length
+    if service_type == ServiceType.EMBEDDING:
+        length = len(request.text)
+    elif service_type == ServiceType.RERANK:
+        length = len(request.initial_query) + max((len(doc.text) for doc in request.retrieved_docs), default=0)
+    else:
+        return None
+    return length // PAD_SEQUENCE_TO_MULTIPLE_OF
+
+
 async def dynamic_batching_infer(service_type: Enum, batch: list[dict]):
     if logflag:
         logger.info(f"{service_type} {len(batch)} request inference begin >>>")
+    # run the model off the event loop, so batches of both service types and new requests are handled meanwhile
+    return await asyncio.to_thread(batch_infer, service_type, batch)
 
+
+def batch_infer(service_type: Enum, batch: list[dict]):
+    with device_lock:
+        return _batch_infer(service_type, batch)
+
+
+def _batch_infer(service_type: Enum, batch: list[dict]):
     if service_type == ServiceType.EMBEDDING:
         sentences = [req["request"].text for req in batch]
 
@@ -184,13 +209,10 @@ async def embedding(
 
     # if logflag:
     #     logger.info(input)
-    # Create a future for this specific request
-    response_future = asyncio.get_event_loop().create_future()
-
     cur_microservice = opea_microservices["opea_service@local_embedding_reranking"]
     cur_microservice.dynamic_batching_infer = dynamic_batching_infer
-    async with cur_microservice.buffer_lock:
-        cur_microservice.request_buffer[ServiceType.EMBEDDING].append({"request": input, "response": response_future})
+    cur_microservice.dynamic_batching_bucket = dynamic_batching_bucket
+    response_future = cur_microservice.submit_batch_request(ServiceType.EMBEDDING, input)
 
     # Wait for batch inference to complete and return results
     result = await response_future
@@ -218,13 +240,10 @@ async def reranking(input: SearchedDoc) -> LLMParamsDoc:
     if len(input.retrieved_docs) == 0:
         return LLMParamsDoc(query=input.initial_query)
 
-    # Create a future for this specific request
-    response_future = asyncio.get_event_loop().create_future()
-
     cur_microservice = opea_microservices["opea_service@local_embedding_reranking"]
     cur_microservice.dynamic_batching_infer = dynamic_batching_infer
-    async with cur_microservice.buffer_lock:
-        cur_microservice.request_buffer[ServiceType.RERANK].append({"request": input, "response": response_future})
+    cur_microservice.dynamic_batching_bucket = dynamic_batching_bucket
+    response_future = cur_microservice.submit_batch_request(ServiceType.RERANK, input)
 
     # Wait for batch inference to complete and return results
     result = await response_future
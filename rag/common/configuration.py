@@ -18,12 +18,48 @@ class EmbeddingConfig:
         self.mosec_embedding_model = get_env_var("MOSEC_EMBEDDING_MODEL", default="")
         self.tei_embedding_endpoint = get_env_var("TEI_EMBEDDING_ENDPOINT", default="http://127.0.0.1:6006")
         self.local_embedding_model = get_env_var("LOCAL_EMBEDDING_MODEL", default="")
+        self.cache_enabled = get_env_var("EMBEDDING_CACHE_ENABLED", default="true", cast=bool)
+        self.cache_path = get_env_var("EMBEDDING_CACHE_PATH", default="")
+        self.cache_namespace = get_env_var("EMBEDDING_CACHE_NAMESPACE", default="")
+        self.cache_lru_size = get_env_var("EMBEDDING_CACHE_LRU_SIZE", default=10000, cast=int)
 
 
 class VectorStoreConfig:
     def __init__(self):
         self.vector_store_type = get_env_var("VECTOR_STORE_TYPE", default="milvus")
+        # 进程内缓存的向量库句柄数量上限及空闲淘汰时间(秒)
+        self.cache_size = get_env_var("VECTOR_STORE_CACHE_SIZE", default=64, cast=int)
+        self.idle_seconds = get_env_var("VECTOR_STORE_IDLE_SECONDS", default=1800, cast=int)
+        # 淘汰句柄时是否从向量库服务端卸载集合；集合可能仍被其他进程或进行中的检索使用，默认只丢弃本进程的句柄
+        self.release_on_evict = get_env_var("VECTOR_STORE_RELEASE_ON_EVICT", default="false", cast=bool)
+        # 异步检索的并发上限
+        self.search_concurrency = get_env_var("VECTOR_STORE_SEARCH_CONCURRENCY", default=16, cast=int)
+        # 关键词(BM25)索引，用于 hybrid 检索；索引目录为空时使用 {DATA_ROOT_PATH}/keyword_index
+        self.keyword_index_enabled = get_env_var("KEYWORD_INDEX_ENABLED", default="true", cast=bool)
+        self.keyword_index_path = get_env_var("KEYWORD_INDEX_PATH", default="")
+        # 关键词索引与向量库文档数的核对间隔(秒)，连续两次不一致时从向量库重建索引；0 表示不核对
+        self.keyword_index_refresh_seconds = get_env_var("KEYWORD_INDEX_REFRESH_SECONDS", default=60, cast=int)
+        self.bm25_k1 = get_env_var("BM25_K1", default=1.2, cast=float)
+        self.bm25_b = get_env_var("BM25_B", default=0.75, cast=float)
+        # small-to-big 检索的父块存储，父块不做向量化；目录为空时使用 {DATA_ROOT_PATH}/parent_store
+        self.parent_store_enabled = get_env_var("PARENT_STORE_ENABLED", default="true", cast=bool)
+        self.parent_store_path = get_env_var("PARENT_STORE_PATH", default="")
+        # 每个知识库在进程内缓存的父块数量
+        self.parent_store_cache_size = get_env_var("PARENT_STORE_CACHE_SIZE", default=10000, cast=int)
+        # 倒数排名融合的平滑常数
+        self.hybrid_rrf_k = get_env_var("HYBRID_RRF_K", default=60, cast=int)
+        # 一次请求联合检索多个知识库时的数量上限，以及各知识库分数的归一化方式：raw / minmax / zscore / rrf，
+        # 默认 raw 直接比较原始分数；逐个知识库归一化的方式只在各知识库分数不可比时使用，见 federation.NORMALIZATIONS
+        self.federated_max_knowledge = get_env_var("FEDERATED_MAX_KNOWLEDGE", default=8, cast=int)
+        self.federated_normalization = get_env_var("FEDERATED_SCORE_NORMALIZATION", default="raw")
+        # 新建知识库默认的向量量化方式：none / int8 / pq，可在创建知识库时单独指定
+        self.quantization = get_env_var("VECTOR_STORE_QUANTIZATION", default="none")
+        # 量化索引召回 top_k 的多少倍候选，再用原始向量重新打分；0 表示 int8 取 4 倍、pq 取 32 倍
+        self.rescore_oversample = get_env_var("VECTOR_STORE_RESCORE_OVERSAMPLE", default=0, cast=int)
+        # PQ 子空间个数，0 表示每 8 维一个子空间
+        self.pq_m = get_env_var("VECTOR_STORE_PQ_M", default=0, cast=int)
         self.milvus = VectorStoreMilvusConfig()
+        self.local = VectorStoreLocalConfig()
 
 
 class VectorStoreMilvusConfig:
@@ -37,6 +73,22 @@ class VectorStoreMilvusConfig:
             "search_params": {"metric_type": "IP"},
             "index_params": {"metric_type": "IP", "index_type": "HNSW", "params": {"M": 8, "efConstruction": 64}}
         }
+        # 量化知识库使用 IVF_SQ8 / IVF_PQ 索引的聚类数及检索时扫描的聚类数
+        self.ivf_nlist = get_env_var("MILVUS_IVF_NLIST", default=1024, cast=int)
+        self.ivf_nprobe = get_env_var("MILVUS_IVF_NPROBE", default=32, cast=int)
+
+
+class VectorStoreLocalConfig:
+    """VECTOR_STORE_TYPE=local 时使用的进程内向量库"""
+    def __init__(self):
+        # 数据目录，为空时使用 {DATA_ROOT_PATH}/vector_store
+        self.path = get_env_var("LOCAL_VECTOR_STORE_PATH", default="")
+        # 向量数达到该值后建立 IVF 索引，此前精确检索
+        self.ivf_min_rows = get_env_var("LOCAL_VECTOR_STORE_IVF_MIN_ROWS", default=50000, cast=int)
+        # 检索时扫描的聚类数
+        self.nprobe = get_env_var("LOCAL_VECTOR_STORE_NPROBE", default=32, cast=int)
+        # 已删除向量的比例超过该值时压缩数据文件
+        self.compact_ratio = get_env_var("LOCAL_VECTOR_STORE_COMPACT_RATIO", default=0.3, cast=float)
 
 
 class LLMConfig:
@@ -51,11 +103,22 @@ class ServerConfig:
     def __init__(self):
         self.host = get_env_var("SERVER_HOST", default="localhost")
         self.port = get_env_var("SERVER_PORT", default=8000, cast=int)
+        # ChatQnA 网关答案缓存的失效接口，逗号分隔，如 http://chatqna:8888/v1/chatqna/cache
+        self.answer_cache_invalidate_urls = [url.strip() for url in
+                                             get_env_var("SEMANTIC_CACHE_INVALIDATE_URLS", default="").split(",")
+                                             if url.strip()]
 
 
 class DatabaseConfig:
     def __init__(self):
         self.sqlalchemy_database_uri = get_env_var("SQLALCHEMY_DATABASE_URI", default="")
+        # 只读副本地址，用于列表、统计等只读查询，为空时使用主库
+        self.sqlalchemy_read_database_uri = get_env_var("SQLALCHEMY_READ_DATABASE_URI", default="")
+        self.pool_size = get_env_var("DB_POOL_SIZE", default=10, cast=int)
+        self.max_overflow = get_env_var("DB_MAX_OVERFLOW", default=20, cast=int)
+        self.pool_timeout = get_env_var("DB_POOL_TIMEOUT", default=30, cast=int)
+        self.pool_recycle = get_env_var("DB_POOL_RECYCLE", default=1800, cast=int)
+        self.sqlite_busy_timeout = get_env_var("DB_SQLITE_BUSY_TIMEOUT", default=30000, cast=int)
 
 
 class SplitterConfig:
@@ -64,6 +127,42 @@ class SplitterConfig:
         self.chunk_overlap = get_env_var("CHUNK_OVERLAP", default=100, cast=int)
         self.smaller_chunk_size = get_env_var("SMALLER_CHUNK_SIZE", default=0, cast=int)
         self.splitter_name = get_env_var("SPLITTER_NAME", default="ChineseRecursiveTextSplitter")
+        # ChineseRecursiveTextSplitter 按该分词器的 token 数计算块大小（HuggingFace 名称或本地路径），为空时按字符数
+        self.tokenizer = get_env_var("SPLITTER_TOKENIZER", default="")
+
+
+class IndexingConfig:
+    def __init__(self):
+        self.load_workers = get_env_var("INDEXING_LOAD_WORKERS", default=4, cast=int)
+        self.embed_workers = get_env_var("INDEXING_EMBED_WORKERS", default=4, cast=int)
+        self.upsert_workers = get_env_var("INDEXING_UPSERT_WORKERS", default=2, cast=int)
+        self.embed_batch_size = get_env_var("INDEXING_EMBED_BATCH_SIZE", default=16, cast=int)
+        self.queue_size = get_env_var("INDEXING_QUEUE_SIZE", default=8, cast=int)
+
+
+class OcrConfig:
+    def __init__(self):
+        self.workers = get_env_var("OCR_WORKERS", default=2, cast=int)
+        self.use_cuda = get_env_var("OCR_USE_CUDA", default="true", cast=bool)
+
+
+class CrawlerConfig:
+    def __init__(self):
+        self.concurrency = get_env_var("CRAWLER_CONCURRENCY", default=16, cast=int)
+        self.per_host_concurrency = get_env_var("CRAWLER_PER_HOST_CONCURRENCY", default=4, cast=int)
+        self.crawl_delay = get_env_var("CRAWLER_CRAWL_DELAY", default=0.0, cast=float)
+        self.respect_robots = get_env_var("CRAWLER_RESPECT_ROBOTS", default="true", cast=bool)
+        self.user_agent = get_env_var("CRAWLER_USER_AGENT", default="Mozilla/5.0 (compatible; LiteRAGBot/1.0)")
+        self.timeout = get_env_var("CRAWLER_TIMEOUT", default=20, cast=int)
+        self.max_retries = get_env_var("CRAWLER_MAX_RETRIES", default=3, cast=int)
+        self.batch_size = get_env_var("CRAWLER_BATCH_SIZE", default=50, cast=int)
+        self.index_workers = get_env_var("CRAWLER_INDEX_WORKERS", default=4, cast=int)
+        self.worker_id = get_env_var("CRAWLER_WORKER_ID", default="")
+        self.lease_seconds = get_env_var("CRAWLER_LEASE_SECONDS", default=600, cast=int)
+        self.url_max_retries = get_env_var("CRAWLER_URL_MAX_RETRIES", default=3, cast=int)
+        self.retry_backoff = get_env_var("CRAWLER_RETRY_BACKOFF", default=60, cast=int)
+        # 已完成的URL超过该秒数后重新排队爬取，页面未变化时服务端返回 304，不再重新索引；0 表示不重新爬取
+        self.recrawl_interval = get_env_var("CRAWLER_RECRAWL_INTERVAL", default=0, cast=int)
 
 
 class Configuration:
@@ -75,6 +174,9 @@ class Configuration:
         self.database = DatabaseConfig()
         self.data_root_path = get_env_var("DATA_ROOT_PATH", default=DATA_ROOT_PATH)
         self.splitter = SplitterConfig()
+        self.indexing = IndexingConfig()
+        self.ocr = OcrConfig()
+        self.crawler = CrawlerConfig()
 
 
 config = Configuration()
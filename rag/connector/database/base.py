@@ -1,10 +1,14 @@
 import os
 import json
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, inspect
+from sqlalchemy.engine import Engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from comps import CustomLogger
 from rag.common.configuration import config
 
+logger = CustomLogger(__name__)
+
 Base = declarative_base()
 
 # 数据库默认存储路径
@@ -23,20 +27,102 @@ if config.database.sqlalchemy_database_uri == "":
 else:
     SQLALCHEMY_DATABASE_URI = config.database.sqlalchemy_database_uri
 
+SQLALCHEMY_READ_DATABASE_URI = config.database.sqlalchemy_read_database_uri
+
 print(f"sql uri:{SQLALCHEMY_DATABASE_URI}")
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL 模式下读写互不阻塞；写锁冲突时等待 busy_timeout 而不是立即报 database is locked
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute(f"PRAGMA busy_timeout={config.database.sqlite_busy_timeout}")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+
 class DB:
+    @staticmethod
+    def create_engine(uri: str) -> Engine:
+        """
+        创建数据库引擎。
+
+        SQLite 连接启用 WAL、busy_timeout 与 synchronous=NORMAL，允许跨线程使用连接；
+        其他数据库使用可配置大小的连接池，并在取出连接时检测连接是否可用。
+        """
+        kwargs = {"json_serializer": lambda obj: json.dumps(obj, ensure_ascii=False)}
+        if uri.startswith("sqlite"):
+            kwargs["connect_args"] = {"check_same_thread": False,
+                                      "timeout": config.database.sqlite_busy_timeout / 1000}
+        else:
+            kwargs.update(pool_size=config.database.pool_size,
+                          max_overflow=config.database.max_overflow,
+                          pool_timeout=config.database.pool_timeout,
+                          pool_recycle=config.database.pool_recycle,
+                          pool_pre_ping=True)
+        new_engine = create_engine(uri, **kwargs)
+        if uri.startswith("sqlite"):
+            event.listen(new_engine, "connect", _set_sqlite_pragmas)
+        return new_engine
+
     @staticmethod
     def get_engine():
         """获取数据库引擎"""
-        return create_engine(
-            SQLALCHEMY_DATABASE_URI,
-            json_serializer=lambda obj: json.dumps(obj, ensure_ascii=False),
-        )
+        return engine
+
+    @staticmethod
+    def get_read_engine():
+        """获取只读查询使用的数据库引擎，未配置只读副本时与主库相同"""
+        return read_engine
 
     @staticmethod
     def create_tables(engine):
-        """创建数据库表格"""
+        """创建数据库表格，并为已有的表补上模型中新增的列、回填数据并补建索引"""
+        existing_tables = set(inspect(engine).get_table_names())
         Base.metadata.create_all(bind=engine)
+        DB.add_missing_columns(engine)
+        DB.migrate_existing_tables(engine, existing_tables)
+
+    @staticmethod
+    def add_missing_columns(engine):
+        """
+        create_all 不会修改已有的表，模型新增的列在这里用 ALTER TABLE 补上。
+
+        新增的列须允许为空，已有的行取 NULL，由读取方按默认值处理。
+        """
+        inspector = inspect(engine)
+        existing_tables = set(inspector.get_table_names())
+        with engine.begin() as conn:
+            for table in Base.metadata.sorted_tables:
+                if table.name not in existing_tables:
+                    continue
+                existing = {column["name"] for column in inspector.get_columns(table.name)}
+                for column in table.columns:
+                    if column.name in existing:
+                        continue
+                    column_type = column.type.compile(dialect=engine.dialect)
+                    conn.exec_driver_sql(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}")
+                    logger.info(f"add column {table.name}.{column.name}")
+
+    @staticmethod
+    def migrate_existing_tables(engine, existing_tables):
+        """
+        升级已有的表：先执行模型在 __table_args__ 的 info["migrations"] 中声明的迁移函数（回填新增列、
+        清理违反新唯一索引的数据），再补建模型中新增的索引，create_all 不会为已有的表建索引。
+
+        迁移函数接收数据库连接，须可重复执行，每次启动都会调用。
+        """
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            with engine.begin() as conn:
+                for migration in table.info.get("migrations", ()):
+                    migration(conn)
+            existing_indexes = {index["name"] for index in inspect(engine).get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    index.create(bind=engine)
+                    logger.info(f"create index {table.name}.{index.name}")
 
     @staticmethod
     def get_session():
@@ -45,5 +131,7 @@ class DB:
 
 
 # 获取数据库引擎和会话类
-engine = DB.get_engine()
+engine = DB.create_engine(SQLALCHEMY_DATABASE_URI)
+read_engine = DB.create_engine(SQLALCHEMY_READ_DATABASE_URI) if SQLALCHEMY_READ_DATABASE_URI else engine
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+ReadOnlySessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
@@ -13,6 +13,7 @@ class KnowledgeBaseModel(Base):
     kb_info = Column(String(200), comment='知识库简介')
     vs_type = Column(String(50), comment='向量库类型')
     embed_model = Column(String(50), comment='嵌入模型类型')
+    vs_quantization = Column(String(20), default='none', comment='向量量化方式：none/int8/pq')
     file_count = Column(Integer, default=0, comment='文件数量')
     weburl = Column(String(500), comment='网页URL')
     scraping_level = Column(Integer, default=1, comment='URL爬取深度')
@@ -21,4 +22,4 @@ class KnowledgeBaseModel(Base):
     update_time = Column(DateTime, default=func.now(), onupdate=func.now(), comment='更新时间')
 
     def __repr__(self):
-        return f"<KnowledgeBase(id='{self.id}', kb_name='{self.kb_name}',kb_intro='{self.kb_info} vs_type='{self.vs_type}', embed_model='{self.embed_model}', file_count='{self.file_count}', weburl='{self.weburl}', scraping_level='{self.scraping_level}', create_time='{self.create_time}')>"
+        return f"<KnowledgeBase(id='{self.id}', kb_name='{self.kb_name}',kb_intro='{self.kb_info} vs_type='{self.vs_type}', vs_quantization='{self.vs_quantization}', embed_model='{self.embed_model}', file_count='{self.file_count}', weburl='{self.weburl}', scraping_level='{self.scraping_level}', create_time='{self.create_time}')>"
@@ -1,16 +1,36 @@
-from sqlalchemy import Column, Integer, String, DateTime, Float, Boolean, JSON, func
+from sqlalchemy import Column, Integer, String, DateTime, Float, Boolean, JSON, Index, func
 from rag.connector.database.base import Base
 
+
+def normalize_name(name: str) -> str:
+    """知识库名、文件名的规范化形式，用于不区分大小写的精确匹配"""
+    return name.lower() if name else name
+
+
+def _backfill_norm_columns(table_name: str):
+    """升级前写入的行没有规范化名称，按 lower() 回填后才能被查询到"""
+    def migrate(conn):
+        conn.exec_driver_sql(f"UPDATE {table_name} SET kb_name_norm = lower(kb_name), "
+                             f"file_name_norm = lower(file_name) WHERE kb_name_norm IS NULL")
+    return migrate
+
+
 class KnowledgeFileModel(Base):
     """
     知识文件模型
     """
     __tablename__ = 'knowledge_file'
+    __table_args__ = (
+        Index('ix_knowledge_file_kb_file', 'kb_name_norm', 'file_name_norm'),
+        {"info": {"migrations": [_backfill_norm_columns('knowledge_file')]}},
+    )
     
     id = Column(Integer, primary_key=True, autoincrement=True, comment='知识文件ID')
     file_name = Column(String(255), comment='文件名')
     file_ext = Column(String(10), comment='文件扩展名')
     kb_name = Column(String(50), comment='所属知识库名称')
+    kb_name_norm = Column(String(50), comment='规范化的知识库名称，用于查询')
+    file_name_norm = Column(String(255), comment='规范化的文件名，用于查询')
     type = Column(String(20), default='file', comment='文件类型(file/url)')
     document_loader_name = Column(String(50), comment='文档加载器名称')
     text_splitter_name = Column(String(50), comment='文本分割器名称')
@@ -19,6 +39,7 @@ class KnowledgeFileModel(Base):
     file_size = Column(Integer, default=0, comment="文件大小")
     custom_docs = Column(Boolean, default=False, comment="是否自定义docs")
     docs_count = Column(Integer, default=0, comment="切分文档数量")
+    content_hash = Column(String(64), default="", comment="文件内容及切分参数哈希，用于增量索引")
     create_time = Column(DateTime, default=func.now(), comment='创建时间')
     update_time = Column(DateTime, default=func.now(), onupdate=func.now(), comment='更新时间')
 
@@ -31,10 +52,17 @@ class FileDocModel(Base):
     文件-向量库文档模型
     """
     __tablename__ = 'file_doc'
+    __table_args__ = (
+        Index('ix_file_doc_kb_file', 'kb_name_norm', 'file_name_norm'),
+        {"info": {"migrations": [_backfill_norm_columns('file_doc')]}},
+    )
     id = Column(Integer, primary_key=True, autoincrement=True, comment='ID')
     kb_name = Column(String(50), comment='知识库名称')
     file_name = Column(String(255), comment='文件名称')
+    kb_name_norm = Column(String(50), comment='规范化的知识库名称，用于查询')
+    file_name_norm = Column(String(255), comment='规范化的文件名，用于查询')
     doc_id = Column(String(50), comment="向量库文档ID")
+    chunk_hash = Column(String(64), default="", comment="文档块内容哈希，用于增量索引")
     meta_data = Column(JSON, default={})
 
     def __repr__(self):
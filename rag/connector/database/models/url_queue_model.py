@@ -1,7 +1,11 @@
-from sqlalchemy import Column, Integer, String, DateTime, Enum, func
+from sqlalchemy import Column, Integer, String, DateTime, Enum, Index, bindparam, func, inspect, select
+from comps import CustomLogger
+from rag.common.utils import md5_encryption
 from rag.connector.database.base import Base
 import enum
 
+logger = CustomLogger(__name__)
+
 
 class URLStatus(enum.Enum):
     PENDING = "pending"    # 等待爬取
@@ -10,19 +14,63 @@ class URLStatus(enum.Enum):
     FAILED = "failed"      # 爬取失败
 
 
+def _migrate_url_hash(conn):
+    """
+    升级前写入的行没有 url_hash：按 URL 回填，再清理同一知识库中重复的 URL，之后才能建立唯一索引。
+
+    重复的 URL 保留已完成的一行，其次保留最早入队的一行。
+    """
+    table = URLQueueModel.__table__
+    missing = conn.execute(select(table.c.id, table.c.url).where(table.c.url_hash.is_(None))).all()
+    if missing:
+        conn.execute(table.update().where(table.c.id == bindparam("row_id")).values(url_hash=bindparam("hash")),
+                     [{"row_id": row_id, "hash": md5_encryption(url or "")} for row_id, url in missing])
+    if "uq_url_queue_kb_url_hash" in {index["name"] for index in inspect(conn).get_indexes(table.name)}:
+        return
+    kept, duplicates = {}, []
+    rows = conn.execute(select(table.c.id, table.c.kb_name, table.c.url_hash, table.c.status)
+                        .order_by(table.c.id)).all()
+    for row_id, kb_name, url_hash, status in rows:
+        key = (kb_name, url_hash)
+        if key not in kept:
+            kept[key] = (row_id, status)
+        elif status == URLStatus.COMPLETED and kept[key][1] != URLStatus.COMPLETED:
+            duplicates.append(kept[key][0])
+            kept[key] = (row_id, status)
+        else:
+            duplicates.append(row_id)
+    for i in range(0, len(duplicates), 500):
+        conn.execute(table.delete().where(table.c.id.in_(duplicates[i:i + 500])))
+    if duplicates:
+        logger.info(f"removed {len(duplicates)} duplicated urls from url_queue")
+
+
 class URLQueueModel(Base):
     """
     URL爬取队列模型
     """
     __tablename__ = 'url_queue'
+    __table_args__ = (
+        # 同一知识库中的URL只入队一次，批量插入发现的链接时依赖该唯一索引去重
+        Index('uq_url_queue_kb_url_hash', 'kb_name', 'url_hash', unique=True),
+        Index('ix_url_queue_status_next_attempt', 'status', 'next_attempt_time'),
+        {"info": {"migrations": [_migrate_url_hash]}},
+    )
     
     id = Column(Integer, primary_key=True, autoincrement=True, comment='队列ID')
     kb_name = Column(String(50), comment='所属知识库名称')
     url = Column(String(500), comment='待爬取URL')
+    url_hash = Column(String(32), comment='URL的MD5哈希')
     scraping_level = Column(Integer, default=0, comment='剩余爬取深度')
     link_tags = Column(String(500), comment='链接标签，用于过滤子URL，多个标签用逗号分隔')
     status = Column(Enum(URLStatus), default=URLStatus.PENDING, comment='爬取状态')
     error_msg = Column(String(500), nullable=True, comment='错误信息')
+    etag = Column(String(255), nullable=True, comment='上次抓取返回的ETag，用于条件请求')
+    last_modified = Column(String(64), nullable=True, comment='上次抓取返回的Last-Modified，用于条件请求')
+    worker_id = Column(String(100), nullable=True, comment='持有租约的爬虫工作进程ID')
+    lease_expire_time = Column(DateTime, nullable=True, comment='租约过期时间，过期后URL可被其他工作进程重新领取')
+    retry_count = Column(Integer, default=0, comment='已重试次数')
+    next_attempt_time = Column(DateTime, nullable=True, comment='下次可领取时间，用于失败重试退避')
     create_time = Column(DateTime, default=func.now(), comment='创建时间')
     update_time = Column(DateTime, default=func.now(), onupdate=func.now(), comment='更新时间')
 
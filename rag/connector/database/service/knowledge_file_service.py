@@ -1,26 +1,37 @@
 from rag.connector.database.models.knowledge_base_model import KnowledgeBaseModel
-from rag.connector.database.models.knowledge_file_model import KnowledgeFileModel, FileDocModel
-from rag.connector.database.session import with_session
+from rag.connector.database.models.knowledge_file_model import KnowledgeFileModel, FileDocModel, normalize_name
+from rag.connector.database.session import with_read_session, with_session
 from rag.module.knowledge_file import KnowledgeFile
+from sqlalchemy import insert
 
 from typing import List, Dict
 
+# 批量写入文档记录时每批的行数
+_INSERT_BATCH_SIZE = 1000
+
+
+def _file_filter(model, kb_name: str, file_name: str = None) -> list:
+    """按规范化名称精确匹配，命中 (kb_name_norm, file_name_norm) 组合索引"""
+    conditions = [model.kb_name_norm == normalize_name(kb_name)]
+    if file_name:
+        conditions.append(model.file_name_norm == normalize_name(file_name))
+    return conditions
+
 
 class KnowledgeFileService:
     @with_session
     def delete_files_from_db(self, session, knowledge_base_name: str):
-        session.query(KnowledgeFileModel).filter(KnowledgeFileModel.kb_name.ilike(knowledge_base_name)).delete(synchronize_session=False)
-        session.query(FileDocModel).filter(FileDocModel.kb_name.ilike(knowledge_base_name)).delete(synchronize_session=False)
+        session.query(KnowledgeFileModel).filter(*_file_filter(KnowledgeFileModel, knowledge_base_name)).delete(synchronize_session=False)
+        session.query(FileDocModel).filter(*_file_filter(FileDocModel, knowledge_base_name)).delete(synchronize_session=False)
         kb = session.query(KnowledgeBaseModel).filter(KnowledgeBaseModel.kb_name.ilike(knowledge_base_name)).first()
         if kb:
             kb.file_count = 0
-        session.commit()
         return True
 
 
-    @with_session
+    @with_read_session
     def list_files_from_db(self, session, knowledge_base_name: str) -> List[Dict]:
-        db_files = session.query(KnowledgeFileModel).filter(KnowledgeFileModel.kb_name.ilike(knowledge_base_name)).all()
+        db_files = session.query(KnowledgeFileModel).filter(*_file_filter(KnowledgeFileModel, knowledge_base_name)).all()
         files = []
         for f in db_files:
             file = {
@@ -45,15 +56,18 @@ class KnowledgeFileService:
                           ) -> List[Dict]:
         '''
         列出某知识库某文件对应的所有Document。
-        返回形式：[{"id": str, "metadata": dict}, ...]
+        返回形式：[{"id": str, "metadata": dict, "chunk_hash": str}, ...]
         '''
-        docs = session.query(FileDocModel).filter(FileDocModel.kb_name.ilike(kb_name))
-        if file_name:
-            docs = docs.filter(FileDocModel.file_name.ilike(file_name))
+        return self._list_docs(session, kb_name, file_name, metadata)
+
+    def _list_docs(self, session, kb_name: str, file_name: str = None, metadata: Dict = {}) -> List[Dict]:
+        docs = session.query(FileDocModel.doc_id, FileDocModel.meta_data, FileDocModel.chunk_hash) \
+            .filter(*_file_filter(FileDocModel, kb_name, file_name))
         for k, v in metadata.items():
             docs = docs.filter(FileDocModel.meta_data[k].as_string()==str(v))
 
-        return [{"id": x.doc_id, "metadata": x.metadata} for x in docs.all()]
+        return [{"id": doc_id, "metadata": meta_data, "chunk_hash": chunk_hash}
+                for doc_id, meta_data, chunk_hash in docs.all()]
 
     @with_session
     def delete_docs_from_db(self, session,
@@ -64,30 +78,27 @@ class KnowledgeFileService:
         删除某知识库某文件对应的所有Document，并返回被删除的Document。
         返回形式：[{"id": str, "metadata": dict}, ...]
         '''
-        docs = self.list_docs_from_db(kb_name=kb_name, file_name=file_name)
-        query = session.query(FileDocModel).filter(FileDocModel.kb_name.ilike(kb_name))
-        if file_name:
-            query = query.filter(FileDocModel.file_name.ilike(file_name))
-        query.delete(synchronize_session=False)
-        session.commit()
+        docs = self._list_docs(session, kb_name, file_name)
+        self._delete_docs(session, kb_name, file_name)
         return docs
 
+    def _delete_docs(self, session, kb_name: str, file_name: str = None):
+        session.query(FileDocModel).filter(*_file_filter(FileDocModel, kb_name, file_name)) \
+            .delete(synchronize_session=False)
+
 
     @with_session
     def delete_file_from_db(self, session, kb_file: KnowledgeFile):
         existing_file = (session.query(KnowledgeFileModel)
-                         .filter(KnowledgeFileModel.file_name.ilike(kb_file.filename),
-                                KnowledgeFileModel.kb_name.ilike(kb_file.knowledge_name))
-                        .first())
+                         .filter(*_file_filter(KnowledgeFileModel, kb_file.knowledge_name, kb_file.filename))
+                         .first())
         if existing_file:
             session.delete(existing_file)
-            self.delete_docs_from_db(kb_name=kb_file.knowledge_name, file_name=kb_file.filename)
-            session.commit()
+            self._delete_docs(session, kb_file.knowledge_name, kb_file.filename)
 
             kb = session.query(KnowledgeBaseModel).filter(KnowledgeBaseModel.kb_name.ilike(kb_file.knowledge_name)).first()
             if kb:
                 kb.file_count -= 1
-                session.commit()
         return True
 
 
@@ -96,14 +107,23 @@ class KnowledgeFileService:
                     kb_file: KnowledgeFile,
                     docs_count: int = 0,
                     custom_docs: bool = False,
+                    content_hash: str = "",
                     ):
+        return self._upsert_file(session, kb_file, docs_count, custom_docs, content_hash)
+
+    def _upsert_file(self, session,
+                     kb_file: KnowledgeFile,
+                     docs_count: int = 0,
+                     custom_docs: bool = False,
+                     content_hash: str = "") -> bool:
         kb = session.query(KnowledgeBaseModel).filter_by(kb_name=kb_file.knowledge_name).first()
         if kb:
             # 如果已经存在该文件，则更新文件信息与版本号
             existing_file: KnowledgeFileModel = (session.query(KnowledgeFileModel)
-                                                 .filter(KnowledgeFileModel.kb_name.ilike(kb_file.knowledge_name),
-                                                         KnowledgeFileModel.file_name.ilike(kb_file.filename))
-                                                .first())
+                                                 .filter(*_file_filter(KnowledgeFileModel,
+                                                                       kb_file.knowledge_name,
+                                                                       kb_file.filename))
+                                                 .first())
             mtime = kb_file.get_mtime()
             size = kb_file.get_size()
 
@@ -113,6 +133,7 @@ class KnowledgeFileService:
                 existing_file.docs_count = docs_count
                 existing_file.custom_docs = custom_docs
                 existing_file.type = kb_file.get_type()
+                existing_file.content_hash = content_hash
                 existing_file.file_version += 1
             # 否则，添加新文件
             else:
@@ -120,6 +141,8 @@ class KnowledgeFileService:
                     file_name=kb_file.filename,
                     file_ext=kb_file.ext,
                     kb_name=kb_file.knowledge_name,
+                    kb_name_norm=normalize_name(kb_file.knowledge_name),
+                    file_name_norm=normalize_name(kb_file.filename),
                     type=kb_file.get_type(),
                     document_loader_name=kb_file.document_loader.__name__,
                     text_splitter_name=kb_file.text_splitter.__name__,
@@ -127,6 +150,7 @@ class KnowledgeFileService:
                     file_size=size,
                     docs_count=docs_count,
                     custom_docs=custom_docs,
+                    content_hash=content_hash,
                 )
                 kb.file_count += 1
                 session.add(new_file)
@@ -142,26 +166,61 @@ class KnowledgeFileService:
         将某知识库某文件对应的所有Document信息添加到数据库。
         doc_infos形式：[{"id": str, "metadata": dict}, ...]
         '''
+        return self._insert_docs(session, kb_name, file_name, doc_infos)
+
+    def _insert_docs(self, session, kb_name: str, file_name: str, doc_infos: List[Dict]) -> bool:
         #! 这里会出现doc_infos为None的情况，需要进一步排查
         if doc_infos is None:
             print("输入的server.db.service.knowledge_file_repository.add_docs_to_db的doc_infos参数为None")
             return False
-        for d in doc_infos:
-            obj = FileDocModel(
-                kb_name=kb_name,
-                file_name=file_name,
-                doc_id=d["id"],
-                meta_data=d["metadata"],
-            )
-            session.add(obj)
+        kb_name_norm, file_name_norm = normalize_name(kb_name), normalize_name(file_name)
+        rows = [{
+            "kb_name": kb_name,
+            "file_name": file_name,
+            "kb_name_norm": kb_name_norm,
+            "file_name_norm": file_name_norm,
+            "doc_id": d["id"],
+            "chunk_hash": d["metadata"].get("chunk_hash", ""),
+            "meta_data": d["metadata"],
+        } for d in doc_infos]
+        # 按批 executemany 写入，不逐行构造 ORM 对象
+        for i in range(0, len(rows), _INSERT_BATCH_SIZE):
+            session.execute(insert(FileDocModel), rows[i:i + _INSERT_BATCH_SIZE])
         return True
 
 
     @with_session
+    def replace_file_in_db(self, session,
+                           kb_file: KnowledgeFile,
+                           docs_count: int = 0,
+                           doc_infos: List[Dict] = None,
+                           content_hash: str = "",
+                           custom_docs: bool = False):
+        '''
+        在一个事务中更新文件记录，并用 doc_infos 替换该文件的全部Document记录。
+        doc_infos形式：[{"id": str, "metadata": dict}, ...]
+        '''
+        self._delete_docs(session, kb_file.knowledge_name, kb_file.filename)
+        return self._upsert_file(session, kb_file, docs_count, custom_docs, content_hash) and \
+            self._insert_docs(session, kb_file.knowledge_name, kb_file.filename, doc_infos or [])
+
+
+    @with_session
+    def get_file_content_hash(self, session, kb_name: str, filename: str) -> str:
+        '''
+        获取某知识库某文件上次索引时记录的内容哈希，文件不存在时返回空字符串。
+        '''
+        content_hash = (session.query(KnowledgeFileModel.content_hash)
+                        .filter(*_file_filter(KnowledgeFileModel, kb_name, filename))
+                        .limit(1)
+                        .scalar())
+        return content_hash or ""
+
+
+    @with_read_session
     def get_file_detail(self, session, kb_name: str, filename: str) -> dict:
         file: KnowledgeFileModel = (session.query(KnowledgeFileModel)
-                                    .filter(KnowledgeFileModel.file_name.ilike(filename),
-                                            KnowledgeFileModel.kb_name.ilike(kb_name))
+                                    .filter(*_file_filter(KnowledgeFileModel, kb_name, filename))
                                     .first())
         if file:
             return {
@@ -176,6 +235,7 @@ class KnowledgeFileService:
                 "file_size": file.file_size,
                 "custom_docs": file.custom_docs,
                 "docs_count": file.docs_count,
+                "content_hash": file.content_hash,
             }
         else:
             return {}
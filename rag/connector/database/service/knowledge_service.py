@@ -1,6 +1,6 @@
 from comps.cores.mega.logger import CustomLogger
 from rag.connector.database.models.knowledge_base_model import KnowledgeBaseModel
-from rag.connector.database.session import with_session
+from rag.connector.database.session import with_read_session, with_session
 from typing import Optional, List, Tuple
 from rag.connector.database.service.url_queue_service import URLQueueService
 
@@ -11,7 +11,7 @@ class KnowledgeService:
     def __init__(self):
         self.url_queue_service = URLQueueService()
 
-    @with_session
+    @with_read_session
     def list_kbs_from_db(self, session, min_file_count: int = -1) -> List[str]:
         """获取知识库列表"""
         kbs = session.query(KnowledgeBaseModel.kb_name).filter(
@@ -29,7 +29,8 @@ class KnowledgeService:
         embed_model: str,
         weburl: Optional[str] = "",
         scraping_level: int = 1,
-        link_tags: Optional[str] = ""
+        link_tags: Optional[str] = "",
+        vs_quantization: Optional[str] = None
     ) -> bool:
         """添加或更新知识库"""
         kb = session.query(KnowledgeBaseModel).filter(
@@ -44,7 +45,8 @@ class KnowledgeService:
                 embed_model=embed_model,
                 weburl=weburl,
                 scraping_level=scraping_level,
-                link_tags=link_tags
+                link_tags=link_tags,
+                vs_quantization=vs_quantization or "none"
             )
             session.add(kb)
         else:
@@ -54,6 +56,9 @@ class KnowledgeService:
             kb.weburl = weburl
             kb.scraping_level = scraping_level
             kb.link_tags = link_tags
+            # 已有知识库的量化方式需清空后重建，更新时不提供则保持不变
+            if vs_quantization:
+                kb.vs_quantization = vs_quantization
 
         # 如果提供了weburl，添加到爬取队列
         if weburl and scraping_level > 0:
@@ -74,6 +79,7 @@ class KnowledgeService:
                 'kb_name': kb.kb_name,
                 'kb_info': kb.kb_info,
                 'vs_type': kb.vs_type,
+                'vs_quantization': kb.vs_quantization or 'none',
                 'embed_model': kb.embed_model,
                 'weburl': kb.weburl,
                 'scraping_level': kb.scraping_level,
@@ -1,9 +1,36 @@
-from typing import List, Optional
-from sqlalchemy import and_
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from sqlalchemy import and_, bindparam, func, insert, or_, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from rag.common.utils import md5_encryption
 from rag.connector.database.models.url_queue_model import URLQueueModel, URLStatus
-from rag.connector.database.session import with_session
+from rag.connector.database.session import with_read_session, with_session
 import re
 
+# 批量插入时每条语句包含的行数，避免超过数据库的参数个数上限
+_INSERT_BATCH_SIZE = 100
+# error_msg 列长度
+_ERROR_MSG_LENGTH = 500
+
+
+def _url_hash(url: str) -> str:
+    return md5_encryption(url)
+
+
+def _to_dict(item: URLQueueModel) -> dict:
+    return {
+        'id': item.id,
+        'url': item.url,
+        'kb_name': item.kb_name,
+        'scraping_level': item.scraping_level,
+        'link_tags': item.link_tags,
+        'status': item.status,
+        'etag': item.etag,
+        'last_modified': item.last_modified,
+        'retry_count': item.retry_count or 0
+    }
+
 
 class URLQueueService:
     """
@@ -31,7 +58,7 @@ class URLQueueService:
         existing = session.query(URLQueueModel).filter(
             and_(
                 URLQueueModel.kb_name == kb_name,
-                URLQueueModel.url == url
+                URLQueueModel.url_hash == _url_hash(url)
             )
         ).first()
         
@@ -40,6 +67,7 @@ class URLQueueService:
             queue_item = URLQueueModel(
                 kb_name=kb_name,
                 url=url,
+                url_hash=_url_hash(url),
                 scraping_level=scraping_level,
                 link_tags=link_tags,  # 保存link_tags到数据库
                 status=URLStatus.PENDING
@@ -50,6 +78,225 @@ class URLQueueService:
         return False
 
     @with_session
+    def add_urls_to_queue(
+        self,
+        session,
+        kb_name: str,
+        urls: List[str],
+        scraping_level: int,
+        link_tags: Optional[str] = None
+    ) -> None:
+        """
+        批量添加URL到爬取队列，已在队列中的URL由 (kb_name, url_hash) 唯一索引去重
+        Args:
+            kb_name: 知识库名称
+            urls: 待爬取URL列表
+            scraping_level: 剩余爬取深度
+            link_tags: URL过滤标签(可选)
+        """
+        rows = {}
+        for url in urls:
+            rows.setdefault(_url_hash(url), {
+                'kb_name': kb_name,
+                'url': url,
+                'url_hash': _url_hash(url),
+                'scraping_level': scraping_level,
+                'link_tags': link_tags,
+                'status': URLStatus.PENDING
+            })
+        if not rows:
+            return
+
+        dialect = session.get_bind().dialect.name
+        if dialect == 'sqlite':
+            stmt = sqlite_insert(URLQueueModel).on_conflict_do_nothing(index_elements=['kb_name', 'url_hash'])
+        elif dialect == 'postgresql':
+            stmt = postgresql_insert(URLQueueModel).on_conflict_do_nothing(index_elements=['kb_name', 'url_hash'])
+        elif dialect in ('mysql', 'mariadb'):
+            stmt = insert(URLQueueModel).prefix_with('IGNORE')
+        else:
+            existing = {url_hash for (url_hash,) in session.query(URLQueueModel.url_hash).filter(
+                URLQueueModel.kb_name == kb_name,
+                URLQueueModel.url_hash.in_(list(rows.keys()))
+            )}
+            rows = {key: row for key, row in rows.items() if key not in existing}
+            stmt = insert(URLQueueModel)
+
+        values = list(rows.values())
+        for i in range(0, len(values), _INSERT_BATCH_SIZE):
+            session.execute(stmt.values(values[i:i + _INSERT_BATCH_SIZE]))
+
+    def _reclaim_expired_leases(self, session, now: datetime, max_retries: int) -> None:
+        """回收租约已过期的URL：工作进程可能已崩溃，计一次重试后重新排队，超过重试次数则标记为失败"""
+        expired = and_(
+            URLQueueModel.status == URLStatus.RUNNING,
+            URLQueueModel.lease_expire_time < now
+        )
+        session.execute(
+            update(URLQueueModel)
+            .where(expired, func.coalesce(URLQueueModel.retry_count, 0) + 1 >= max_retries)
+            .values(status=URLStatus.FAILED,
+                    retry_count=func.coalesce(URLQueueModel.retry_count, 0) + 1,
+                    error_msg='lease expired',
+                    worker_id=None,
+                    lease_expire_time=None)
+        )
+        session.execute(
+            update(URLQueueModel)
+            .where(expired)
+            .values(status=URLStatus.PENDING,
+                    retry_count=func.coalesce(URLQueueModel.retry_count, 0) + 1,
+                    worker_id=None,
+                    lease_expire_time=None)
+        )
+
+    @with_session
+    def claim_urls(
+        self,
+        session,
+        worker_id: str,
+        limit: int = 10,
+        lease_seconds: int = 600,
+        max_retries: int = 3,
+        kb_name: Optional[str] = None
+    ) -> List[dict]:
+        """
+        领取一批待处理URL并加租约
+        Args:
+            worker_id: 爬虫工作进程ID
+            limit: 领取的最大URL数量
+            lease_seconds: 租约时长(秒)，超时未完成的URL会被重新领取
+            max_retries: 最大重试次数
+            kb_name: 知识库名称（可选）
+        Returns:
+            List[dict]: 本次成功领取的URL信息
+        """
+        now = datetime.now()
+        self._reclaim_expired_leases(session, now, max_retries)
+
+        claimable = and_(
+            URLQueueModel.status == URLStatus.PENDING,
+            or_(URLQueueModel.next_attempt_time.is_(None), URLQueueModel.next_attempt_time <= now)
+        )
+        query = session.query(URLQueueModel.id).filter(claimable)
+        if kb_name:
+            query = query.filter(URLQueueModel.kb_name == kb_name)
+        candidate_ids = [url_id for (url_id,) in query.order_by(URLQueueModel.id).limit(limit)]
+        if not candidate_ids:
+            return []
+
+        # 条件更新：只有仍处于可领取状态的行会被更新，并发领取同一行时只有一个工作进程成功
+        lease_expire_time = now + timedelta(seconds=lease_seconds)
+        session.execute(
+            update(URLQueueModel)
+            .where(URLQueueModel.id.in_(candidate_ids), claimable)
+            .values(status=URLStatus.RUNNING,
+                    worker_id=worker_id,
+                    lease_expire_time=lease_expire_time)
+        )
+        # 不按租约时间回查：MySQL 的 DATETIME 不保存微秒，写入后的值与 lease_expire_time 不相等
+        claimed = session.query(URLQueueModel).filter(
+            URLQueueModel.id.in_(candidate_ids),
+            URLQueueModel.status == URLStatus.RUNNING,
+            URLQueueModel.worker_id == worker_id
+        ).all()
+        return [_to_dict(item) for item in claimed]
+
+    @with_session
+    def finish_urls(
+        self,
+        session,
+        results: List[dict],
+        worker_id: str,
+        max_retries: int = 3,
+        retry_backoff: int = 60
+    ) -> None:
+        """
+        批量更新已处理URL的状态并释放租约
+        Args:
+            results: 处理结果列表，形式：[{"id": int, "status": URLStatus, "error_msg": str,
+                     "etag": str, "last_modified": str, "retry": bool}, ...]
+                     失败且 retry 为 True 的URL按指数退避重新排队，超过最大重试次数后标记为失败
+            worker_id: 领取这些URL的爬虫工作进程ID，租约已过期并被其他工作进程重新领取的URL不会被更新
+            max_retries: 最大重试次数
+            retry_backoff: 首次重试的等待时间(秒)
+        """
+        table = URLQueueModel.__table__
+        now = datetime.now()
+        completed = [{
+            'row_id': result['id'],
+            'holder': worker_id,
+            'etag': result.get('etag'),
+            'last_modified': result.get('last_modified')
+        } for result in results if result['status'] == URLStatus.COMPLETED]
+        if completed:
+            session.execute(
+                table.update()
+                .where(table.c.id == bindparam('row_id'),
+                       table.c.worker_id == bindparam('holder'),
+                       table.c.status == URLStatus.RUNNING)
+                .values(status=URLStatus.COMPLETED,
+                        error_msg=None,
+                        etag=bindparam('etag'),
+                        last_modified=bindparam('last_modified'),
+                        worker_id=None,
+                        lease_expire_time=None,
+                        next_attempt_time=None,
+                        # 与 requeue_completed_urls 比较的完成时间，和租约时间一样取本机时间
+                        update_time=now),
+                completed
+            )
+
+        failed = {result['id']: result for result in results if result['status'] != URLStatus.COMPLETED}
+        if not failed:
+            return
+        for item in session.query(URLQueueModel).filter(URLQueueModel.id.in_(list(failed.keys())),
+                                                        URLQueueModel.worker_id == worker_id,
+                                                        URLQueueModel.status == URLStatus.RUNNING):
+            result = failed[item.id]
+            item.retry_count = (item.retry_count or 0) + 1
+            item.error_msg = (result.get('error_msg') or '')[:_ERROR_MSG_LENGTH]
+            item.worker_id = None
+            item.lease_expire_time = None
+            if result.get('retry', True) and item.retry_count < max_retries:
+                item.status = URLStatus.PENDING
+                item.next_attempt_time = now + timedelta(seconds=retry_backoff * 2 ** (item.retry_count - 1))
+            else:
+                item.status = URLStatus.FAILED
+
+    @with_session
+    def requeue_completed_urls(
+        self,
+        session,
+        kb_name: Optional[str] = None,
+        older_than: int = 0
+    ) -> int:
+        """
+        把已完成的URL重新排队，用于定期重新爬取
+        保留上次抓取的 ETag / Last-Modified，重新抓取时发送条件请求，页面未变化时不再下载和索引
+        Args:
+            kb_name: 知识库名称（可选，仅重新爬取特定知识库的URL）
+            older_than: 只重新排队完成时间早于该秒数之前的URL，0 表示全部
+        Returns:
+            int: 重新排队的URL数量
+        """
+        conditions = [URLQueueModel.status == URLStatus.COMPLETED]
+        if kb_name:
+            conditions.append(URLQueueModel.kb_name == kb_name)
+        if older_than > 0:
+            conditions.append(URLQueueModel.update_time <= datetime.now() - timedelta(seconds=older_than))
+        result = session.execute(
+            update(URLQueueModel)
+            .where(*conditions)
+            .values(status=URLStatus.PENDING,
+                    retry_count=0,
+                    error_msg=None,
+                    next_attempt_time=None,
+                    update_time=datetime.now())
+        )
+        return result.rowcount
+
+    @with_read_session
     def get_pending_urls(
         self,
         session,
@@ -73,14 +320,7 @@ class URLQueueService:
             
         pending = query.limit(limit).all()
         # 在session活跃时获取所有需要的数据
-        return [{
-            'id': item.id,
-            'url': item.url,
-            'kb_name': item.kb_name,
-            'scraping_level': item.scraping_level,
-            'link_tags': item.link_tags,
-            'status': item.status
-        } for item in pending]
+        return [_to_dict(item) for item in pending]
 
     @with_session
     def update_url_status(
@@ -88,7 +328,9 @@ class URLQueueService:
         session,
         url_id: int,
         status: URLStatus,
-        error_msg: Optional[str] = None
+        error_msg: Optional[str] = None,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None
     ) -> bool:
         """
         更新URL状态
@@ -96,12 +338,18 @@ class URLQueueService:
             url_id: URL队列项ID
             status: 新状态
             error_msg: 错误信息（如果有）
+            etag: 页面ETag（如果有）
+            last_modified: 页面Last-Modified（如果有）
         """
         queue_item = session.query(URLQueueModel).get(url_id)
         if queue_item:
             queue_item.status = status
             if error_msg:
                 queue_item.error_msg = error_msg
+            if etag:
+                queue_item.etag = etag
+            if last_modified:
+                queue_item.last_modified = last_modified
             return True
         return False
 
@@ -118,7 +366,7 @@ class URLQueueService:
         query.delete()
         return True
 
-    @with_session
+    @with_read_session
     def get_completed_urls(self, session, kb_name: str) -> List[dict]:
         """
         获取已完成的URL列表
@@ -136,7 +384,7 @@ class URLQueueService:
         # 在session活跃时获取所有需要的数据
         return [{'url': item.url, 'id': item.id} for item in completed]
 
-    @with_session
+    @with_read_session
     def get_failed_urls(self, session, kb_name: str) -> List[dict]:
         """
         获取失败的URL列表及错误信息
@@ -154,7 +402,7 @@ class URLQueueService:
         # 在session活跃时获取所有需要的数据
         return [{'url': item.url, 'error': item.error_msg, 'id': item.id} for item in failed]
 
-    @with_session
+    @with_read_session
     def get_queue_stats(self, session, kb_name: Optional[str] = None) -> dict:
         """
         获取队列统计信息
@@ -163,16 +411,17 @@ class URLQueueService:
         Returns:
             dict: 包含各状态URL数量的统计信息
         """
-        query = session.query(URLQueueModel)
+        query = session.query(URLQueueModel.status, func.count(URLQueueModel.id))
         if kb_name:
             query = query.filter(URLQueueModel.kb_name == kb_name)
-            
-        total = query.count()
+
+        # 一次分组查询统计各状态数量
+        counts: Dict[URLStatus, int] = dict(query.group_by(URLQueueModel.status).all())
         stats = {
-            'total': total,
-            'pending': query.filter(URLQueueModel.status == URLStatus.PENDING).count(),
-            'running': query.filter(URLQueueModel.status == URLStatus.RUNNING).count(),
-            'completed': query.filter(URLQueueModel.status == URLStatus.COMPLETED).count(),
-            'failed': query.filter(URLQueueModel.status == URLStatus.FAILED).count()
+            'total': sum(counts.values()),
+            'pending': counts.get(URLStatus.PENDING, 0),
+            'running': counts.get(URLStatus.RUNNING, 0),
+            'completed': counts.get(URLStatus.COMPLETED, 0),
+            'failed': counts.get(URLStatus.FAILED, 0)
         }
         return stats
@@ -1,12 +1,17 @@
+from contextvars import ContextVar
 from functools import wraps
 from contextlib import contextmanager
+from typing import Optional
 
 from comps import CustomLogger
-from rag.connector.database.base import SessionLocal
+from rag.connector.database.base import ReadOnlySessionLocal, SessionLocal
 from sqlalchemy.orm import Session
 
 logger = CustomLogger(__name__)
 
+# 当前线程/协程中正在进行的事务会话，嵌套调用的服务方法复用该会话
+_current_session: ContextVar[Optional[Session]] = ContextVar("current_session", default=None)
+
 @contextmanager
 def transaction_scope() -> Session:
     """
@@ -21,8 +26,15 @@ def transaction_scope() -> Session:
     Yields:
         Session: 一个数据库会话对象，用于执行数据库操作。
     """
+    # 已处于事务中时直接复用，由最外层的事务范围负责提交或回滚
+    current = _current_session.get()
+    if current is not None:
+        yield current
+        return
+
     # 创建一个数据库会话实例
     session = SessionLocal()
+    token = _current_session.set(session)
     try:
         # 使用yield语法将控制权交还给调用者，调用者可以使用session执行数据库操作
         yield session
@@ -36,10 +48,42 @@ def transaction_scope() -> Session:
         # 将异常重新抛出，以便调用者可以捕获和处理
         raise
     finally:
+        _current_session.reset(token)
         # 无论是否发生异常，都关闭数据库会话
         session.close()
 
 
+@contextmanager
+def read_only_scope() -> Session:
+    """
+    创建一个只读会话的上下文管理器。
+
+    会话绑定只读引擎（配置了只读副本时连接副本），退出时回滚而不提交。
+    已处于事务中时复用当前事务会话，保证能读到本事务尚未提交的写入。
+
+    Yields:
+        Session: 一个只读数据库会话对象。
+    """
+    current = _current_session.get()
+    if current is not None:
+        yield current
+        return
+
+    session = ReadOnlySessionLocal()
+    try:
+        yield session
+    finally:
+        session.rollback()
+        session.close()
+
+
+def _call(f, session, args, kwargs):
+    # 检测是否是类方法，传递 self 参数
+    if hasattr(f, "__self__") or (len(args) > 0 and hasattr(args[0], "__dict__")):
+        return f(args[0], session, *args[1:], **kwargs)
+    return f(session, *args, **kwargs)
+
+
 
 def with_session(f):
     """
@@ -67,14 +111,18 @@ def with_session(f):
         返回:
         result: 被装饰函数的执行结果。
         """
+        # 嵌套在其他事务中调用时复用外层会话，不单独提交
+        if _current_session.get() is not None:
+            with transaction_scope() as session:
+                result = _call(f, session, args, kwargs)
+                # 刷新到数据库，使同一事务中后续的查询能看到本次写入
+                session.flush()
+                return result
+
         # 使用上下文管理器创建一个事务会话
         with transaction_scope() as session:
             try:
-                # 检测是否是类方法，传递 self 参数
-                if hasattr(f, "__self__") or (len(args) > 0 and hasattr(args[0], "__dict__")):
-                    result = f(args[0], session, *args[1:], **kwargs)
-                else:
-                    result = f(session, *args, **kwargs)
+                result = _call(f, session, args, kwargs)
                 # 提交会话
                 session.commit()
                 return result
@@ -88,3 +136,22 @@ def with_session(f):
 
     return wrapper
 
+
+def with_read_session(f):
+    """
+    为只读查询函数自动管理只读会话的装饰器，用于列表、统计等接口。
+    在事务中调用时复用当前事务会话。
+
+    参数:
+    f: 被装饰的函数或方法。
+
+    返回:
+    wrapper: 包装后的函数。
+    """
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        with read_only_scope() as session:
+            return _call(f, session, args, kwargs)
+
+    return wrapper
+
@@ -0,0 +1,149 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from comps import CustomLogger, measure_stage
+
+logger = CustomLogger("cached_embeddings")
+
+# SQLite 单条语句的参数个数上限为 999
+_SQLITE_BATCH_SIZE = 500
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    带缓存的 Embeddings 包装器。
+
+    以 (模型命名空间, 文本sha256) 为键缓存向量，内存 LRU 为一级缓存，SQLite 文件为二级缓存，
+    多个进程（dataprep、crawler、retriever）可以共享同一个缓存文件。
+    只有两级缓存都未命中的文本才会请求底层 embedding 服务，同一批次中的重复文本只请求一次。
+    """
+
+    def __init__(self,
+                 underlying: Embeddings,
+                 namespace: str,
+                 cache_path: str,
+                 lru_size: int = 10000):
+        self.underlying = underlying
+        self.namespace = namespace
+        self.cache_path = cache_path
+        self.lru_size = lru_size
+        self._lru: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if not os.path.exists(os.path.dirname(cache_path)):
+            os.makedirs(os.path.dirname(cache_path))
+        self._conn = sqlite3.connect(cache_path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS embedding_cache (
+                namespace TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                PRIMARY KEY (namespace, text_hash)
+            ) WITHOUT ROWID
+        """)
+        self._conn.commit()
+
+    @staticmethod
+    def _hash(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _lru_get(self, key: str) -> Optional[List[float]]:
+        vector = self._lru.get(key)
+        if vector is not None:
+            self._lru.move_to_end(key)
+        return vector
+
+    def _lru_put(self, key: str, vector: List[float]):
+        self._lru[key] = vector
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.lru_size:
+            self._lru.popitem(last=False)
+
+    def _disk_get(self, namespace: str, keys: List[str]) -> Dict[str, List[float]]:
+        found = {}
+        for i in range(0, len(keys), _SQLITE_BATCH_SIZE):
+            batch = keys[i:i + _SQLITE_BATCH_SIZE]
+            placeholders = ",".join("?" * len(batch))
+            rows = self._conn.execute(
+                f"SELECT text_hash, vector FROM embedding_cache "
+                f"WHERE namespace = ? AND text_hash IN ({placeholders})",
+                [namespace, *batch]).fetchall()
+            for text_hash, blob in rows:
+                found[text_hash] = np.frombuffer(blob, dtype=np.float32).tolist()
+        return found
+
+    def _disk_put(self, namespace: str, items: Dict[str, List[float]]):
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO embedding_cache (namespace, text_hash, vector) VALUES (?, ?, ?)",
+            [(namespace, key, np.asarray(vector, dtype=np.float32).tobytes()) for key, vector in items.items()])
+        self._conn.commit()
+
+    def _embed_with_cache(self, texts: List[str], namespace: str, embed_func) -> List[List[float]]:
+        keys = [self._hash(text) for text in texts]
+        resolved: Dict[str, List[float]] = {}  # text_hash: vector
+
+        with self._lock:
+            missing = {}  # text_hash: text
+            for key, text in zip(keys, texts):
+                if key in resolved or key in missing:
+                    continue
+                vector = self._lru_get(f"{namespace}:{key}")
+                if vector is not None:
+                    self.memory_hits += 1
+                    resolved[key] = vector
+                else:
+                    missing[key] = text
+
+            if missing:
+                found = self._disk_get(namespace, list(missing.keys()))
+                self.disk_hits += len(found)
+                for key, vector in found.items():
+                    self._lru_put(f"{namespace}:{key}", vector)
+                    resolved[key] = vector
+                    missing.pop(key)
+
+        if missing:
+            missing_keys = list(missing.keys())
+            with measure_stage("embed"):
+                computed = dict(zip(missing_keys, embed_func([missing[key] for key in missing_keys])))
+            with self._lock:
+                self.misses += len(computed)
+                self._disk_put(namespace, computed)
+                for key, vector in computed.items():
+                    self._lru_put(f"{namespace}:{key}", vector)
+            resolved.update(computed)
+            logger.debug(f"embedding cache stats: {self.stats()}")
+
+        return [resolved[key] for key in keys]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._embed_with_cache(texts, self.namespace, self.underlying.embed_documents)
+
+    def embed_query(self, text: str) -> List[float]:
+        # 部分模型对 query 会追加指令前缀，与文档向量分开缓存
+        return self._embed_with_cache([text], f"{self.namespace}:query",
+                                      lambda texts: [self.underlying.embed_query(texts[0])])[0]
+
+    def stats(self) -> Dict:
+        """返回缓存命中统计"""
+        total = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "namespace": self.namespace,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.memory_hits + self.disk_hits) / total if total else None,
+            "lru_size": len(self._lru),
+        }
@@ -1,41 +1,116 @@
+import os
 from functools import lru_cache
+from typing import Optional
 
+import requests
 from langchain_community.embeddings import HuggingFaceBgeEmbeddings, HuggingFaceEmbeddings
 from comps import CustomLogger
 from rag.connector.embedding.hashable_huggingface_endpoint import HashableHuggingFaceEndpointEmbeddings
 from rag.connector.embedding.mosec_embeddings import MosecEmbeddings
+from rag.connector.embedding.cached_embeddings import CachedEmbeddings
+from rag.common.configuration import config
+from rag.connector.database.service.knowledge_service import KnowledgeService
 from rag.connector.vectorstore.base import VectorStore
-from rag.connector.vectorstore import MilvusVectorStore
+from rag.connector.vectorstore import LocalVectorStore, MilvusVectorStore
+from rag.connector.vectorstore.registry import VectorStoreRegistry
 from langchain_core.embeddings import Embeddings
 
 logger = CustomLogger("rag_connector_utils")
 
+
+def _tei_namespace(tei_embedding_endpoint) -> str:
+    """
+    TEI 服务的 embedding 缓存命名空间，取自 /info 返回的模型名与版本。
+
+    同一个服务地址背后更换模型后，缓存随之切换；/info 不可用时退回到服务地址。
+    """
+    try:
+        response = requests.get(f"{tei_embedding_endpoint.rstrip('/')}/info", timeout=10)
+        response.raise_for_status()
+        info = response.json()
+        model_id = info["model_id"]
+    except Exception as e:
+        logger.warning(f"get model info from {tei_embedding_endpoint} failed, "
+                       f"using the endpoint as embedding cache namespace: {e}")
+        return f"tei:{tei_embedding_endpoint}"
+    model_sha = info.get("model_sha")
+    return f"tei:{model_id}@{model_sha}" if model_sha else f"tei:{model_id}"
+
 @lru_cache
 def get_embedding_model(embedding_type, mosec_embedding_model, mosec_embedding_endpoint, tei_embedding_endpoint, local_embedding_model) -> Embeddings:
     """Create the embedding model."""
     if embedding_type == "MOSEC":
-        return MosecEmbeddings(model=mosec_embedding_model)
+        embedding_model = MosecEmbeddings(model=mosec_embedding_model)
+        namespace = f"mosec:{mosec_embedding_model}"
     elif embedding_type == "TEI":
-        return HashableHuggingFaceEndpointEmbeddings(model=tei_embedding_endpoint)
+        embedding_model = HashableHuggingFaceEndpointEmbeddings(model=tei_embedding_endpoint)
+        namespace = None
     elif embedding_type == "LOCAL":
         if any([key_word in local_embedding_model for key_word in ["bge"]]):
-            return HuggingFaceBgeEmbeddings(model_name=local_embedding_model)
+            embedding_model = HuggingFaceBgeEmbeddings(model_name=local_embedding_model)
         else:
-            return HuggingFaceEmbeddings(model_name=local_embedding_model)
+            embedding_model = HuggingFaceEmbeddings(model_name=local_embedding_model)
+        namespace = f"local:{local_embedding_model}"
     else:
         raise RuntimeError("Unable to find any supported embedding model.")
 
-@lru_cache
-def get_vectorstore(knowledge_name,
-                    vs_type,
-                    embedding_model
-                    ) -> VectorStore:
-    """Get the vectorstore"""
+    if not config.embedding.cache_enabled:
+        return embedding_model
+    cache_path = config.embedding.cache_path or os.path.join(config.data_root_path,
+                                                             "embedding_cache",
+                                                             "embedding_cache.db")
+    # EMBEDDING_CACHE_NAMESPACE 优先，TEI 的命名空间只在启用缓存且未指定时查询
+    namespace = config.embedding.cache_namespace or namespace or _tei_namespace(tei_embedding_endpoint)
+    logger.info(f"Using embedding cache {cache_path} with namespace {namespace}")
+    return CachedEmbeddings(underlying=embedding_model,
+                            namespace=namespace,
+                            cache_path=cache_path,
+                            lru_size=config.embedding.cache_lru_size)
+
+def _knowledge_quantization(knowledge_name) -> Optional[str]:
+    """
+    知识库登记的向量量化方式，只在新建集合时使用。
+
+    查不到时返回 None，由向量库沿用已有数据的量化方式（检索服务可能不连接知识库数据库）。
+    """
+    try:
+        kb = KnowledgeService().load_kb_from_db(knowledge_name)
+    except Exception as e:
+        logger.warning(f"load quantization of {knowledge_name} failed: {e}")
+        return None
+    return kb["vs_quantization"] if kb else None
+
+
+def _create_vectorstore(knowledge_name, vs_type, embedding_model) -> VectorStore:
     vectorstore = None
     logger.info(f"Using {vs_type} as db to create vectorstore")
+    quantization = _knowledge_quantization(knowledge_name)
     if vs_type == "milvus":
-        vectorstore = MilvusVectorStore(embedding_model=embedding_model, collection_name=knowledge_name)
+        vectorstore = MilvusVectorStore(embedding_model=embedding_model, collection_name=knowledge_name,
+                                        quantization=quantization)
+    elif vs_type == "local":
+        vectorstore = LocalVectorStore(embedding_model=embedding_model, collection_name=knowledge_name,
+                                       quantization=quantization)
     else:
         raise ValueError(f"{vs_type} vector database is not supported")
     logger.info("Vector store created")
     return vectorstore
+
+
+vectorstore_registry = VectorStoreRegistry(factory=_create_vectorstore,
+                                           max_size=config.vector_store.cache_size,
+                                           idle_seconds=config.vector_store.idle_seconds,
+                                           release_on_evict=config.vector_store.release_on_evict)
+
+
+def get_vectorstore(knowledge_name,
+                    vs_type,
+                    embedding_model
+                    ) -> VectorStore:
+    """Get the vectorstore"""
+    return vectorstore_registry.get(knowledge_name, vs_type, embedding_model)
+
+
+def invalidate_vectorstore(knowledge_name):
+    """Drop cached vectorstore handles of a knowledge base after it is dropped or cleared"""
+    vectorstore_registry.invalidate(knowledge_name)
@@ -1 +1,2 @@
-from .milvus import MilvusVectorStore
\ No newline at end of file
+from .milvus import MilvusVectorStore
+from .local import LocalVectorStore
@@ -1,4 +1,23 @@
+import asyncio
+import os
+import threading
+import time
+import uuid
 from abc import ABC, abstractmethod
+
+from comps import CustomLogger
+from rag.common.configuration import config
+from rag.common.utils import md5_encryption
+from rag.connector.vectorstore.executor import get_search_executor
+from rag.connector.vectorstore.keyword_index import reciprocal_rank_fusion
+from rag.connector.vectorstore.parent_store import get_parent_store, is_parent_chunk
+
+logger = CustomLogger("vectorstore")
+
+# 保护各向量库关键词索引检查的调度状态
+_keyword_check_lock = threading.Lock()
+
+
 class VectorStore(ABC):
     """Abstract base class for vector store implementations.
 
@@ -32,18 +51,41 @@ class VectorStore(ABC):
         It is useful for resetting the store while maintaining the underlying structure.
         """
 
+    def release(self):
+        """Releases resources held for this vector store.
+
+        Called when the handle is evicted from the per-process registry, only if
+        ``VECTOR_STORE_RELEASE_ON_EVICT`` is enabled: server-side resources such as loaded
+        collections are shared with other processes and with searches still in flight, so
+        by default evicting a handle only drops it. Implementations backed by a server may
+        free server-side resources here; the default implementation does nothing.
+        """
+
     @abstractmethod
-    def add_doc(self, file, docs):
+    def add_doc(self, file, docs, **kwargs):
         """Adds documents to the vector store.
 
         Args:
             file (str): The name of the file to which the documents belong.
             docs (list): A list of documents to be added to the vector store.
+            **kwargs: Additional keyword arguments. ``embeddings`` holds precomputed vectors
+                aligned with ``docs``; when given, the documents are not embedded again.
 
         This method should process the documents and add them to the specified file within
         the vector store.
         """
 
+    @abstractmethod
+    def embed_docs(self, docs):
+        """Embeds documents with the vector store's embedding model.
+
+        Args:
+            docs (list): A list of documents to be embedded.
+
+        Returns:
+            A list of vectors aligned with ``docs``, suitable for ``add_doc(..., embeddings=...)``.
+        """
+
     @abstractmethod
     def delete_doc(self, filename):
         """Deletes a document from the vector store.
@@ -54,6 +96,16 @@ class VectorStore(ABC):
         This method should remove the specified document from the vector store.
         """
 
+    @abstractmethod
+    def delete_doc_by_ids(self, ids):
+        """Deletes documents from the vector store by their ids.
+
+        Args:
+            ids (list): The ids of the documents to be deleted.
+
+        This method is used by incremental indexing to drop only the chunks that changed.
+        """
+
     @abstractmethod
     def update_doc(self, file, docs):
         """Updates documents in the vector store.
@@ -93,6 +145,21 @@ class VectorStore(ABC):
             A list of documents that are similar to the specified vector.
         """
 
+    @abstractmethod
+    def search_docs_by_vector_with_score(self, embedding, top_k, threshold, **kwargs):
+        """Searches for documents similar to the specified vector, keeping their scores.
+
+        Args:
+            embedding (list): The vector embedding to compare against.
+            top_k (int): The number of top results to return.
+            threshold (float): The minimum similarity score for a document to be included in the results.
+            **kwargs: Additional keyword arguments for customizing the search.
+
+        Returns:
+            A list of ``(document, score)`` tuples ordered by score, with child chunks replaced by
+            their parents. Used when results of several stores are merged by score.
+        """
+
     @abstractmethod
     def search_docs_by_mmr(self, text, top_k, fetch_k, lambda_mult, **kwargs):
         """Searches for documents using Maximal Marginal Relevance (MMR).
@@ -108,3 +175,230 @@ class VectorStore(ABC):
             A list of documents selected based on MMR criteria.
         """
 
+    @abstractmethod
+    def search_docs_by_mmr_vector(self, embedding, top_k, fetch_k, lambda_mult, **kwargs):
+        """Searches for documents using MMR, starting from a precomputed query vector.
+
+        Args:
+            embedding (list): The query vector; the query text is not embedded again.
+            top_k (int): The number of top results to return.
+            fetch_k (int): The number of candidates fetched, together with their vectors, before applying MMR.
+            lambda_mult (float): The lambda parameter for balancing relevance and diversity in MMR.
+            **kwargs: Additional keyword arguments for customizing the search.
+
+        Returns:
+            A list of documents selected based on MMR criteria.
+        """
+
+    # BM25 keyword index, kept in sync by implementations as documents are added or deleted.
+    # None disables keyword search.
+    keyword_index = None
+    # Counts seen by the last keyword index check, see ``refresh_keyword_index``.
+    _keyword_checked_at = 0.0
+    _keyword_mismatch = None
+    _keyword_checking = False
+
+    # Key-value store of the parent chunks of small-to-big retrieval, which are not embedded.
+    # None keeps parent chunks in the vector store together with their children.
+    parent_store = None
+
+    def _load_parent_store(self):
+        vs_config = config.vector_store
+        if not vs_config.parent_store_enabled:
+            return
+        root = vs_config.parent_store_path or os.path.join(config.data_root_path, "parent_store")
+        self.parent_store = get_parent_store(self.knowledge_name, root, cache_size=vs_config.parent_store_cache_size)
+
+    def split_parent_docs(self, docs):
+        """Separates the parent chunks of small-to-big retrieval from the chunks to be embedded.
+
+        Args:
+            docs (list): Documents to be indexed.
+
+        Returns:
+            A ``(parents, others)`` tuple. ``parents`` is empty when the store has no parent store,
+            in which case parent chunks are embedded and added like any other chunk.
+        """
+        if self.parent_store is None:
+            return [], docs
+        parents, others = [], []
+        for doc in docs:
+            (parents if is_parent_chunk(doc) else others).append(doc)
+        return parents, others
+
+    def add_parent_docs(self, file, docs):
+        """Adds parent chunks to the parent store without embedding them.
+
+        Args:
+            file (str): The name of the file to which the documents belong.
+            docs (list): Parent chunks, see ``split_parent_docs``.
+
+        Returns:
+            A list of ``{"id": ..., "metadata": ...}`` dicts like ``add_doc``.
+        """
+        source = md5_encryption(file.filename)
+        doc_ids = []
+        for doc in docs:
+            doc.metadata["source"] = source
+            doc.metadata["filename"] = file.filename
+            for k, v in doc.metadata.items():
+                doc.metadata[k] = str(v)
+            doc_ids.append(doc.metadata.setdefault("id", str(uuid.uuid4())))
+        self.parent_store.add(doc_ids, docs, source=file.filename)
+        return [{"id": doc_id, "metadata": doc.metadata} for doc_id, doc in zip(doc_ids, docs)]
+
+    def get_parent_docs(self, ids):
+        """Looks parent chunks up in the parent store.
+
+        Returns:
+            A dict of id to document; ids that are not found are left out, so callers can fall
+            back to the vector store for knowledge bases indexed before the parent store existed.
+        """
+        if self.parent_store is None:
+            return {}
+        return self.parent_store.get(ids)
+
+    def get_parents(self, docs):
+        """Replaces child chunks with their parent chunks.
+
+        Args:
+            docs (list): Documents or ``(document, score)`` tuples.
+
+        The default implementation returns ``docs`` unchanged; stores that index smaller
+        child chunks for multi-vector retrieval override it.
+        """
+        return docs
+
+    def quantization_stats(self, evaluate=False):
+        """Reports how the vectors of this store are quantized.
+
+        Args:
+            evaluate (bool): Also measure recall@k on a sample of the stored vectors, which
+                costs a number of extra searches.
+
+        Returns:
+            A dict with the quantization mode, the memory needed to search compared with the
+            full-precision vectors, and recall figures. The default implementation reports
+            unquantized storage only.
+        """
+        return {"quantization": "none"}
+
+    def count_docs(self):
+        """Returns the number of chunks stored in the vector store, or None when it is unknown.
+
+        Used to detect a keyword index that has drifted from the vector store.
+        """
+        return None
+
+    def rebuild_keyword_index(self):
+        """Rebuilds the keyword index from the chunks stored in the vector store.
+
+        Implementations build the new index alongside the current one and swap it in once it is
+        complete, so searches keep using the old index meanwhile. The default implementation
+        does nothing.
+        """
+
+    def refresh_keyword_index(self):
+        """Schedules a check of the keyword index against the vector store.
+
+        The index file is shared between processes through ``DATA_ROOT_PATH``; a process that
+        does not see the writes of the others (a separate data directory, a copy restored from a
+        backup) ends up with a stale index. At most every ``KEYWORD_INDEX_REFRESH_SECONDS`` a
+        background thread compares the number of indexed chunks with ``count_docs`` and rebuilds
+        the index when the same difference is seen on two consecutive checks, so writes in
+        flight between the vector store and the index do not trigger a rebuild. The caller
+        never waits for the check or the rebuild.
+        """
+        interval = config.vector_store.keyword_index_refresh_seconds
+        if self.keyword_index is None or interval <= 0:
+            return
+        with _keyword_check_lock:
+            now = time.monotonic()
+            if self._keyword_checking or now - self._keyword_checked_at < interval:
+                return
+            self._keyword_checked_at = now
+            self._keyword_checking = True
+        threading.Thread(target=self._check_keyword_index,
+                         name=f"keyword-index-check-{self.collection_name}",
+                         daemon=True).start()
+
+    def _check_keyword_index(self):
+        try:
+            expected = self.count_docs()
+            if expected is None:
+                return
+            counts = (self.keyword_index.count(), expected)
+            if counts[0] == counts[1]:
+                self._keyword_mismatch = None
+            elif counts != self._keyword_mismatch:
+                self._keyword_mismatch = counts
+            else:
+                self._keyword_mismatch = None
+                self.rebuild_keyword_index()
+        except Exception as e:
+            logger.warning(f"keyword index check of {self.collection_name} failed: {e}")
+        finally:
+            self._keyword_checking = False
+
+    def search_docs_by_keyword(self, text, top_k, **kwargs):
+        """Searches for documents with the BM25 keyword index.
+
+        Args:
+            text (str): The query text.
+            top_k (int): The number of top results to return.
+
+        Returns:
+            A list of documents ordered by BM25 score, with child chunks replaced by their parents.
+        """
+        if self.keyword_index is None:
+            return []
+        self.refresh_keyword_index()
+        return self.get_parents(self.keyword_index.search(text, top_k))
+
+    async def asearch_docs(self, text, top_k, threshold, **kwargs):
+        """Async version of ``search_docs``.
+
+        The default implementation runs the synchronous search on the shared search executor,
+        so the event loop is not blocked and concurrent searches overlap their I/O.
+        """
+        return await get_search_executor().run(self.search_docs, text, top_k, threshold, **kwargs)
+
+    async def asearch_docs_by_vector(self, embedding, top_k, threshold, **kwargs):
+        """Async version of ``search_docs_by_vector``, see ``asearch_docs``."""
+        return await get_search_executor().run(self.search_docs_by_vector, embedding, top_k, threshold, **kwargs)
+
+    async def asearch_docs_by_vector_with_score(self, embedding, top_k, threshold, **kwargs):
+        """Async version of ``search_docs_by_vector_with_score``, see ``asearch_docs``."""
+        return await get_search_executor().run(self.search_docs_by_vector_with_score, embedding, top_k, threshold,
+                                               **kwargs)
+
+    async def asearch_docs_by_mmr(self, text, top_k, fetch_k, lambda_mult, **kwargs):
+        """Async version of ``search_docs_by_mmr``, see ``asearch_docs``."""
+        return await get_search_executor().run(self.search_docs_by_mmr, text, top_k, fetch_k, lambda_mult, **kwargs)
+
+    async def asearch_docs_by_mmr_vector(self, embedding, top_k, fetch_k, lambda_mult, **kwargs):
+        """Async version of ``search_docs_by_mmr_vector``, see ``asearch_docs``."""
+        return await get_search_executor().run(self.search_docs_by_mmr_vector, embedding, top_k, fetch_k,
+                                               lambda_mult, **kwargs)
+
+    async def asearch_docs_by_keyword(self, text, top_k, **kwargs):
+        """Async version of ``search_docs_by_keyword``, see ``asearch_docs``."""
+        return await get_search_executor().run(self.search_docs_by_keyword, text, top_k, **kwargs)
+
+    async def asearch_docs_hybrid(self, text, embedding, top_k, fetch_k, **kwargs):
+        """Searches with dense vectors and BM25 concurrently and fuses the rankings.
+
+        Args:
+            text (str): The query text, used by the keyword search.
+            embedding (list): The query vector, used by the dense search.
+            top_k (int): The number of fused results to return.
+            fetch_k (int): The number of candidates fetched from each search before fusion.
+            **kwargs: Additional keyword arguments passed to the dense search.
+
+        Returns:
+            A list of documents ordered by reciprocal rank fusion score.
+        """
+        fetch_k = max(fetch_k, top_k)
+        dense, keyword = await asyncio.gather(self.asearch_docs_by_vector(embedding, fetch_k, None, **kwargs),
+                                              self.asearch_docs_by_keyword(text, fetch_k))
+        return reciprocal_rank_fusion([dense, keyword], k=config.vector_store.hybrid_rrf_k)[:top_k]
@@ -0,0 +1,83 @@
+import asyncio
+import contextvars
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict
+
+from rag.common.configuration import config
+
+
+class SearchExecutor:
+    """
+    向量检索专用线程池。
+
+    同步的向量库客户端调用在线程池中执行，事件循环只等待结果，并发请求的网络 I/O 可以重叠；
+    线程数即并发上限，超出的请求在队列中等待，并统计排队深度与等待时间。
+    """
+
+    def __init__(self, max_workers: int = 16):
+        self.max_workers = max(1, max_workers)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                            thread_name_prefix="vectorstore-search")
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.max_queue_depth = 0
+        self.total_wait_time = 0.0
+
+    async def run(self, func: Callable, *args, **kwargs):
+        """在线程池中执行 func，返回其结果"""
+        submitted = time.perf_counter()
+        with self._lock:
+            self.queued += 1
+            self.max_queue_depth = max(self.max_queue_depth, self.queued)
+
+        def task():
+            with self._lock:
+                self.queued -= 1
+                self.running += 1
+                self.total_wait_time += time.perf_counter() - submitted
+            try:
+                return func(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self.running -= 1
+                    self.completed += 1
+
+        def on_done(future: Future):
+            # 请求在排队时被取消，任务不会执行
+            if future.cancelled():
+                with self._lock:
+                    self.queued -= 1
+
+        # 带上调用方的上下文，检索线程中仍能把各阶段耗时记到当前请求的统计上
+        future = self._executor.submit(contextvars.copy_context().run, task)
+        future.add_done_callback(on_done)
+        return await asyncio.wrap_future(future)
+
+    def stats(self) -> Dict:
+        """返回并发上限、排队深度及平均排队时间"""
+        with self._lock:
+            return {
+                "max_concurrency": self.max_workers,
+                "running": self.running,
+                "queue_depth": self.queued,
+                "max_queue_depth": self.max_queue_depth,
+                "completed": self.completed,
+                "avg_queue_wait": self.total_wait_time / self.completed if self.completed else 0.0,
+            }
+
+
+_search_executor = None
+_search_executor_lock = threading.Lock()
+
+
+def get_search_executor() -> SearchExecutor:
+    """获取进程内共享的向量检索线程池"""
+    global _search_executor
+    with _search_executor_lock:
+        if _search_executor is None:
+            _search_executor = SearchExecutor(max_workers=config.vector_store.search_concurrency)
+        return _search_executor
@@ -0,0 +1,67 @@
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+# 多知识库联合检索时各知识库分数的归一化方式：
+# raw（默认）直接比较原始分数，各知识库使用同一 embedding 模型与 IP 度量，分数本身可比，
+# 与查询最相关的结果排在前面，不相关的知识库的结果排在后面；
+# minmax 按各知识库返回结果的最小、最大值缩放到 0~1，zscore 减均值除以标准差，rrf 只看排名、按倒数排名打分，
+# 这三种方式逐个知识库归一化，每个知识库的第一条结果得分相同，合并结果只是轮流取各知识库的结果，
+# 只在各知识库使用不同的 embedding 模型或度量、原始分数不可比时使用
+NORMALIZATIONS = ("raw", "minmax", "zscore", "rrf")
+
+
+def normalize_scores(scores: List[float], method: str) -> List[float]:
+    """把一个知识库返回结果的分数归一化，结果只有一条或分数都相同时视为 1"""
+    if method == "raw" or not scores:
+        return list(scores)
+    values = np.asarray(scores, dtype=np.float64)
+    if method == "minmax":
+        spread = values.max() - values.min()
+        return ((values - values.min()) / spread).tolist() if spread > 0 else [1.0] * len(values)
+    if method == "zscore":
+        std = values.std()
+        return ((values - values.mean()) / std).tolist() if std > 0 else [1.0] * len(values)
+    raise ValueError(f"score normalization {method} is not supported, expected one of {', '.join(NORMALIZATIONS)}")
+
+
+def merge_federated(results: Dict[str, List], normalization: str = "raw",
+                    rrf_k: int = 60) -> List[Tuple[Document, float, str]]:
+    """
+    合并多个知识库对同一查询的检索结果。
+
+    参数:
+    - results: {知识库名: 结果列表}，结果为 (文档, 分数) 元组或文档，列表按相关性从高到低排列。
+    - normalization: 分数归一化方式，见 NORMALIZATIONS；有结果不带分数（如 mmr、hybrid 检索）时改用 rrf。
+    - rrf_k: 倒数排名融合的平滑常数。
+
+    返回:
+    - [(文档, 合并分数, 知识库名)]，按合并分数从高到低，分数相同时按各自的排名、再按知识库顺序。
+      文档为副本，metadata 中的 knowledge_name 记录来源知识库。
+    """
+    scored = all(isinstance(item, tuple) and item[1] is not None
+                 for items in results.values() for item in items)
+    method = normalization if scored else "rrf"
+    merged = []  # (合并分数, 排名, 知识库顺序, 文档, 知识库名)
+    for order, (knowledge_name, items) in enumerate(results.items()):
+        docs = [item[0] if isinstance(item, tuple) else item for item in items]
+        if method == "rrf":
+            scores = [1.0 / (rrf_k + rank) for rank in range(1, len(docs) + 1)]
+        else:
+            scores = normalize_scores([item[1] for item in items], method)
+        for rank, (doc, score) in enumerate(zip(docs, scores)):
+            doc = Document(page_content=doc.page_content,
+                           metadata={**doc.metadata, "knowledge_name": knowledge_name})
+            merged.append((score, rank, order, doc, knowledge_name))
+    merged.sort(key=lambda item: (-item[0], item[1], item[2]))
+    return [(doc, score, knowledge_name) for score, _, _, doc, knowledge_name in merged]
+
+
+def knowledge_names(knowledge_name, max_count: Optional[int] = None) -> List[str]:
+    """请求中的知识库名（单个或列表）去掉空值、按首次出现去重"""
+    names = knowledge_name if isinstance(knowledge_name, (list, tuple)) else [knowledge_name]
+    names = list(dict.fromkeys(name.strip() for name in names if name and name.strip()))
+    if max_count is not None and len(names) > max_count:
+        raise ValueError(f"at most {max_count} knowledge bases can be searched at once, got {len(names)}")
+    return names
@@ -0,0 +1,279 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+# SQLite 单条语句的参数个数上限为 999
+_SQLITE_BATCH_SIZE = 500
+
+# 重建索引时写入的临时表前缀；重建锁超过该秒数视为重建进程已退出
+_REBUILD_PREFIX = "rebuild_"
+_REBUILD_TIMEOUT = 3600
+
+_TABLES_SQL = """
+    CREATE TABLE IF NOT EXISTS {prefix}docs (
+        doc INTEGER PRIMARY KEY,
+        doc_id TEXT NOT NULL UNIQUE,
+        source TEXT NOT NULL,
+        length INTEGER NOT NULL,
+        content TEXT NOT NULL,
+        metadata TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS {prefix}terms (
+        term_id INTEGER PRIMARY KEY,
+        term TEXT NOT NULL UNIQUE
+    );
+    CREATE TABLE IF NOT EXISTS {prefix}postings (
+        term INTEGER NOT NULL,
+        doc INTEGER NOT NULL,
+        tf INTEGER NOT NULL,
+        PRIMARY KEY (term, doc)
+    ) WITHOUT ROWID;
+"""
+
+# 英文/数字词（保留 ERR-1024、v2.1、a_b 这类编号整体）与连续的中文字符
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[._\-/:][a-z0-9]+)*|[\u3400-\u4dbf\u4e00-\u9fff]+")
+_WORD_PARTS = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    中英文混合分词。
+
+    与 ChineseRecursiveTextSplitter 一样按字符处理中文、不依赖词典：中文标点处断开，连续的中文按二元组切分，
+    单个汉字保留为一个词；英文转小写，产品编号、错误码等复合词同时保留整体与各组成部分。
+    全角字符先做 NFKC 归一化。
+    """
+    tokens = []
+    for match in _TOKEN_PATTERN.finditer(unicodedata.normalize("NFKC", text).lower()):
+        token = match.group()
+        if token[0].isascii():
+            tokens.append(token)
+            parts = _WORD_PARTS.findall(token)
+            if len(parts) > 1:
+                tokens.extend(parts)
+        elif len(token) == 1:
+            tokens.append(token)
+        else:
+            tokens.extend(token[i:i + 2] for i in range(len(token) - 1))
+    return tokens
+
+
+class KeywordIndex:
+    """
+    单个知识库的 BM25 倒排索引，存储在一个 SQLite 文件中。
+
+    倒排表以 (term, doc) 为主键、不带 rowid，同一个词的倒排列表在磁盘上连续存放；文档以整数编号引用，
+    并保存原文与 metadata，检索结果不需要再回查向量库。
+    文档按 id 或来源文件增量添加和删除，多个进程（dataprep、crawler、retriever）可以共享同一个索引文件。
+    """
+
+    def __init__(self, index_path: str, k1: float = 1.2, b: float = 0.75):
+        self.index_path = index_path
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.Lock()
+
+        if not os.path.exists(os.path.dirname(index_path)):
+            os.makedirs(os.path.dirname(index_path), exist_ok=True)
+        self.created = not os.path.exists(index_path)
+        self._conn = sqlite3.connect(index_path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_TABLES_SQL.format(prefix="") +
+                                 "CREATE INDEX IF NOT EXISTS ix_docs_source ON docs (source);")
+        self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _select_in(self, sql: str, values: List) -> List[tuple]:
+        # sql 中的 {} 替换为一批参数占位符
+        rows = []
+        for i in range(0, len(values), _SQLITE_BATCH_SIZE):
+            batch = values[i:i + _SQLITE_BATCH_SIZE]
+            rows.extend(self._conn.execute(sql.format(",".join("?" * len(batch))), batch).fetchall())
+        return rows
+
+    def _term_ids(self, terms: List[str], create: bool = False, prefix: str = "") -> Dict[str, int]:
+        # 倒排表只存词的整数编号，词表只增不删
+        if create:
+            self._conn.executemany(f"INSERT OR IGNORE INTO {prefix}terms (term) VALUES (?)",
+                                   [(term,) for term in terms])
+        return dict(self._select_in(f"SELECT term, term_id FROM {prefix}terms WHERE term IN ({{}})", terms))
+
+    def _delete_rows(self, rows: List[tuple]):
+        # 删除时重新分词得到倒排表主键，不需要为 doc 列额外建索引
+        doc_terms = [(doc, set(tokenize(content))) for doc, content in rows]
+        term_ids = self._term_ids(list({term for _, terms in doc_terms for term in terms}))
+        self._conn.executemany("DELETE FROM postings WHERE term = ? AND doc = ?",
+                               [(term_ids[term], doc) for doc, terms in doc_terms for term in terms
+                                if term in term_ids])
+        self._conn.executemany("DELETE FROM docs WHERE doc = ?", [(doc,) for doc, _ in rows])
+
+    def _select_rows(self, column: str, values: List[str]) -> List[tuple]:
+        return self._select_in(f"SELECT doc, content FROM docs WHERE {column} IN ({{}})", values)
+
+    def add(self, doc_ids: List[str], docs: List[Document], source: str):
+        """添加文档，已存在的 id 先删除再写入"""
+        if not docs:
+            return
+        with self._lock, self._conn:
+            self._delete_rows(self._select_rows("doc_id", list(doc_ids)))
+            self._insert(doc_ids, docs, source)
+
+    def _insert(self, doc_ids: List[str], docs: List[Document], source: str, prefix: str = ""):
+        doc_term_freqs = [Counter(tokenize(doc.page_content)) for doc in docs]
+        term_ids = self._term_ids(list({term for term_freqs in doc_term_freqs for term in term_freqs}),
+                                  create=True, prefix=prefix)
+        for doc_id, doc, term_freqs in zip(doc_ids, docs, doc_term_freqs):
+            cursor = self._conn.execute(
+                f"INSERT INTO {prefix}docs (doc_id, source, length, content, metadata) VALUES (?, ?, ?, ?, ?)",
+                (doc_id, source, sum(term_freqs.values()), doc.page_content,
+                 json.dumps(doc.metadata, ensure_ascii=False)))
+            self._conn.executemany(f"INSERT INTO {prefix}postings (term, doc, tf) VALUES (?, ?, ?)",
+                                   [(term_ids[term], cursor.lastrowid, tf) for term, tf in term_freqs.items()])
+
+    def delete(self, doc_ids: Iterable[str]):
+        doc_ids = list(doc_ids)
+        if not doc_ids:
+            return
+        with self._lock, self._conn:
+            self._delete_rows(self._select_rows("doc_id", doc_ids))
+
+    def delete_source(self, source: str):
+        """删除某个文件的全部文档"""
+        with self._lock, self._conn:
+            self._delete_rows(self._select_rows("source", [source]))
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM postings")
+            self._conn.execute("DELETE FROM docs")
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+
+    def _drop_rebuild_tables(self):
+        for table in ("docs", "terms", "postings"):
+            self._conn.execute(f"DROP TABLE IF EXISTS {_REBUILD_PREFIX}{table}")
+
+    def rebuild(self, batches: Iterable[Tuple[str, List[str], List[Document]]]) -> bool:
+        """
+        用 (来源文件, [文档id], [文档]) 批次重建整个索引。
+
+        新索引写入同一文件的临时表，写完后在一个事务中替换原来的表，重建期间检索仍使用原来的索引；
+        多个进程同时发现索引需要重建时只有一个进程重建，其余返回 False。重建期间的增量写入只进入原来的表，
+        替换后若与向量库不一致，由下一次检查再次重建。
+        """
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS rebuild_lock (started REAL NOT NULL)")
+            row = self._conn.execute("SELECT started FROM rebuild_lock").fetchone()
+            if row is not None and time.time() - row[0] < _REBUILD_TIMEOUT:
+                return False
+            self._conn.execute("DELETE FROM rebuild_lock")
+            self._conn.execute("INSERT INTO rebuild_lock (started) VALUES (?)", (time.time(),))
+            self._drop_rebuild_tables()
+        try:
+            with self._lock, self._conn:
+                self._conn.executescript(_TABLES_SQL.format(prefix=_REBUILD_PREFIX))
+            # 每批一个事务，批次之间检索与增量写入照常进行
+            for source, doc_ids, docs in batches:
+                with self._lock, self._conn:
+                    self._insert(doc_ids, docs, source, prefix=_REBUILD_PREFIX)
+            with self._lock, self._conn:
+                self._conn.execute("BEGIN IMMEDIATE")
+                for table in ("postings", "docs", "terms"):
+                    self._conn.execute(f"DROP TABLE {table}")
+                    self._conn.execute(f"ALTER TABLE {_REBUILD_PREFIX}{table} RENAME TO {table}")
+                self._conn.execute("CREATE INDEX ix_docs_source ON docs (source)")
+                self._conn.execute("DELETE FROM rebuild_lock")
+        except BaseException:
+            with self._lock, self._conn:
+                self._drop_rebuild_tables()
+                self._conn.execute("DELETE FROM rebuild_lock")
+            raise
+        return True
+
+    def search(self, text: str, top_k: int) -> List[Document]:
+        """按 BM25 分数返回最相关的 top_k 个文档，metadata 中的 score 为 BM25 分数"""
+        terms = list(dict.fromkeys(tokenize(text)))
+        if not terms or top_k <= 0:
+            return []
+        with self._lock:
+            total_docs, total_length = self._conn.execute("SELECT COUNT(*), SUM(length) FROM docs").fetchone()
+            if not total_docs:
+                return []
+            term_ids = list(self._term_ids(terms).values())
+            # 一次查询取回所有查询词的倒排列表及文档长度
+            postings = self._select_in("SELECT p.term, p.doc, p.tf, d.length FROM postings p "
+                                       "JOIN docs d ON d.doc = p.doc WHERE p.term IN ({})", term_ids)
+            if not postings:
+                return []
+            term, doc, tf, length = (np.asarray(column, dtype=np.float64) for column in zip(*postings))
+
+            # BM25：idf 按每个词的文档频率计算，文档得分为各查询词得分之和
+            unique_terms, term_index, doc_freq = np.unique(term, return_inverse=True, return_counts=True)
+            idf = np.log(1 + (total_docs - doc_freq + 0.5) / (doc_freq + 0.5))[term_index]
+            avg_length = (total_length or 0) / total_docs or 1.0
+            norm = self.k1 * (1 - self.b + self.b * length / avg_length)
+            unique_docs, doc_index = np.unique(doc, return_inverse=True)
+            scores = np.zeros(len(unique_docs))
+            np.add.at(scores, doc_index, idf * tf * (self.k1 + 1) / (tf + norm))
+
+            order = np.argsort(-scores, kind="stable")[:top_k]
+            top = [(int(unique_docs[i]), float(scores[i])) for i in order]
+            rows = {doc: (content, metadata) for doc, content, metadata in self._select_in(
+                "SELECT doc, content, metadata FROM docs WHERE doc IN ({})", [doc for doc, _ in top])}
+
+        results = []
+        for doc, score in top:
+            content, metadata = rows[doc]
+            metadata = json.loads(metadata)
+            metadata["score"] = score
+            results.append(Document(page_content=content, metadata=metadata))
+        return results
+
+
+_keyword_indexes: Dict[str, KeywordIndex] = {}
+_keyword_indexes_lock = threading.Lock()
+
+
+def get_keyword_index(knowledge_name: str, index_root: str, k1: float = 1.2, b: float = 0.75) -> KeywordIndex:
+    """获取知识库的关键词索引，同一个进程内每个知识库只打开一次索引文件"""
+    with _keyword_indexes_lock:
+        index = _keyword_indexes.get(knowledge_name)
+        if index is None:
+            index = KeywordIndex(os.path.join(index_root, f"{knowledge_name}.db"), k1=k1, b=b)
+            _keyword_indexes[knowledge_name] = index
+        return index
+
+
+def reciprocal_rank_fusion(result_lists: List[List], k: int = 60, key=None) -> List[Document]:
+    """
+    倒数排名融合（RRF）。
+
+    每个结果列表中排名为 rank 的文档得分 1 / (k + rank)，同一文档在多个列表中的得分相加；
+    结果列表的元素为文档或 (文档, 分数) 元组，默认按 metadata 中的 id 识别同一文档，没有 id 时按文本识别。
+    """
+    key = key or (lambda doc: doc.metadata.get("id") or doc.page_content)
+    scores: Dict[str, float] = defaultdict(float)
+    docs: Dict[str, Document] = {}
+    for results in result_lists:
+        for rank, item in enumerate(results or [], start=1):
+            doc = item[0] if isinstance(item, tuple) else item
+            doc_key = key(doc)
+            scores[doc_key] += 1.0 / (k + rank)
+            docs.setdefault(doc_key, doc)
+    return [docs[doc_key] for doc_key in sorted(scores, key=scores.get, reverse=True)]
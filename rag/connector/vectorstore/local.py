@@ -0,0 +1,828 @@
+from __future__ import annotations
+
+import json
+import math
+import os
+import shutil
+import sqlite3
+import threading
+import uuid
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from rag.common.configuration import config
+from rag.common.utils import md5_encryption
+from rag.module.knowledge_file import KnowledgeFile
+from rag.connector.vectorstore.base import VectorStore
+from rag.connector.vectorstore.keyword_index import get_keyword_index
+from rag.connector.vectorstore.mmr import maximal_marginal_relevance
+from rag.connector.vectorstore.quantization import (QUANTIZATION_MODES, QUANTIZER_TRAIN_SAMPLES, RECALL_K,
+                                                    RECALL_QUERIES, RescoreMonitor, exact_top_k, load_quantizer,
+                                                    normalize_quantization, oversample_for, recall_report,
+                                                    save_quantizer, train_quantizer)
+from comps import CustomLogger, measure_stage
+
+logger = CustomLogger("local_vector_store")
+
+# SQLite 单条语句的参数个数上限为 999
+_SQLITE_BATCH_SIZE = 500
+# 建立 IVF 索引后新增、尚未分配聚类的行数超过该值时分配到已有聚类，此前精确扫描
+_MAX_TAIL_ROWS = 8192
+# 向量数增长到训练时的这么多倍后重新训练聚类
+_RETRAIN_GROWTH = 4
+_KMEANS_ITERATIONS = 10
+_KMEANS_SAMPLES_PER_LIST = 64
+# 训练、分配聚类时每批处理的行数，控制临时内存
+_ASSIGN_BATCH_ROWS = 65536
+
+
+def _spherical_kmeans(samples: np.ndarray, nlist: int, seed: int = 0) -> np.ndarray:
+    """内积度量下的 k-means，聚类中心归一化"""
+    rng = np.random.default_rng(seed)
+    centroids = samples[rng.choice(len(samples), nlist, replace=False)].copy()
+    for _ in range(_KMEANS_ITERATIONS):
+        centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+        labels = np.argmax(samples @ centroids.T, axis=1)
+        order = np.argsort(labels, kind="stable")
+        counts = np.bincount(labels, minlength=nlist)
+        # 空聚类保留原中心
+        non_empty = np.flatnonzero(counts)
+        starts = np.concatenate([[0], np.cumsum(counts)])[non_empty]
+        centroids[non_empty] = np.add.reduceat(samples[order], starts, axis=0) / counts[non_empty, None]
+    centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+    return centroids.astype(np.float32)
+
+
+class _Snapshot:
+    """某一版本的只读视图，检索期间持有，不受并发写入影响"""
+
+    __slots__ = ("generation", "layout", "rows", "dim", "vectors", "alive",
+                 "centroids", "assigned", "order", "offsets", "quantizer", "codes")
+
+    def __init__(self, generation=0, layout=0, rows=0, dim=0):
+        self.generation = generation
+        self.layout = layout
+        self.rows = rows
+        self.dim = dim
+        self.vectors = None
+        self.alive = None
+        self.centroids = None
+        self.assigned = 0
+        self.order = None  # 按聚类排列的行号
+        self.offsets = None  # 每个聚类在 order 中的起止位置
+        self.quantizer = None
+        self.codes = None  # 量化编码，与行号一一对应
+
+
+class LocalVectorIndex:
+    """
+    单个知识库的向量数据与 IVF 索引，存储在一个目录中，通过 mmap 加载。
+
+    目录结构：
+    - store.db：SQLite，chunks 表保存行号、文档 id、来源文件、原文与 metadata，meta 表保存版本与行数；
+    - vectors.f32：float32 向量，按行号顺序追加；
+    - alive.u8：每行一个字节，删除时置 0；
+    - centroids.npy / assign.i32：IVF 聚类中心与每行所属的聚类；
+    - quantizer.npz / codes.u8：知识库启用 int8 / pq 量化时的量化器与每行的编码。
+    - instance：目录的实例标识，其他进程据此发现知识库被删除后重建，重新打开目录。
+
+    打开知识库只需映射文件、读取聚类分配，不需要重新读入向量。写入在 SQLite 的写事务中进行，
+    dataprep 与 retriever 等多个进程可以共享同一个目录：读取方每次检索前比较 meta 中的版本号，
+    有变化时重新映射。删除只把行标记为无效，无效行超过 compact_ratio 时压缩数据文件。
+
+    启用量化时，量化器与 IVF 索引一同训练，此后检索只扫描量化编码，取 top_k * oversample 个候选
+    再从 vectors.f32 读出这些行的原始向量重新打分，常驻内存的只有编码，原始向量留在磁盘上。
+    """
+
+    def __init__(self, path: str, ivf_min_rows: int = 50000, nprobe: int = 32, compact_ratio: float = 0.3,
+                 quantization: Optional[str] = None, oversample: int = 0, pq_m: int = 0):
+        self.path = path
+        self.ivf_min_rows = ivf_min_rows
+        self.nprobe = max(1, nprobe)
+        self.compact_ratio = compact_ratio
+        self.oversample = oversample  # 0 表示按量化方式取默认值
+        self.pq_m = pq_m
+        self.monitor = RescoreMonitor()
+        self.vectors_path = os.path.join(path, "vectors.f32")
+        self.alive_path = os.path.join(path, "alive.u8")
+        self.centroids_path = os.path.join(path, "centroids.npy")
+        self.assign_path = os.path.join(path, "assign.i32")
+        self.quantizer_path = os.path.join(path, "quantizer.npz")
+        self.codes_path = os.path.join(path, "codes.u8")
+        self.instance_path = os.path.join(path, "instance")
+        self._lock = threading.RLock()
+        self._snapshot = _Snapshot()
+
+        os.makedirs(path, exist_ok=True)
+        self.instance = self._open_instance()
+        self._conn = sqlite3.connect(os.path.join(path, "store.db"), check_same_thread=False, timeout=30,
+                                     isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS chunks (
+                row INTEGER PRIMARY KEY,
+                id TEXT NOT NULL UNIQUE,
+                source TEXT NOT NULL,
+                text TEXT NOT NULL,
+                metadata TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS ix_chunks_source ON chunks (source);
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            );
+        """)
+        if quantization is not None:
+            self.set_quantization(quantization)
+
+    def _read_instance(self) -> Optional[str]:
+        try:
+            with open(self.instance_path) as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _open_instance(self) -> str:
+        """目录的实例标识，首次打开时随机生成；目录被删除后重建，标识随之改变"""
+        instance = self._read_instance()
+        if instance is None:
+            # 先写临时文件再硬链接，多个进程同时创建时只有一个标识生效
+            tmp_path = f"{self.instance_path}.{uuid.uuid4().hex}"
+            with open(tmp_path, "w") as f:
+                f.write(uuid.uuid4().hex)
+            try:
+                os.link(tmp_path, self.instance_path)
+            except FileExistsError:
+                pass
+            finally:
+                os.remove(tmp_path)
+            instance = self._read_instance()
+        return instance
+
+    def dropped(self) -> bool:
+        """
+        目录是否已被其他进程删除（可能又已重建）。
+
+        删除后本进程的 SQLite 连接与 mmap 仍指向已删除的文件，看不到之后的写入，需要重新打开。
+        """
+        return self._read_instance() != self.instance
+
+    def close(self):
+        with self._lock:
+            self._snapshot = _Snapshot()
+            self._conn.close()
+
+    # ---------------------------------------------------------------- 写入
+
+    def _read_meta(self) -> Dict[str, int]:
+        # quantization 为 QUANTIZATION_MODES 的下标，coded 为已编码的行数（量化器训练后等于 rows）
+        meta = {"dim": 0, "rows": 0, "dead": 0, "generation": 0, "layout": 0, "trained": 0, "assigned": 0,
+                "quantization": 0, "coded": 0}
+        meta.update(self._conn.execute("SELECT key, value FROM meta").fetchall())
+        return meta
+
+    @contextmanager
+    def _write(self):
+        """写事务：跨进程串行，提交时版本号加一"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                meta = self._read_meta()
+                yield meta
+                meta["generation"] += 1
+                self._conn.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", meta.items())
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    @property
+    def quantization(self) -> str:
+        with self._lock:
+            return QUANTIZATION_MODES[self._read_meta()["quantization"]]
+
+    def set_quantization(self, quantization: str):
+        """设置量化方式；已有数据的知识库保持原方式，需清空后重建才能更改"""
+        code = QUANTIZATION_MODES.index(normalize_quantization(quantization))
+        with self._lock:
+            meta = self._read_meta()
+            if meta["quantization"] == code:
+                return
+            if meta["rows"]:
+                logger.warning(f"{self.path} already stores vectors with {QUANTIZATION_MODES[meta['quantization']]} "
+                               f"quantization, clear it before switching to {quantization}")
+                return
+            with self._write() as meta:
+                meta["quantization"] = code
+
+    @staticmethod
+    def _write_at(path: str, offset: int, data: bytes):
+        with open(path, "r+b" if os.path.exists(path) else "wb") as f:
+            f.seek(offset)
+            f.write(data)
+
+    def _select_in(self, sql: str, values: List) -> List[tuple]:
+        rows = []
+        for i in range(0, len(values), _SQLITE_BATCH_SIZE):
+            batch = values[i:i + _SQLITE_BATCH_SIZE]
+            rows.extend(self._conn.execute(sql.format(",".join("?" * len(batch))), batch).fetchall())
+        return rows
+
+    def _mark_deleted(self, meta: Dict[str, int], rows: List[int]):
+        if not rows:
+            return
+        alive = np.memmap(self.alive_path, dtype=np.uint8, mode="r+", shape=(meta["rows"],))
+        alive[np.asarray(rows, dtype=np.int64)] = 0
+        alive.flush()
+        del alive
+        self._select_in("DELETE FROM chunks WHERE row IN ({})", rows)
+        meta["dead"] += len(rows)
+
+    def add(self, ids: List[str], sources: List[str], texts: List[str], metadatas: List[dict], vectors):
+        """写入一批文档，id 已存在的先删除"""
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if not len(ids):
+            return
+        if vectors.ndim != 2 or len(vectors) != len(ids):
+            raise ValueError("vectors must be a 2-d array aligned with ids")
+        with self._write() as meta:
+            if meta["dim"] and meta["dim"] != vectors.shape[1]:
+                raise ValueError(f"vector dimension {vectors.shape[1]} does not match {meta['dim']} of {self.path}")
+            meta["dim"] = vectors.shape[1]
+            self._mark_deleted(meta, [row for row, in self._select_in("SELECT row FROM chunks WHERE id IN ({})",
+                                                                       list(ids))])
+            start = meta["rows"]
+            self._write_at(self.vectors_path, start * meta["dim"] * 4, vectors.tobytes())
+            self._write_at(self.alive_path, start, b"\x01" * len(ids))
+            if meta["coded"]:
+                quantizer = load_quantizer(self.quantizer_path)
+                self._write_at(self.codes_path, start * quantizer.code_size, quantizer.encode(vectors).tobytes())
+            self._conn.executemany(
+                "INSERT INTO chunks (row, id, source, text, metadata) VALUES (?, ?, ?, ?, ?)",
+                [(start + i, doc_id, source, text, json.dumps(metadata, ensure_ascii=False))
+                 for i, (doc_id, source, text, metadata) in enumerate(zip(ids, sources, texts, metadatas))])
+            meta["rows"] = start + len(ids)
+            if meta["coded"]:
+                meta["coded"] = meta["rows"]
+            self._maintain(meta)
+
+    def delete(self, ids: List[str]):
+        if not ids:
+            return
+        with self._write() as meta:
+            self._mark_deleted(meta, [row for row, in self._select_in("SELECT row FROM chunks WHERE id IN ({})",
+                                                                       list(ids))])
+            self._maintain(meta)
+
+    def delete_source(self, source: str) -> int:
+        with self._write() as meta:
+            rows = [row for row, in self._conn.execute("SELECT row FROM chunks WHERE source = ?", (source,))]
+            self._mark_deleted(meta, rows)
+            self._maintain(meta)
+        return len(rows)
+
+    def clear(self):
+        with self._write() as meta:
+            self._conn.execute("DELETE FROM chunks")
+            for path in (self.vectors_path, self.alive_path, self.centroids_path, self.assign_path,
+                         self.quantizer_path, self.codes_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            meta.update(dim=0, rows=0, dead=0, trained=0, assigned=0, coded=0, layout=meta["layout"] + 1)
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    # ---------------------------------------------------------------- 索引维护
+
+    def _maintain(self, meta: Dict[str, int]):
+        rows, live = meta["rows"], meta["rows"] - meta["dead"]
+        if meta["dead"] and meta["dead"] >= self.compact_ratio * rows:
+            self._compact(meta)
+            rows, live = meta["rows"], meta["rows"]
+        if live == 0:
+            return
+        if (not meta["trained"] and live >= self.ivf_min_rows) or \
+                (meta["trained"] and live >= _RETRAIN_GROWTH * meta["trained"]):
+            self._train(meta)
+        elif meta["trained"] and rows - meta["assigned"] > _MAX_TAIL_ROWS:
+            self._assign_tail(meta)
+
+    def _vectors(self, meta: Dict[str, int]) -> np.memmap:
+        return np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(meta["rows"], meta["dim"]))
+
+    def _assign(self, vectors, centroids: np.ndarray, start: int, end: int) -> np.ndarray:
+        labels = np.empty(end - start, dtype=np.int32)
+        for i in range(start, end, _ASSIGN_BATCH_ROWS):
+            batch = np.asarray(vectors[i:min(i + _ASSIGN_BATCH_ROWS, end)])
+            labels[i - start:i - start + len(batch)] = np.argmax(batch @ centroids.T, axis=1)
+        return labels
+
+    def _train(self, meta: Dict[str, int]):
+        vectors = self._vectors(meta)
+        alive = np.fromfile(self.alive_path, dtype=np.uint8, count=meta["rows"])
+        live_rows = np.flatnonzero(alive)
+        nlist = int(min(4096, max(16, math.sqrt(len(live_rows)))))
+        rng = np.random.default_rng(meta["rows"])
+        sample_rows = np.sort(rng.choice(live_rows, min(len(live_rows), nlist * _KMEANS_SAMPLES_PER_LIST),
+                                         replace=False))
+        centroids = _spherical_kmeans(np.asarray(vectors[sample_rows]), min(nlist, len(sample_rows)))
+        labels = self._assign(vectors, centroids, 0, meta["rows"])
+        np.save(self.centroids_path + ".tmp.npy", centroids)
+        labels.tofile(self.assign_path + ".tmp")
+        os.replace(self.centroids_path + ".tmp.npy", self.centroids_path)
+        os.replace(self.assign_path + ".tmp", self.assign_path)
+        meta.update(trained=len(live_rows), assigned=meta["rows"], layout=meta["layout"] + 1)
+        logger.info(f"trained {len(centroids)} clusters on {len(live_rows)} vectors of {self.path}")
+        if meta["quantization"]:
+            self._train_quantizer(meta, vectors, live_rows, rng)
+
+    def _train_quantizer(self, meta: Dict[str, int], vectors, live_rows: np.ndarray, rng: np.random.Generator):
+        """在有效行的样本上训练量化器，并重新编码全部行"""
+        mode = QUANTIZATION_MODES[meta["quantization"]]
+        sample_rows = np.sort(rng.choice(live_rows, min(len(live_rows), QUANTIZER_TRAIN_SAMPLES), replace=False))
+        samples = np.asarray(vectors[sample_rows])
+        quantizer = train_quantizer(mode, samples, self.pq_m)
+        with open(self.codes_path + ".tmp", "wb") as f:
+            for i in range(0, meta["rows"], _ASSIGN_BATCH_ROWS):
+                f.write(quantizer.encode(vectors[i:i + _ASSIGN_BATCH_ROWS]).tobytes())
+        save_quantizer(self.quantizer_path + ".tmp.npz", quantizer)
+        os.replace(self.quantizer_path + ".tmp.npz", self.quantizer_path)
+        os.replace(self.codes_path + ".tmp", self.codes_path)
+        meta["coded"] = meta["rows"]
+        logger.info(f"trained {mode} quantizer on {len(sample_rows)} vectors of {self.path}")
+
+    def _assign_tail(self, meta: Dict[str, int]):
+        centroids = np.load(self.centroids_path)
+        labels = self._assign(self._vectors(meta), centroids, meta["assigned"], meta["rows"])
+        self._write_at(self.assign_path, meta["assigned"] * 4, labels.tobytes())
+        meta["assigned"] = meta["rows"]
+
+    def _compact(self, meta: Dict[str, int]):
+        """去掉已删除的行，行号重新连续编号"""
+        alive = np.fromfile(self.alive_path, dtype=np.uint8, count=meta["rows"])
+        live_rows = np.flatnonzero(alive)
+        vectors = self._vectors(meta)
+        with open(self.vectors_path + ".tmp", "wb") as f:
+            for i in range(0, len(live_rows), _ASSIGN_BATCH_ROWS):
+                f.write(np.ascontiguousarray(vectors[live_rows[i:i + _ASSIGN_BATCH_ROWS]]).tobytes())
+        del vectors
+        np.ones(len(live_rows), dtype=np.uint8).tofile(self.alive_path + ".tmp")
+        assigned = int(np.searchsorted(live_rows, meta["assigned"]))
+        if meta["trained"]:
+            labels = np.fromfile(self.assign_path, dtype=np.int32, count=meta["assigned"])
+            labels[live_rows[:assigned]].tofile(self.assign_path + ".tmp")
+        if meta["coded"]:
+            code_size = os.path.getsize(self.codes_path) // meta["coded"]
+            codes = np.memmap(self.codes_path, dtype=np.uint8, mode="r", shape=(meta["coded"], code_size))
+            with open(self.codes_path + ".tmp", "wb") as f:
+                for i in range(0, len(live_rows), _ASSIGN_BATCH_ROWS):
+                    f.write(np.ascontiguousarray(codes[live_rows[i:i + _ASSIGN_BATCH_ROWS]]).tobytes())
+            del codes
+        # 新行号不大于旧行号，按升序更新不会与尚未更新的行冲突
+        self._conn.executemany("UPDATE chunks SET row = ? WHERE row = ?",
+                               [(new, int(old)) for new, old in enumerate(live_rows) if new != old])
+        os.replace(self.vectors_path + ".tmp", self.vectors_path)
+        os.replace(self.alive_path + ".tmp", self.alive_path)
+        if meta["trained"]:
+            os.replace(self.assign_path + ".tmp", self.assign_path)
+        if meta["coded"]:
+            os.replace(self.codes_path + ".tmp", self.codes_path)
+        logger.info(f"compacted {self.path}: {meta['rows']} -> {len(live_rows)} rows")
+        meta.update(rows=len(live_rows), dead=0, assigned=assigned if meta["trained"] else 0,
+                    coded=len(live_rows) if meta["coded"] else 0, layout=meta["layout"] + 1)
+
+    # ---------------------------------------------------------------- 读取
+
+    def snapshot(self) -> _Snapshot:
+        """返回当前版本的只读视图，其它进程写入后重新映射文件"""
+        with self._lock:
+            meta = self._read_meta()
+            current = self._snapshot
+            if meta["generation"] == current.generation and meta["layout"] == current.layout:
+                return current
+            snap = _Snapshot(meta["generation"], meta["layout"], meta["rows"], meta["dim"])
+            if meta["rows"]:
+                snap.vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r",
+                                         shape=(meta["rows"], meta["dim"]))
+                snap.alive = np.memmap(self.alive_path, dtype=np.uint8, mode="r", shape=(meta["rows"],))
+            if meta["trained"] and meta["assigned"]:
+                if current.centroids is not None and current.layout == meta["layout"] \
+                        and current.assigned == meta["assigned"]:
+                    snap.centroids, snap.order, snap.offsets = current.centroids, current.order, current.offsets
+                else:
+                    snap.centroids = np.load(self.centroids_path)
+                    labels = np.fromfile(self.assign_path, dtype=np.int32, count=meta["assigned"])
+                    snap.order = np.argsort(labels, kind="stable").astype(np.int64)
+                    snap.offsets = np.concatenate(
+                        [[0], np.cumsum(np.bincount(labels, minlength=len(snap.centroids)))])
+                snap.assigned = meta["assigned"]
+            if meta["coded"]:
+                # 量化器只在训练时更换，训练会更新 layout
+                if current.quantizer is not None and current.layout == meta["layout"]:
+                    snap.quantizer = current.quantizer
+                else:
+                    snap.quantizer = load_quantizer(self.quantizer_path)
+                snap.codes = np.memmap(self.codes_path, dtype=np.uint8, mode="r",
+                                       shape=(meta["coded"], snap.quantizer.code_size))
+            self._snapshot = snap
+            return snap
+
+    def search(self, query, top_k: int, snap: Optional[_Snapshot] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """返回内积最大的 top_k 个有效行号及分数，分数从高到低"""
+        rows, scores, quantized_top, candidates = self._search(query, top_k, snap or self.snapshot())
+        if quantized_top is not None:
+            self.monitor.record(quantized_top.tolist(), rows.tolist(), candidates)
+        return rows, scores
+
+    def _search(self, query, top_k: int, snap: _Snapshot):
+        """返回 (行号, 分数, 只按量化分数排序的 top_k 行号, 重新打分的候选数)，未量化时后两项为 None"""
+        if not snap.rows or top_k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32), None, None
+        query = np.asarray(query, dtype=np.float32).reshape(-1)
+        if snap.centroids is None:
+            candidates = np.flatnonzero(snap.alive)
+        else:
+            nprobe = min(self.nprobe, len(snap.centroids))
+            probes = np.argpartition(-(snap.centroids @ query), nprobe - 1)[:nprobe]
+            parts = [snap.order[snap.offsets[c]:snap.offsets[c + 1]] for c in probes]
+            parts.append(np.arange(snap.assigned, snap.rows))
+            candidates = np.sort(np.concatenate(parts))
+            candidates = candidates[snap.alive[candidates] != 0]
+        quantized_top = rescored = None
+        if snap.codes is not None:
+            # 先按量化编码的近似分数取 top_k * oversample 个候选，再读原始向量重新打分
+            approx = snap.quantizer.scores(query, snap.codes[candidates])
+            fetch = top_k * oversample_for(snap.quantizer.kind, self.oversample)
+            if len(candidates) > fetch:
+                keep = np.argpartition(-approx, fetch - 1)[:fetch]
+                candidates, approx = candidates[keep], approx[keep]
+            quantized_top = candidates[np.argsort(-approx, kind="stable")[:top_k]]
+            rescored = len(candidates)
+            candidates = np.sort(candidates)
+            scores = snap.vectors[candidates] @ query
+        elif snap.centroids is None:
+            scores = (np.asarray(snap.vectors) @ query)[candidates]
+        else:
+            scores = snap.vectors[candidates] @ query
+        if len(candidates) > top_k:
+            best = np.argpartition(-scores, top_k - 1)[:top_k]
+            candidates, scores = candidates[best], scores[best]
+        order = np.argsort(-scores, kind="stable")
+        return candidates[order], scores[order], quantized_top, rescored
+
+    def quantization_stats(self, evaluate: bool = False) -> Dict:
+        """
+        量化方式、检索需常驻内存的字节数与原始向量的字节数，以及重新打分的在线统计。
+
+        evaluate 为 True 时另外评估 recall@k，见 evaluate_recall。
+        """
+        snap = self.snapshot()
+        with self._lock:
+            meta = self._read_meta()
+        rows, dim = meta["rows"], meta["dim"]
+        # 检索需要常驻内存的部分：量化编码或原始向量，加上 IVF 的聚类中心与聚类分配
+        ivf_bytes = (snap.centroids.nbytes + 4 * snap.assigned) if snap.centroids is not None else 0
+        search_bytes = (snap.codes.nbytes if snap.codes is not None else rows * dim * 4) + ivf_bytes
+        stats = {
+            "quantization": QUANTIZATION_MODES[meta["quantization"]],
+            "quantizer_trained": snap.quantizer is not None,
+            "rows": rows - meta["dead"],
+            "dim": dim,
+            "oversample": oversample_for(QUANTIZATION_MODES[meta["quantization"]], self.oversample),
+            "search_memory_bytes": search_bytes,
+            "full_precision_bytes": rows * dim * 4,
+            "compression_ratio": rows * dim * 4 / search_bytes if search_bytes else None,
+            "rescore": self.monitor.stats(),
+        }
+        if evaluate and rows - meta["dead"]:
+            stats["evaluated_recall"] = self.evaluate_recall(snap)
+        return stats
+
+    def evaluate_recall(self, snap: Optional[_Snapshot] = None, queries: int = RECALL_QUERIES,
+                        k: int = RECALL_K) -> Dict:
+        """
+        以随机抽取的已存向量为查询，对比检索结果与全量精确检索的 recall@k。
+
+        精确检索按块顺序扫描全部原始向量一次；量化知识库同时给出只按量化分数排序时的召回率。
+        """
+        snap = snap or self.snapshot()
+        live_rows = np.flatnonzero(snap.alive)
+        picked = np.random.default_rng().choice(live_rows, min(queries, len(live_rows)), replace=False)
+        query_vectors = np.asarray(snap.vectors[np.sort(picked)])
+        blocks = ((i, snap.vectors[i:i + _ASSIGN_BATCH_ROWS], snap.alive[i:i + _ASSIGN_BATCH_ROWS] != 0)
+                  for i in range(0, snap.rows, _ASSIGN_BATCH_ROWS))
+        exact = exact_top_k(blocks, query_vectors, k)
+        quantized, rescored = [], []
+        for query in query_vectors:
+            rows, _, quantized_top, _ = self._search(query, k, snap)
+            rescored.append(rows.tolist())
+            quantized.append((quantized_top if quantized_top is not None else rows).tolist())
+        return recall_report(exact, quantized, rescored, k)
+
+    def fetch(self, rows, snap: Optional[_Snapshot] = None) -> List[Tuple[int, str, str, dict]]:
+        """按行号取回 (row, id, text, metadata)，顺序与 rows 一致；行已被删除时跳过"""
+        rows = [int(row) for row in rows]
+        if not rows:
+            return []
+        with self._lock:
+            found = {row: (row, doc_id, text, json.loads(metadata)) for row, doc_id, text, metadata in
+                     self._select_in("SELECT row, id, text, metadata FROM chunks WHERE row IN ({})", rows)}
+            layout = self._read_meta()["layout"]
+        if snap is not None and layout != snap.layout:
+            raise _LayoutChanged()
+        return [found[row] for row in rows if row in found]
+
+    def get(self, ids: List[str]) -> Dict[str, Tuple[str, dict]]:
+        """按文档 id 取回 {id: (text, metadata)}"""
+        if not ids:
+            return {}
+        with self._lock:
+            return {doc_id: (text, json.loads(metadata)) for doc_id, text, metadata in
+                    self._select_in("SELECT id, text, metadata FROM chunks WHERE id IN ({})", list(ids))}
+
+    def iter_chunks(self, batch_size: int = 1000) -> Iterator[List[Tuple[str, str, str, dict]]]:
+        """按批遍历 (id, source, text, metadata)"""
+        last = -1
+        while True:
+            with self._lock:
+                rows = self._conn.execute("SELECT row, id, source, text, metadata FROM chunks WHERE row > ? "
+                                          "ORDER BY row LIMIT ?", (last, batch_size)).fetchall()
+            if not rows:
+                return
+            last = rows[-1][0]
+            yield [(doc_id, source, text, json.loads(metadata)) for _, doc_id, source, text, metadata in rows]
+
+
+class _LayoutChanged(Exception):
+    """检索期间数据文件被压缩或重建，行号失效"""
+
+
+_indexes: Dict[str, LocalVectorIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def get_local_vector_index(knowledge_name: str, root: str, quantization: Optional[str] = None) -> LocalVectorIndex:
+    """进程内每个知识库共用一个 LocalVectorIndex；quantization 为 None 时沿用知识库已保存的量化方式"""
+    path = os.path.join(root, os.path.basename(knowledge_name))
+    with _indexes_lock:
+        index = _indexes.get(path)
+        if index is not None and index.dropped():
+            # 其他进程删除了知识库，重新打开（重建后的）目录
+            index.close()
+            index = None
+        if index is None:
+            local_config = config.vector_store.local
+            index = _indexes[path] = LocalVectorIndex(path,
+                                                      ivf_min_rows=local_config.ivf_min_rows,
+                                                      nprobe=local_config.nprobe,
+                                                      compact_ratio=local_config.compact_ratio,
+                                                      quantization=quantization,
+                                                      oversample=config.vector_store.rescore_oversample,
+                                                      pq_m=config.vector_store.pq_m)
+        elif quantization is not None:
+            index.set_quantization(quantization)
+        return index
+
+
+def drop_local_vector_index(knowledge_name: str, root: str):
+    path = os.path.join(root, os.path.basename(knowledge_name))
+    with _indexes_lock:
+        index = _indexes.pop(path, None)
+        if index is not None:
+            index.close()
+        shutil.rmtree(path, ignore_errors=True)
+
+
+class LocalVectorStore(VectorStore):
+    """
+    进程内向量库，适合小型知识库、CI 与边缘部署，不依赖 Milvus。
+
+    向量以 float32 存放在 mmap 文件中，超过 LOCAL_VECTOR_STORE_IVF_MIN_ROWS 后建立 IVF 索引；
+    原文与 metadata 存放在同目录的 SQLite 中，父块召回在本地完成。
+    quantization 为 int8 / pq 时，IVF 索引建立后检索改为扫描量化编码并用原始向量重新打分。
+    Milvus 的过滤表达式（expr）不支持，会被忽略。
+    """
+
+    def __init__(self,
+                 embedding_model: Embeddings,
+                 collection_name: str,
+                 quantization: Optional[str] = None):
+        self.embeddings = embedding_model
+        self.knowledge_name = collection_name
+        self.collection_name = collection_name
+        self.root = config.vector_store.local.path or os.path.join(config.data_root_path, "vector_store")
+        self._index = get_local_vector_index(collection_name, self.root, quantization)
+        self._load_keyword_index()
+        self._load_parent_store()
+
+    @property
+    def index(self) -> LocalVectorIndex:
+        """知识库的数据目录；其他进程删除知识库后重新打开，不再读写已删除的文件"""
+        if self._index.dropped():
+            self._index = get_local_vector_index(self.collection_name, self.root)
+        return self._index
+
+    def _load_keyword_index(self):
+        """打开知识库的关键词索引，首次创建时从本地存储回填"""
+        vs_config = config.vector_store
+        if not vs_config.keyword_index_enabled:
+            return
+        index_root = vs_config.keyword_index_path or os.path.join(config.data_root_path, "keyword_index")
+        self.keyword_index = get_keyword_index(self.knowledge_name, index_root,
+                                               k1=vs_config.bm25_k1, b=vs_config.bm25_b)
+        if self.keyword_index.created:
+            self.keyword_index.created = False
+            self._backfill_keyword_index()
+
+    def _iter_keyword_batches(self):
+        """按批读出本地索引中的分块，每批按文件名分组后逐组产出 (filename, doc_ids, docs)"""
+        for batch in self.index.iter_chunks():
+            by_source = {}  # filename: ([doc_id], [doc])
+            for doc_id, _, text, metadata in batch:
+                doc_ids, docs = by_source.setdefault(metadata.get("filename", ""), ([], []))
+                doc_ids.append(doc_id)
+                docs.append(Document(page_content=text, metadata=metadata))
+            for filename, (doc_ids, docs) in by_source.items():
+                yield filename, doc_ids, docs
+
+    def _backfill_keyword_index(self):
+        for filename, doc_ids, docs in self._iter_keyword_batches():
+            self.keyword_index.add(doc_ids, docs, source=filename)
+
+    def count_docs(self):
+        return self.index.count()
+
+    def rebuild_keyword_index(self):
+        logger.warning(f"keyword index of {self.collection_name} is out of sync, rebuilding")
+        if not self.keyword_index.rebuild(self._iter_keyword_batches()):
+            logger.info(f"keyword index of {self.collection_name} is being rebuilt by another process")
+
+    def create_vectorstore(self):
+        # 目录与数据文件在打开时创建，首次写入时确定向量维度
+        pass
+
+    def drop_vectorstore(self):
+        quantization = self.index.quantization
+        drop_local_vector_index(self.collection_name, self.root)
+        self._index = get_local_vector_index(self.collection_name, self.root, quantization)
+        if self.keyword_index is not None:
+            self.keyword_index.clear()
+        if self.parent_store is not None:
+            self.parent_store.clear()
+
+    def clear_vectorstore(self):
+        self.index.clear()
+        if self.keyword_index is not None:
+            self.keyword_index.clear()
+        if self.parent_store is not None:
+            self.parent_store.clear()
+
+    def quantization_stats(self, evaluate=False):
+        return self.index.quantization_stats(evaluate)
+
+    def add_doc(self, file: KnowledgeFile, docs, **kwargs):
+        """
+        向知识库添加文档，metadata 的处理与 MilvusVectorStore 一致。
+
+        参数:
+        - file: 文档所属的文件。
+        - docs: 待添加的文档集合。
+        - **kwargs: embeddings 为与 docs 一一对应的预先计算好的向量，提供时不再调用embedding模型。
+
+        返回:
+        - doc_infos: 包含每个文档的id和metadata信息的列表。
+        """
+        if not docs:
+            return []
+        embeddings = kwargs.get("embeddings")
+        if embeddings is None:
+            embeddings = self.embed_docs(docs)
+        source = md5_encryption(file.filename)
+        doc_ids = []
+        for doc in docs:
+            doc.metadata["source"] = source
+            doc.metadata["filename"] = file.filename
+            for k, v in doc.metadata.items():
+                doc.metadata[k] = str(v)
+            doc_ids.append(doc.metadata.setdefault("id", str(uuid.uuid4())))
+        self.index.add(doc_ids, [source] * len(docs), [doc.page_content for doc in docs],
+                       [doc.metadata for doc in docs], embeddings)
+        if self.keyword_index is not None:
+            self.keyword_index.add(doc_ids, docs, source=file.filename)
+        return [{"id": doc_id, "metadata": doc.metadata} for doc_id, doc in zip(doc_ids, docs)]
+
+    def embed_docs(self, docs: List[Document]) -> List[List[float]]:
+        return self.embeddings.embed_documents([doc.page_content for doc in docs])
+
+    def delete_doc(self, filename):
+        count = self.index.delete_source(md5_encryption(filename))
+        if count:
+            logger.warning(f"成功删除文件 {filename} {count} 条记录")
+        else:
+            logger.warning(f"vs中不存在文件 {filename} 相关的记录，不需要删除")
+        if self.keyword_index is not None:
+            self.keyword_index.delete_source(filename)
+        if self.parent_store is not None:
+            self.parent_store.delete_source(filename)
+
+    def delete_doc_by_ids(self, ids: List[str]):
+        if not ids:
+            return
+        if self.keyword_index is not None:
+            self.keyword_index.delete(ids)
+        if self.parent_store is not None:
+            self.parent_store.delete(ids)
+        self.index.delete(list(ids))
+        logger.info(f"成功删除 {len(ids)} 条记录")
+
+    def update_doc(self, file: KnowledgeFile, docs: List[Document]):
+        self.delete_doc(file.filename)
+        return self.add_doc(file, docs=docs)
+
+    def _search(self, embedding, top_k, with_vectors=False):
+        """返回 [(Document, score)]，with_vectors 时同时返回候选向量"""
+        for _ in range(3):
+            snap = self.index.snapshot()
+            rows, scores = self.index.search(embedding, top_k, snap)
+            try:
+                found = self.index.fetch(rows, snap)
+            except _LayoutChanged:
+                # 检索期间数据文件被压缩，行号失效，按新版本重试
+                continue
+            # 行在检索与取回之间被删除时 fetch 会跳过
+            score_of = dict(zip(rows.tolist(), scores.tolist()))
+            results = [(Document(page_content=text, metadata=metadata), score_of[row])
+                       for row, _, text, metadata in found]
+            if with_vectors:
+                kept = np.asarray([row for row, _, _, _ in found], dtype=np.int64)
+                return results, np.asarray(snap.vectors[kept])
+            return results
+        raise RuntimeError(f"vector store {self.collection_name} keeps changing during search")
+
+    def search_docs(self, text, top_k, threshold, **kwargs):
+        with measure_stage("embed"):
+            embedding = self.embeddings.embed_query(text)
+        docs = self._search(embedding, top_k)
+        if threshold is not None:
+            docs = [(doc, score) for doc, score in docs if score >= threshold]
+        return self.get_parents(docs)
+
+    def search_docs_by_vector(self, embedding, top_k, threshold, **kwargs):
+        return [doc for doc, _ in self.search_docs_by_vector_with_score(embedding, top_k, threshold, **kwargs)]
+
+    def search_docs_by_vector_with_score(self, embedding, top_k, threshold, **kwargs):
+        docs = self._search(embedding, top_k)
+        if threshold is not None:
+            docs = [(doc, score) for doc, score in docs if score >= threshold]
+        return self.get_parents(docs)
+
+    def search_docs_by_mmr(self, text, top_k, fetch_k, lambda_mult, **kwargs):
+        with measure_stage("embed"):
+            embedding = self.embeddings.embed_query(text)
+        return self.search_docs_by_mmr_vector(embedding, top_k, fetch_k, lambda_mult, **kwargs)
+
+    def search_docs_by_mmr_vector(self, embedding, top_k, fetch_k, lambda_mult, **kwargs):
+        docs, vectors = self._search(embedding, max(fetch_k, top_k), with_vectors=True)
+        if not docs:
+            return []
+        selected = maximal_marginal_relevance(embedding, vectors, k=top_k, lambda_mult=lambda_mult)
+        return self.get_parents([docs[i][0] for i in selected])
+
+    def get_parents(self, docs):
+        """用父块存储中的父块替换子块，父块存储中没有的从向量库的 SQLite 中取；docs 的元素为文档或 (文档, 分数) 元组"""
+        parent_doc_map = {}
+        for i, tp in enumerate(docs):
+            doc = tp[0] if isinstance(tp, tuple) else tp
+            parent_id = doc.metadata.get("parent_id")
+            if parent_id:
+                parent_doc_map[i] = parent_id
+        if not parent_doc_map:
+            return docs
+        with measure_stage("parent_fetch"):
+            ids = list(set(parent_doc_map.values()))
+            parents = self.get_parent_docs(ids)
+            missing = [parent_id for parent_id in ids if parent_id not in parents]
+            if missing:
+                parents.update((parent_id, Document(page_content=text, metadata=metadata))
+                               for parent_id, (text, metadata) in self.index.get(missing).items())
+        unresolved = [parent_id for parent_id in ids if parent_id not in parents]
+        if unresolved:
+            logger.warning(f"{len(unresolved)} parent chunks of {self.collection_name} not found, "
+                           f"returning child chunks instead; check that DATA_ROOT_PATH is shared "
+                           f"with dataprep: {unresolved[:5]}")
+        for doc_index, parent_id in parent_doc_map.items():
+            if parent_id not in parents:
+                continue
+            parent_doc = parents[parent_id]
+            if isinstance(docs[doc_index], tuple):
+                docs[doc_index] = (parent_doc, docs[doc_index][1])
+            else:
+                docs[doc_index] = parent_doc
+        return docs
@@ -1,7 +1,11 @@
 from __future__ import annotations
-from typing import List
+from typing import List, Optional
+import json
+import os
 import uuid
 import operator
+import threading
+import numpy as np
 from pymilvus import MilvusClient
 from langchain.docstore.document import Document
 from langchain_core.embeddings import Embeddings
@@ -10,23 +14,63 @@ from langchain.vectorstores.milvus import Milvus
 from rag.common.utils import md5_encryption
 from rag.module.knowledge_file import KnowledgeFile
 from rag.connector.vectorstore.base import VectorStore
+from rag.connector.vectorstore.keyword_index import get_keyword_index
+from rag.connector.vectorstore.mmr import maximal_marginal_relevance
+from rag.connector.vectorstore.quantization import (RECALL_K, RECALL_QUERIES, RescoreMonitor, exact_top_k,
+                                                    normalize_quantization, oversample_for, pq_subquantizers,
+                                                    recall_report, rescore)
 from rag.common.configuration import config
-from comps import CustomLogger
+from comps import CustomLogger, measure_stage
 
 logger = CustomLogger("milvus_vector_store")
 
+# Milvus 索引类型与知识库量化方式的对应关系
+_QUANTIZED_INDEX_TYPES = {"int8": "IVF_SQ8", "pq": "IVF_PQ"}
+# 评估召回率时从集合中取出的向量数
+_RECALL_SAMPLE_SIZE = 2000
+
+_shared_client = None
+_shared_client_lock = threading.Lock()
+
+
+def get_milvus_client() -> MilvusClient:
+    """
+    获取进程内共享的 MilvusClient。
+
+    MilvusClient 底层的 gRPC 连接是线程安全的，所有集合共用一个连接，
+    避免每个知识库各自建立连接。
+    """
+    global _shared_client
+    with _shared_client_lock:
+        if _shared_client is None:
+            milvus_config = config.vector_store.milvus
+            _shared_client = MilvusClient(
+                uri="http://" + milvus_config.host + ":" + str(milvus_config.port),
+                user=milvus_config.user,
+                password=milvus_config.password,
+                db_name=milvus_config.db_name,
+            )
+        return _shared_client
+
 
 class MilvusVectorStore(VectorStore):
 
     def __init__(self,
                  embedding_model: Embeddings,
-                 collection_name: str):
+                 collection_name: str,
+                 quantization: Optional[str] = None):
         self.embeddings = embedding_model
         self.knowledge_name = collection_name
         self.collection_name = collection_name
         self.config = config.vector_store.milvus
         self.milvus = None
+        # 集合已存在时以集合上的索引类型为准，quantization 只决定新建集合使用的索引
+        self.quantization = normalize_quantization(quantization)
+        self.monitor = RescoreMonitor()
+        self._init_lock = threading.Lock()
         self._load_milvus()
+        self._load_keyword_index()
+        self._load_parent_store()
 
     def _load_milvus(self):
         """
@@ -45,11 +89,15 @@ class MilvusVectorStore(VectorStore):
             "secure": False,
             "db_name": self.config.db_name,
         }
-        # 获取索引参数，用于数据库的索引构建
-        index_params = self.config.kwargs.get("index_params", None)
-        # 获取搜索参数，用于数据库的查询操作
-        search_params = self.config.kwargs.get("search_params", None)
-        # 初始化langchain client，用于与Milvus数据库进行交互
+        # 使用共享的pyclient，提供另一种方式与Milvus数据库进行交互
+        self.pyclient = get_milvus_client()
+        if self.pyclient.has_collection(self.collection_name):
+            self.quantization = self._collection_quantization()
+        self.oversample = oversample_for(self.quantization, config.vector_store.rescore_oversample)
+        # 获取索引参数与搜索参数，量化知识库使用 IVF_SQ8 / IVF_PQ 索引
+        index_params, search_params = self._index_params()
+        # 初始化langchain client，用于与Milvus数据库进行交互。
+        # langchain 会复用地址和用户相同的已有 pymilvus 连接，所有集合共用一个连接
         self.milvus = Milvus(self.embeddings,
                              collection_name=self.collection_name,
                              connection_args=connection_args,
@@ -57,30 +105,144 @@ class MilvusVectorStore(VectorStore):
                              search_params=search_params,
                              metadata_field="metadata",
                              auto_id=False)
-        # 初始化pyclient，提供另一种方式与Milvus数据库进行交互
-        self.pyclient = MilvusClient(
-            uri="http://"+self.config.host+":"+ str(self.config.port),
-            db_name=self.config.db_name,
-        )
+        self.search_params = search_params
+
+    def _collection_quantization(self) -> str:
+        """根据已有集合的向量索引类型判断量化方式"""
+        for index_name in self.pyclient.list_indexes(self.collection_name):
+            index_type = self.pyclient.describe_index(self.collection_name, index_name).get("index_type")
+            for mode, quantized_type in _QUANTIZED_INDEX_TYPES.items():
+                if index_type == quantized_type:
+                    return mode
+        return "none"
+
+    def _collection_dim(self) -> int:
+        """已有集合的向量维度，集合不存在时返回 0"""
+        if not self.pyclient.has_collection(self.collection_name):
+            return 0
+        return next((field["params"]["dim"] for field in
+                     self.pyclient.describe_collection(self.collection_name)["fields"]
+                     if "dim" in field.get("params", {})), 0)
+
+    def _index_params(self):
+        if self.quantization == "none":
+            return self.config.kwargs.get("index_params", None), self.config.kwargs.get("search_params", None)
+        params = {"nlist": self.config.ivf_nlist}
+        if self.quantization == "pq":
+            # IVF_PQ 的子空间个数须整除向量维度；集合已存在时从 schema 读取维度，不调用embedding模型
+            dim = self._collection_dim() or len(self.embeddings.embed_query("初始化"))
+            params.update(m=pq_subquantizers(dim, config.vector_store.pq_m), nbits=8)
+        index_params = {"metric_type": "IP", "index_type": _QUANTIZED_INDEX_TYPES[self.quantization],
+                        "params": params}
+        search_params = {"metric_type": "IP", "params": {"nprobe": self.config.ivf_nprobe}}
+        return index_params, search_params
+
+    def _init_collection(self, embeddings):
+        """用预先计算好的向量创建集合；量化知识库的原始向量改为 mmap，只在重新打分时从磁盘读取"""
+        self.milvus._init(embeddings=embeddings, metadatas=[{}], partition_names=None,
+                          replica_number=1, timeout=None)
+        if self.quantization == "none":
+            return
+        try:
+            self.milvus.col.release()
+            self.milvus.col.set_properties({"mmap.enabled": True})
+        except Exception as e:
+            logger.warning(f"enable mmap of collection {self.collection_name} failed: {e}")
+        finally:
+            self.milvus.col.load()
+
+    def _load_keyword_index(self):
+        """
+        打开知识库的关键词索引。
+
+        索引文件首次创建而集合中已有文档时（启用关键词索引之前建立的知识库），从Milvus中回填。
+        """
+        vs_config = config.vector_store
+        if not vs_config.keyword_index_enabled:
+            return
+        index_root = vs_config.keyword_index_path or os.path.join(config.data_root_path, "keyword_index")
+        self.keyword_index = get_keyword_index(self.knowledge_name, index_root,
+                                               k1=vs_config.bm25_k1, b=vs_config.bm25_b)
+        if self.keyword_index.created:
+            self.keyword_index.created = False
+            if self.milvus.col is not None:
+                try:
+                    self._backfill_keyword_index()
+                except Exception as e:
+                    logger.warning(f"backfill keyword index of {self.collection_name} failed: {e}")
+
+    def _iter_keyword_batches(self, batch_size=1000):
+        """按批读出 Milvus 中的分块，每批按文件名分组后逐组产出 (filename, doc_ids, docs)"""
+        iterator = self.milvus.col.query_iterator(batch_size=batch_size,
+                                                  expr=f'{self.milvus._primary_field} != ""',
+                                                  output_fields=[self.milvus._primary_field,
+                                                                 self.milvus._text_field,
+                                                                 self.milvus._metadata_field])
+        try:
+            while True:
+                rows = iterator.next()
+                if not rows:
+                    break
+                by_source = {}  # filename: ([doc_id], [doc])
+                for row in rows:
+                    metadata = row[self.milvus._metadata_field] or {}
+                    doc_ids, docs = by_source.setdefault(metadata.get("filename", ""), ([], []))
+                    doc_ids.append(row[self.milvus._primary_field])
+                    docs.append(Document(page_content=row[self.milvus._text_field], metadata=metadata))
+                for filename, (doc_ids, docs) in by_source.items():
+                    yield filename, doc_ids, docs
+        finally:
+            iterator.close()
+
+    def _backfill_keyword_index(self):
+        count = 0
+        for filename, doc_ids, docs in self._iter_keyword_batches():
+            self.keyword_index.add(doc_ids, docs, source=filename)
+            count += len(doc_ids)
+        logger.info(f"backfilled keyword index of {self.collection_name} with {count} docs")
+
+    def count_docs(self):
+        if not self.pyclient.has_collection(self.collection_name):
+            return 0
+        rows = self.pyclient.query(collection_name=self.collection_name, filter="",
+                                   output_fields=["count(*)"])
+        return rows[0]["count(*)"] if rows else 0
+
+    def rebuild_keyword_index(self):
+        if self.milvus.col is None:
+            return
+        logger.warning(f"keyword index of {self.collection_name} is out of sync, rebuilding from Milvus")
+        if not self.keyword_index.rebuild(self._iter_keyword_batches()):
+            logger.info(f"keyword index of {self.collection_name} is being rebuilt by another process")
 
     def create_vectorstore(self):
-        init_kwargs = {"embeddings": self.embeddings.embed_documents(["初始化"]),
-                       "metadatas": [{}],
-                       "partition_names": None,
-                       "replica_number": 1,
-                       "timeout": None}
-        self.milvus._init(**init_kwargs)
+        self._init_collection(self.embeddings.embed_documents(["初始化"]))
 
     def drop_vectorstore(self):
         if self.pyclient.has_collection(self.collection_name):
             self.pyclient.release_collection(self.collection_name)
             self.pyclient.drop_collection(self.collection_name)
+        if self.keyword_index is not None:
+            self.keyword_index.clear()
+        if self.parent_store is not None:
+            self.parent_store.clear()
 
     def clear_vectorstore(self):
         if self.pyclient.has_collection(self.collection_name):
             self.pyclient.release_collection(self.collection_name)
             self.pyclient.drop_collection(self.collection_name)
             self._load_milvus()
+        if self.keyword_index is not None:
+            self.keyword_index.clear()
+        if self.parent_store is not None:
+            self.parent_store.clear()
+
+    def release(self):
+        # 从 Milvus 内存中卸载集合，下次创建句柄时 langchain 会重新加载；
+        # 会影响所有使用该集合的进程，只在开启 VECTOR_STORE_RELEASE_ON_EVICT 时由注册表调用
+        if self.pyclient.has_collection(self.collection_name):
+            self.pyclient.release_collection(self.collection_name)
+            logger.info(f"released collection {self.collection_name}")
 
     def delete_doc(self, filename):
         if self.pyclient.has_collection(self.collection_name):
@@ -97,6 +259,23 @@ class MilvusVectorStore(VectorStore):
                 logger.warning(f"vs中不存在文件 {filename} 相关的记录，不需要删除")
         else:
             logger.warning(f"vs为空，没有可删除的记录")
+        if self.keyword_index is not None:
+            self.keyword_index.delete_source(filename)
+        if self.parent_store is not None:
+            self.parent_store.delete_source(filename)
+
+    def delete_doc_by_ids(self, ids: List[str]):
+        if not ids:
+            return
+        if self.keyword_index is not None:
+            self.keyword_index.delete(ids)
+        if self.parent_store is not None:
+            self.parent_store.delete(ids)
+        if self.pyclient.has_collection(self.collection_name):
+            self.pyclient.delete(collection_name=self.collection_name, ids=list(ids))
+            logger.info(f"成功删除 {len(ids)} 条记录")
+        else:
+            logger.warning(f"vs为空，没有可删除的记录")
 
     def update_doc(self, file: KnowledgeFile, docs: List[Document]):
         self.delete_doc(file.filename)
@@ -112,11 +291,21 @@ class MilvusVectorStore(VectorStore):
         参数:
         - file: KnowledgeFile类型，表示要添加的文件。
         - docs: 待添加的文档集合。
-        - **kwargs: 其他可变关键字参数。
+        - **kwargs: 其他可变关键字参数。embeddings 为与 docs 一一对应的预先计算好的向量，
+          提供时直接写入Milvus，不再调用embedding模型。
 
         返回:
         - doc_infos: 包含每个文档的id和metadata信息的列表。
         """
+        embeddings = kwargs.get("embeddings")
+        if embeddings is None and self.quantization != "none" and self.milvus.col is None:
+            # 量化知识库的集合需由本类创建，才能设置原始向量的存储方式
+            embeddings = self.embed_docs(docs)
+        if embeddings is not None and self.milvus.col is None:
+            # 集合尚未创建时，使用预先计算好的向量初始化集合
+            with self._init_lock:
+                if self.milvus.col is None:
+                    self._init_collection(embeddings)
         # 初始化文档ID列表
         doc_ids = []
         # 遍历每个文档，为它们设置元数据
@@ -138,6 +327,16 @@ class MilvusVectorStore(VectorStore):
             doc_id = doc.metadata.get("id", str(uuid.uuid4()))
             doc_ids.append(doc_id)
 
+        if embeddings is not None:
+            rows = [{self.milvus._primary_field: doc_id,
+                     self.milvus._text_field: doc.page_content,
+                     self.milvus._vector_field: vector,
+                     self.milvus._metadata_field: doc.metadata}
+                    for doc_id, doc, vector in zip(doc_ids, docs, embeddings)]
+            self.pyclient.insert(collection_name=self.collection_name, data=rows)
+            self._index_keywords(file, doc_ids, docs)
+            return [{"id": doc_id, "metadata": doc.metadata} for doc_id, doc in zip(doc_ids, docs)]
+
         # Function to yield batches of documents and their corresponding IDs
         def batch_documents(docs, doc_ids, batch_size=16):
             for i in range(0, len(docs), batch_size):
@@ -153,6 +352,7 @@ class MilvusVectorStore(VectorStore):
             batch_doc_infos = [{"id": id, "metadata": doc.metadata} for id, doc in zip(ids, batch_docs)]
             all_doc_infos.extend(batch_doc_infos)
 
+        self._index_keywords(file, [info["id"] for info in all_doc_infos], docs)
         return all_doc_infos
         # # 根据文档ID列表是否为空，调用不同的方法添加文档到Milvus
         # ids = self.milvus.add_documents(docs) if len(doc_ids) == 0 else self.milvus.add_documents(docs, **{"ids": doc_ids})
@@ -161,6 +361,14 @@ class MilvusVectorStore(VectorStore):
         #
         # return doc_infos
 
+    def _index_keywords(self, file: KnowledgeFile, doc_ids: List[str], docs: List[Document]):
+        # 关键词索引与向量库同步增量写入，不重建整个索引
+        if self.keyword_index is not None:
+            self.keyword_index.add(doc_ids, docs, source=file.filename)
+
+    def embed_docs(self, docs: List[Document]) -> List[List[float]]:
+        return self.embeddings.embed_documents([doc.page_content for doc in docs])
+
     def search_docs(self, text, top_k, threshold, **kwargs):
         """
         搜索与给定文本最相似的文档。
@@ -175,9 +383,14 @@ class MilvusVectorStore(VectorStore):
         - docs: 最相似的文档列表，可能包括原始文档和它们的父文档（如果存在）。
         """
         # 执行相似性搜索，获取最相似的文档和它们的分数
-        docs = self.milvus.similarity_search_with_score(query=text,
-                                                        k=top_k,
-                                                        **kwargs)
+        if self.quantization != "none":
+            with measure_stage("embed"):
+                embedding = self.embeddings.embed_query(text)
+            docs = self._search_rescored(embedding, top_k, kwargs.get("expr"))
+        else:
+            docs = self.milvus.similarity_search_with_score(query=text,
+                                                            k=top_k,
+                                                            **kwargs)
         # 如果设置了阈值，则过滤掉分数低于阈值的文档
         if threshold is not None:
             docs = self._score_threshold_process(docs, threshold, top_k)
@@ -201,6 +414,8 @@ class MilvusVectorStore(VectorStore):
         - List: 包含最相似文档的列表。
         """
         # 执行相似性搜索，获取最相似的文档和它们的分数
+        if self.quantization != "none":
+            return [doc for doc, _ in self.search_docs_by_vector_with_score(embedding, top_k, threshold, **kwargs)]
         docs = self.milvus.similarity_search_by_vector(embedding=embedding,
                                                         k=top_k,
                                                         **kwargs)
@@ -212,6 +427,23 @@ class MilvusVectorStore(VectorStore):
         docs = self.get_parents(docs)
         return docs
 
+    def search_docs_by_vector_with_score(self, embedding, top_k, threshold, **kwargs):
+        """
+        使用向量相似性搜索文档，保留分数，供多个知识库的结果按分数合并。
+
+        返回:
+        - [(文档, 分数)]，分数从高到低，子文档已替换为父文档。
+        """
+        if self.quantization != "none":
+            docs = self._search_rescored(embedding, top_k, kwargs.get("expr"))
+        else:
+            docs = self.milvus.similarity_search_with_score_by_vector(embedding=embedding,
+                                                                      k=top_k,
+                                                                      **kwargs)
+        if threshold is not None:
+            docs = self._score_threshold_process(docs, threshold, top_k)
+        return self.get_parents(docs)
+
     def search_docs_by_mmr(self, text, top_k, fetch_k, lambda_mult, **kwargs):
         """
         使用最大边际相关性搜索（Maximal Marginal Relevance, MMR）来检索文档。
@@ -238,15 +470,145 @@ class MilvusVectorStore(VectorStore):
         docs = self.get_parents(docs)
         return docs
 
+    def search_docs_by_mmr_vector(self, embedding, top_k, fetch_k, lambda_mult, **kwargs):
+        """
+        从给定的查询向量出发，使用最大边际相关性（MMR）检索文档。
+
+        一次查询取回 fetch_k 个候选及其向量，在本地用 NumPy 完成 MMR 选择，不再调用 embedding 服务。
+
+        参数:
+        - embedding (List[float]): 查询向量。
+        - top_k (int): 最终返回的文档数量。
+        - fetch_k (int): 从数据库中获取的候选文档数量，大于等于top_k。
+        - lambda_mult (float): MMR公式中的lambda参数，用于调整相关性和多样性的权重。
+        - **kwargs: expr 为Milvus过滤表达式。
+
+        返回:
+        - List: 经过MMR算法筛选后的文档列表。
+        """
+        if not self.pyclient.has_collection(self.collection_name):
+            return []
+        results = self.pyclient.search(collection_name=self.collection_name,
+                                       data=[embedding],
+                                       filter=kwargs.get("expr") or "",
+                                       limit=max(fetch_k, top_k),
+                                       output_fields=[self.milvus._text_field,
+                                                      self.milvus._metadata_field,
+                                                      self.milvus._vector_field],
+                                       search_params=self.search_params)
+        hits = results[0] if results else []
+        if not hits:
+            return []
+        entities = [hit["entity"] for hit in hits]
+        selected = maximal_marginal_relevance(embedding,
+                                              [entity[self.milvus._vector_field] for entity in entities],
+                                              k=top_k,
+                                              lambda_mult=lambda_mult)
+        docs = [Document(page_content=entities[i][self.milvus._text_field],
+                         metadata=entities[i][self.milvus._metadata_field]) for i in selected]
+        return self.get_parents(docs)
+
+    def _search_rescored(self, embedding, top_k, expr=None):
+        """
+        量化索引上的检索：取 top_k * oversample 个候选及其原始向量，按原始向量的内积重新排序。
+
+        返回:
+        - [(文档, 分数)]，分数从高到低。
+        """
+        if not self.pyclient.has_collection(self.collection_name):
+            return []
+        results = self.pyclient.search(collection_name=self.collection_name,
+                                       data=[embedding],
+                                       filter=expr or "",
+                                       limit=top_k * self.oversample,
+                                       output_fields=[self.milvus._text_field,
+                                                      self.milvus._metadata_field,
+                                                      self.milvus._vector_field],
+                                       search_params=self.search_params)
+        hits = results[0] if results else []
+        if not hits:
+            return []
+        entities = [hit["entity"] for hit in hits]
+        best, scores = rescore(np.asarray(embedding, dtype=np.float32),
+                               [entity[self.milvus._vector_field] for entity in entities], top_k)
+        # Milvus 返回的候选按量化距离排序
+        self.monitor.record(range(min(top_k, len(hits))), best.tolist(), len(hits))
+        return [(Document(page_content=entities[i][self.milvus._text_field],
+                          metadata=entities[i][self.milvus._metadata_field]), float(score))
+                for i, score in zip(best, scores)]
+
+    def quantization_stats(self, evaluate: bool = False):
+        """
+        返回知识库的量化方式、内存估算与召回情况。
+
+        内存按索引结构估算：HNSW 常驻原始向量与图的邻接表，IVF_SQ8 每维 1 字节，IVF_PQ 每个子空间 1 字节。
+        evaluate 为 True 时在集合的一部分向量上实测 recall@k（需要发起数十次检索）。
+        """
+        stats = {"quantization": self.quantization, "oversample": self.oversample, "rescore": self.monitor.stats()}
+        if not self.pyclient.has_collection(self.collection_name):
+            return stats
+        rows = int(self.pyclient.get_collection_stats(self.collection_name).get("row_count", 0))
+        dim = self._collection_dim()
+        index_params = self.milvus.index_params or {}
+        params = index_params.get("params", {})
+        if self.quantization == "int8":
+            search_bytes = rows * dim + self.config.ivf_nlist * dim * 4
+        elif self.quantization == "pq":
+            m = params.get("m") or pq_subquantizers(dim, config.vector_store.pq_m)
+            search_bytes = rows * m + self.config.ivf_nlist * dim * 4 + m * 256 * (dim // m) * 4
+        else:
+            # HNSW 底层每个节点 2M 个邻居
+            search_bytes = rows * (dim * 4 + 2 * params.get("M", 16) * 4)
+        stats.update(rows=rows, dim=dim,
+                     search_memory_bytes=search_bytes,
+                     full_precision_bytes=rows * dim * 4,
+                     compression_ratio=rows * dim * 4 / search_bytes if search_bytes else None)
+        if evaluate and rows:
+            stats["evaluated_recall"] = self.evaluate_recall()
+        return stats
+
+    def evaluate_recall(self, sample_size=_RECALL_SAMPLE_SIZE, queries=RECALL_QUERIES, k=RECALL_K):
+        """
+        在集合的前 sample_size 个向量内评估检索的 recall@k。
+
+        以其中随机抽取的向量为查询，检索范围用主键过滤限定在这批向量内，基准为 NumPy 精确检索的结果；
+        同时给出只按索引排序与重新打分后的召回率。范围比整个集合小，结果偏乐观。
+        """
+        pk = self.milvus._primary_field
+        rows = self.pyclient.query(collection_name=self.collection_name, filter=f'{pk} != ""',
+                                   limit=sample_size, output_fields=[pk, self.milvus._vector_field])
+        if not rows:
+            return {}
+        ids = [row[pk] for row in rows]
+        vectors = np.asarray([row[self.milvus._vector_field] for row in rows], dtype=np.float32)
+        position = {doc_id: i for i, doc_id in enumerate(ids)}
+        id_filter = f"{pk} in {json.dumps(ids, ensure_ascii=False)}"
+        k = min(k, len(ids))
+        picked = np.random.default_rng().choice(len(ids), min(queries, len(ids)), replace=False)
+        exact = exact_top_k([(0, vectors, None)], vectors[picked], k)
+        quantized, rescored = [], []
+        for query in vectors[picked]:
+            results = self.pyclient.search(collection_name=self.collection_name, data=[query.tolist()],
+                                           filter=id_filter, limit=k * self.oversample, output_fields=[pk],
+                                           search_params=self.search_params)
+            found = [position[hit["id"]] for hit in (results[0] if results else []) if hit["id"] in position]
+            best, _ = rescore(query, vectors[found], k) if found else ([], None)
+            quantized.append(found[:k])
+            rescored.append([found[i] for i in best])
+        report = recall_report(exact, quantized, rescored, k)
+        report["sample_size"] = len(ids)
+        return report
+
     def get_parents(self, docs):
         """
        召回父文档并替换当前文档列表中的子文档。
 
         该函数遍历给定的文档列表，查找每个文档的父文档ID，并构建一个映射。
-        如果找到了父文档ID，则通过调用外部服务获取父文档，并用父文档替换原始文档列表中的子文档。
+        父文档先从本地的父块存储中获取，不在其中的（启用父块存储之前建立的知识库）再从Milvus中获取，
+        并用父文档替换原始文档列表中的子文档。
 
         参数:
-        - docs: 文档列表，其中每个文档是一个包含文档信息的元组。
+        - docs: 文档列表，元素为文档或 (文档, 分数) 元组。
 
         返回:
         - 替换子文档为父文档后的文档列表。
@@ -254,24 +616,41 @@ class MilvusVectorStore(VectorStore):
         # 兼容multi_vector，召回父文档
         parent_doc_map = {}
         for i, tp in enumerate(docs):
-            parent_id = tp.metadata.get("parent_id")
-            if parent_id is not None: parent_doc_map[i] = parent_id
+            doc = tp[0] if isinstance(tp, tuple) else tp
+            parent_id = doc.metadata.get("parent_id")
+            if parent_id:
+                parent_doc_map[i] = parent_id
 
         if len(parent_doc_map) > 0:
             try:
                 # 去重后得到所有父文档的ID
                 ids = list(set(parent_doc_map.values()))
-                # 初始化父文档字典，用于存储父文档ID与文档对象的映射
-                parent_docs = {}  # parent_id: parent_doc
-                # 通过外部服务获取父文档信息，并构建父文档对象
-                for p_doc in self.pyclient.get(collection_name=self.collection_name,
-                                               ids=ids,
-                                               output_fields=["pk", "text", "metadata"]):
+                with measure_stage("parent_fetch"):
+                    # 父文档字典，存储父文档ID与文档对象的映射
+                    parent_docs = self.get_parent_docs(ids)  # parent_id: parent_doc
+                    missing = [parent_id for parent_id in ids if parent_id not in parent_docs]
+                    # 通过外部服务获取父块存储中没有的父文档，并构建父文档对象
+                    p_docs = self.pyclient.get(collection_name=self.collection_name,
+                                               ids=missing,
+                                               output_fields=["pk", "text", "metadata"]) if missing else []
+                for p_doc in p_docs:
                     parent_docs[p_doc["pk"]] = Document(page_content=p_doc["text"],
                                                         metadata=p_doc["metadata"])
+                unresolved = [parent_id for parent_id in ids if parent_id not in parent_docs]
+                if unresolved:
+                    # 父块既不在父块存储也不在Milvus中，通常是检索服务没有挂载 dataprep 的数据目录
+                    logger.warning(f"{len(unresolved)} parent chunks of {self.collection_name} not found, "
+                                   f"returning child chunks instead; check that DATA_ROOT_PATH is shared "
+                                   f"with dataprep: {unresolved[:5]}")
                 # 用父文档替换原始文档列表中的子文档
                 for doc_index in parent_doc_map:
-                    docs[doc_index] = tuple([parent_docs[parent_doc_map[doc_index]], docs[doc_index][1]])
+                    parent_doc = parent_docs.get(parent_doc_map[doc_index])
+                    if parent_doc is None:
+                        continue
+                    if isinstance(docs[doc_index], tuple):
+                        docs[doc_index] = tuple([parent_doc, docs[doc_index][1]])
+                    else:
+                        docs[doc_index] = parent_doc
 
             except Exception as e:
                 # 处理查找父文档时可能发生的异常
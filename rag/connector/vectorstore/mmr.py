@@ -0,0 +1,48 @@
+from typing import List, Sequence
+
+import numpy as np
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def maximal_marginal_relevance(query_embedding: Sequence[float],
+                               embeddings: Sequence[Sequence[float]],
+                               k: int = 4,
+                               lambda_mult: float = 0.5) -> List[int]:
+    """
+    最大边际相关性（MMR）选择，返回被选中候选的下标，按选中顺序排列。
+
+    向量先归一化，相关性为一次矩阵乘法；每选中一个候选，只计算它与全部候选的相似度，
+    增量更新每个候选与已选集合的最大相似度，整体复杂度为 O(k·n·d)，不需要构造 n×n 矩阵。
+
+    参数:
+    - query_embedding: 查询向量。
+    - embeddings: 候选向量，形状为 (n, d)。
+    - k: 选择的数量。
+    - lambda_mult: 相关性与多样性的权重，1 只看相关性，0 只看多样性。
+    """
+    candidates = np.asarray(embeddings, dtype=np.float32)
+    if candidates.ndim != 2 or candidates.shape[0] == 0 or k <= 0:
+        return []
+    candidates = _normalize(candidates)
+    query = _normalize(np.asarray(query_embedding, dtype=np.float32).reshape(1, -1))[0]
+
+    relevance = candidates @ query
+    # 第一个选中相关性最高的候选，之后每个候选与已选集合的最大相似度增量更新
+    index = int(np.argmax(relevance))
+    selected = [index]
+    max_similarity = candidates @ candidates[index]
+    available = np.ones(candidates.shape[0], dtype=bool)
+    available[index] = False
+    for _ in range(min(k, candidates.shape[0]) - 1):
+        scores = lambda_mult * relevance - (1 - lambda_mult) * max_similarity
+        scores[~available] = -np.inf
+        index = int(np.argmax(scores))
+        selected.append(index)
+        available[index] = False
+        np.maximum(max_similarity, candidates @ candidates[index], out=max_similarity)
+    return selected
@@ -0,0 +1,158 @@
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List
+
+from langchain_core.documents import Document
+
+# SQLite 单条语句的参数个数上限为 999
+_SQLITE_BATCH_SIZE = 500
+
+# small-to-big 检索中父块的 multi_vector_type，父块只存放在父块存储中，不做向量化
+PARENT_CHUNK_TYPE = "parent"
+
+
+def is_parent_chunk(doc: Document) -> bool:
+    return doc.metadata.get("multi_vector_type") == PARENT_CHUNK_TYPE
+
+
+class ParentStore:
+    """
+    单个知识库的父块存储，父块 id 到原文与 metadata 的键值表，存储在一个 SQLite 文件中。
+
+    small-to-big 检索只对子块做向量化，召回子块后在本地按 parent_id 取父块，不再回查向量库。
+    进程内用 LRU 缓存最近取过的父块：父块 id 对应的内容写入后不会改变（内容变化时重新生成 id），
+    因此缓存不需要跨进程失效，被删除的父块其子块也已从向量库删除，不会再被召回。
+    """
+
+    def __init__(self, path: str, cache_size: int = 10000):
+        self.path = path
+        self.cache_size = max(0, cache_size)
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()  # doc_id: (content, metadata)
+        self._cache_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS parents (
+                doc_id TEXT PRIMARY KEY,
+                source TEXT NOT NULL,
+                content TEXT NOT NULL,
+                metadata TEXT NOT NULL
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS ix_parents_source ON parents (source);
+        """)
+        self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _select_in(self, sql: str, values: List) -> List[tuple]:
+        rows = []
+        for i in range(0, len(values), _SQLITE_BATCH_SIZE):
+            batch = values[i:i + _SQLITE_BATCH_SIZE]
+            rows.extend(self._conn.execute(sql.format(",".join("?" * len(batch))), batch).fetchall())
+        return rows
+
+    def _evict(self, doc_ids: Iterable[str]):
+        with self._cache_lock:
+            for doc_id in doc_ids:
+                self._cache.pop(doc_id, None)
+
+    def add(self, doc_ids: List[str], docs: List[Document], source: str):
+        """添加父块，已存在的 id 覆盖写入"""
+        if not docs:
+            return
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO parents (doc_id, source, content, metadata) VALUES (?, ?, ?, ?)",
+                [(doc_id, source, doc.page_content, json.dumps(doc.metadata, ensure_ascii=False))
+                 for doc_id, doc in zip(doc_ids, docs)])
+        self._evict(doc_ids)
+
+    def get(self, doc_ids: Iterable[str]) -> Dict[str, Document]:
+        """按 id 取父块，返回 {id: 文档}，不存在的 id 不在结果中；每次返回新的文档对象"""
+        found, missing = {}, []
+        with self._cache_lock:
+            for doc_id in dict.fromkeys(doc_ids):
+                if doc_id in self._cache:
+                    self._cache.move_to_end(doc_id)
+                    found[doc_id] = self._cache[doc_id]
+                else:
+                    missing.append(doc_id)
+            self.hits += len(found)
+            self.misses += len(missing)
+        if missing:
+            with self._lock:
+                rows = self._select_in("SELECT doc_id, content, metadata FROM parents WHERE doc_id IN ({})", missing)
+            loaded = {doc_id: (content, json.loads(metadata)) for doc_id, content, metadata in rows}
+            found.update(loaded)
+            if self.cache_size:
+                with self._cache_lock:
+                    self._cache.update(loaded)
+                    while len(self._cache) > self.cache_size:
+                        self._cache.popitem(last=False)
+        return {doc_id: Document(page_content=content, metadata=dict(metadata))
+                for doc_id, (content, metadata) in found.items()}
+
+    def delete(self, doc_ids: Iterable[str]):
+        doc_ids = list(doc_ids)
+        if not doc_ids:
+            return
+        with self._lock, self._conn:
+            self._select_in("DELETE FROM parents WHERE doc_id IN ({})", doc_ids)
+        self._evict(doc_ids)
+
+    def delete_source(self, source: str):
+        """删除某个文件的全部父块"""
+        with self._lock, self._conn:
+            doc_ids = [row[0] for row in self._conn.execute("SELECT doc_id FROM parents WHERE source = ?",
+                                                            (source,))]
+            self._conn.execute("DELETE FROM parents WHERE source = ?", (source,))
+        self._evict(doc_ids)
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM parents")
+        with self._cache_lock:
+            self._cache.clear()
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM parents").fetchone()[0]
+
+    def stats(self) -> Dict:
+        with self._cache_lock:
+            lookups = self.hits + self.misses
+            return {"cached": len(self._cache), "cache_size": self.cache_size, "hits": self.hits,
+                    "misses": self.misses, "hit_rate": self.hits / lookups if lookups else None}
+
+
+_parent_stores: Dict[str, ParentStore] = {}
+_parent_stores_lock = threading.Lock()
+
+
+def get_parent_store(knowledge_name: str, root: str, cache_size: int = 10000) -> ParentStore:
+    """获取知识库的父块存储，同一个进程内每个知识库只打开一次存储文件"""
+    with _parent_stores_lock:
+        store = _parent_stores.get(knowledge_name)
+        if store is None:
+            store = ParentStore(os.path.join(root, f"{knowledge_name}.db"), cache_size=cache_size)
+            _parent_stores[knowledge_name] = store
+        return store
+
+
+def parent_store_stats() -> Dict[str, Dict]:
+    """本进程已打开的各知识库父块存储的缓存命中情况"""
+    with _parent_stores_lock:
+        stores = dict(_parent_stores)
+    return {knowledge_name: store.stats() for knowledge_name, store in stores.items()}
@@ -0,0 +1,238 @@
+from __future__ import annotations
+
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+
+# 知识库可选的向量量化方式：none 不量化；int8 每维 1 字节的标量量化；pq 乘积量化
+QUANTIZATION_MODES = ("none", "int8", "pq")
+# 训练量化器使用的最大样本数
+QUANTIZER_TRAIN_SAMPLES = 32768
+# 评估召回率使用的查询数与 k
+RECALL_QUERIES = 50
+RECALL_K = 10
+# 未配置 oversample 时各量化方式的默认值：PQ 的排序误差更大，需要更多候选
+DEFAULT_OVERSAMPLE = {"int8": 4, "pq": 32}
+_PQ_CLUSTERS = 256
+# PQ 每个子空间训练使用的最大样本数
+_PQ_TRAIN_SAMPLES = _PQ_CLUSTERS * 64
+_PQ_ITERATIONS = 10
+
+
+def normalize_quantization(mode: Optional[str]) -> str:
+    """校验并规范化量化方式，空值视为 none"""
+    mode = (mode or "none").strip().lower()
+    if mode not in QUANTIZATION_MODES:
+        raise ValueError(f"quantization {mode} is not supported, expected one of {', '.join(QUANTIZATION_MODES)}")
+    return mode
+
+
+def pq_subquantizers(dim: int, m: int = 0) -> int:
+    """PQ 子空间个数，须整除向量维度；m 为 0 时每 8 维一个子空间"""
+    m = m or max(1, dim // 8)
+    while dim % m:
+        m -= 1
+    return m
+
+
+class ScalarQuantizer:
+    """
+    int8 标量量化：每一维按训练样本的最小、最大值线性映射到 0~255。
+
+    x ≈ low + code * step，因此 q·x ≈ q·low + code·(q * step)，近似内积只需一次 uint8 矩阵乘法。
+    """
+
+    kind = "int8"
+
+    def __init__(self, low: np.ndarray, step: np.ndarray):
+        self.low = low.astype(np.float32)
+        self.step = step.astype(np.float32)
+
+    @classmethod
+    def fit(cls, samples: np.ndarray) -> "ScalarQuantizer":
+        low, high = samples.min(axis=0), samples.max(axis=0)
+        return cls(low, np.maximum(high - low, 1e-12) / 255)
+
+    @property
+    def code_size(self) -> int:
+        return len(self.low)
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        codes = np.rint((np.asarray(vectors, dtype=np.float32) - self.low) / self.step)
+        return np.clip(codes, 0, 255).astype(np.uint8)
+
+    def scores(self, query: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        return codes.astype(np.float32) @ (query * self.step) + float(query @ self.low)
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        return {"low": self.low, "step": self.step}
+
+
+class ProductQuantizer:
+    """
+    乘积量化：向量切成 m 段，每段用 256 个中心中最近的一个的编号表示，每个向量 m 字节。
+
+    检索时先算出查询每一段与该段所有中心的内积表（m×256），近似内积为查表求和。
+    """
+
+    kind = "pq"
+
+    def __init__(self, centroids: np.ndarray):
+        self.centroids = centroids.astype(np.float32)  # (m, 256, dsub)
+
+    @classmethod
+    def fit(cls, samples: np.ndarray, m: int, seed: int = 0) -> "ProductQuantizer":
+        rng = np.random.default_rng(seed)
+        if len(samples) > _PQ_TRAIN_SAMPLES:
+            samples = samples[np.sort(rng.choice(len(samples), _PQ_TRAIN_SAMPLES, replace=False))]
+        samples = np.asarray(samples, dtype=np.float32)
+        dsub = samples.shape[1] // m
+        ksub = min(_PQ_CLUSTERS, len(samples))
+        centroids = np.zeros((m, _PQ_CLUSTERS, dsub), dtype=np.float32)
+        for j in range(m):
+            sub = np.ascontiguousarray(samples[:, j * dsub:(j + 1) * dsub])
+            centroids[j, :ksub] = _kmeans(sub, ksub, rng)
+        return cls(centroids)
+
+    @property
+    def m(self) -> int:
+        return self.centroids.shape[0]
+
+    @property
+    def code_size(self) -> int:
+        return self.m
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        dsub = self.centroids.shape[2]
+        codes = np.empty((len(vectors), self.m), dtype=np.uint8)
+        for j in range(self.m):
+            sub = vectors[:, j * dsub:(j + 1) * dsub]
+            centroids = self.centroids[j]
+            codes[:, j] = np.argmax(sub @ centroids.T - 0.5 * np.einsum("ij,ij->i", centroids, centroids), axis=1)
+        return codes
+
+    def scores(self, query: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        table = np.einsum("mkd,md->mk", self.centroids, query.reshape(self.m, -1))
+        return table[np.arange(self.m), codes].sum(axis=1)
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        return {"centroids": self.centroids}
+
+
+def _kmeans(samples: np.ndarray, k: int, rng: np.random.Generator) -> np.ndarray:
+    """欧氏距离的 k-means，用于 PQ 每个子空间"""
+    centroids = samples[rng.choice(len(samples), k, replace=False)].copy()
+    for _ in range(_PQ_ITERATIONS):
+        labels = np.argmax(samples @ centroids.T - 0.5 * np.einsum("ij,ij->i", centroids, centroids), axis=1)
+        order = np.argsort(labels, kind="stable")
+        counts = np.bincount(labels, minlength=k)
+        # 空聚类保留原中心
+        non_empty = np.flatnonzero(counts)
+        starts = np.concatenate([[0], np.cumsum(counts)])[non_empty]
+        centroids[non_empty] = np.add.reduceat(samples[order], starts, axis=0) / counts[non_empty, None]
+    return centroids
+
+
+def train_quantizer(mode: str, samples: np.ndarray, pq_m: int = 0):
+    """在样本上训练量化器，mode 为 int8 或 pq"""
+    if mode == "int8":
+        return ScalarQuantizer.fit(samples)
+    if mode == "pq":
+        return ProductQuantizer.fit(samples, pq_subquantizers(samples.shape[1], pq_m))
+    raise ValueError(f"quantization {mode} has no quantizer")
+
+
+def oversample_for(mode: str, oversample: int = 0) -> int:
+    """重新打分时候选数为 top_k 的多少倍，oversample 为 0 时按量化方式取默认值"""
+    return max(1, oversample or DEFAULT_OVERSAMPLE.get(mode, 1))
+
+
+def save_quantizer(path: str, quantizer):
+    with open(path, "wb") as f:
+        np.savez(f, kind=np.array(quantizer.kind), **quantizer.arrays())
+
+
+def load_quantizer(path: str):
+    with np.load(path) as data:
+        if str(data["kind"]) == "int8":
+            return ScalarQuantizer(data["low"], data["step"])
+        return ProductQuantizer(data["centroids"])
+
+
+def rescore(query: np.ndarray, vectors: np.ndarray, top_k: int) -> tuple:
+    """用原始向量重新计算内积，返回 (候选下标, 分数)，分数从高到低"""
+    scores = np.asarray(vectors, dtype=np.float32) @ query
+    if len(scores) > top_k:
+        best = np.argpartition(-scores, top_k - 1)[:top_k]
+    else:
+        best = np.arange(len(scores))
+    best = best[np.argsort(-scores[best], kind="stable")]
+    return best, scores[best]
+
+
+def exact_top_k(blocks, queries: np.ndarray, k: int) -> np.ndarray:
+    """
+    分块精确检索，作为评估召回率的基准。
+
+    blocks 逐块给出 (起始行号, 向量块, 有效行掩码或 None)，返回每个查询内积最大的 k 个行号，形状 (查询数, k)。
+    """
+    best_rows = np.full((len(queries), 0), -1, dtype=np.int64)
+    best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+    for start, block, mask in blocks:
+        scores = np.asarray(queries @ np.asarray(block, dtype=np.float32).T)
+        if mask is not None:
+            scores[:, ~mask] = -np.inf
+        rows = np.broadcast_to(np.arange(start, start + len(block)), scores.shape)
+        best_rows = np.concatenate([best_rows, rows], axis=1)
+        best_scores = np.concatenate([best_scores, scores], axis=1)
+        if best_scores.shape[1] > k:
+            keep = np.argpartition(-best_scores, k - 1, axis=1)[:, :k]
+            best_rows = np.take_along_axis(best_rows, keep, axis=1)
+            best_scores = np.take_along_axis(best_scores, keep, axis=1)
+    return best_rows
+
+
+def recall_report(exact: np.ndarray, quantized: List[List[int]], rescored: List[List[int]], k: int) -> Dict:
+    """按精确检索结果计算只按量化排序与重新打分后的 recall@k"""
+    hits_quantized = hits_rescored = 0
+    for truth, quantized_top, rescored_top in zip(exact, quantized, rescored):
+        truth = set(truth.tolist())
+        hits_quantized += len(truth.intersection(quantized_top[:k]))
+        hits_rescored += len(truth.intersection(rescored_top[:k]))
+    total = max(1, len(exact) * k)
+    return {"recall_at_k": hits_rescored / total, "quantized_recall_at_k": hits_quantized / total,
+            "recall_k": k, "recall_queries": len(exact)}
+
+
+class RescoreMonitor:
+    """
+    统计量化检索的重新打分效果。
+
+    每次检索记录只按量化分数取的 top k 与重新打分后的 top k 的重合比例：比例接近 1 说明量化排序已足够准确，
+    可以降低 oversample；比例偏低说明重新打分在纠正量化误差。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.searches = 0
+        self.candidates = 0
+        self.overlap = 0
+        self.returned = 0
+
+    def record(self, quantized_top, rescored_top, candidates: int):
+        overlap = len(set(quantized_top).intersection(rescored_top))
+        with self._lock:
+            self.searches += 1
+            self.candidates += candidates
+            self.overlap += overlap
+            self.returned += len(rescored_top)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "searches": self.searches,
+                "average_candidates": self.candidates / self.searches if self.searches else None,
+                "quantized_top_k_overlap": self.overlap / self.returned if self.returned else None,
+            }
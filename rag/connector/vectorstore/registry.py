@@ -0,0 +1,114 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Optional, Tuple
+
+from comps import CustomLogger
+from rag.connector.vectorstore.base import VectorStore
+
+logger = CustomLogger("vectorstore_registry")
+
+
+class VectorStoreRegistry:
+    """
+    进程内的向量库句柄注册表。
+
+    按 (知识库名, 向量库类型, embedding 模型) 缓存 VectorStore，最多保留 max_size 个句柄，
+    超出数量或空闲超过 idle_seconds 的句柄按 LRU 淘汰，默认只丢弃本进程的句柄；
+    集合在服务端由所有进程共享，淘汰时仍可能有其他进程或本进程进行中的检索在使用，
+    只有 release_on_evict 为 True（集合只由本进程使用）时才调用 release() 卸载服务端的集合。
+    知识库被删除或清空后调用 invalidate() 使对应句柄失效，下次获取时重新创建。
+    """
+
+    def __init__(self,
+                 factory: Callable[[str, str, Hashable], VectorStore],
+                 max_size: int = 64,
+                 idle_seconds: int = 1800,
+                 release_on_evict: bool = False):
+        self.factory = factory
+        self.max_size = max(1, max_size)
+        self.idle_seconds = idle_seconds
+        self.release_on_evict = release_on_evict
+        self._stores: "OrderedDict[Tuple, Tuple[VectorStore, float]]" = OrderedDict()  # key: (store, last_used)
+        self._lock = threading.Lock()
+        self._creating: Dict[Tuple, threading.Lock] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, knowledge_name: str, vs_type: str, embedding_model: Hashable) -> VectorStore:
+        key = (knowledge_name, vs_type, embedding_model)
+        store = self._lookup(key)
+        if store is not None:
+            return store
+
+        # 创建句柄较慢（连接并加载集合），只对同一个 key 串行，不阻塞其他知识库的获取
+        with self._lock:
+            create_lock = self._creating.setdefault(key, threading.Lock())
+        with create_lock:
+            store = self._lookup(key)
+            if store is not None:
+                return store
+            store = self.factory(knowledge_name, vs_type, embedding_model)
+            with self._lock:
+                self.misses += 1
+                self._stores[key] = (store, time.monotonic())
+                self._creating.pop(key, None)
+                evicted = self._collect_evictions(time.monotonic())
+        self._release(evicted)
+        return store
+
+    def _lookup(self, key: Tuple) -> Optional[VectorStore]:
+        with self._lock:
+            entry = self._stores.get(key)
+            if entry is None:
+                return None
+            now = time.monotonic()
+            self.hits += 1
+            self._stores[key] = (entry[0], now)
+            self._stores.move_to_end(key)
+            evicted = self._collect_evictions(now)
+        self._release(evicted)
+        return entry[0]
+
+    def _collect_evictions(self, now: float) -> list:
+        evicted = []
+        while len(self._stores) > self.max_size:
+            _, (store, _) = self._stores.popitem(last=False)
+            evicted.append(store)
+        if self.idle_seconds > 0:
+            for key, (store, last_used) in list(self._stores.items()):
+                if now - last_used <= self.idle_seconds:
+                    # 按使用时间排序，后面的句柄更新
+                    break
+                del self._stores[key]
+                evicted.append(store)
+        self.evictions += len(evicted)
+        return evicted
+
+    def _release(self, stores: list):
+        if not self.release_on_evict:
+            return
+        for store in stores:
+            try:
+                store.release()
+            except Exception as e:
+                logger.warning(f"release vector store {getattr(store, 'collection_name', store)} failed: {e}")
+
+    def invalidate(self, knowledge_name: str):
+        """知识库被删除或清空后，丢弃该知识库的所有句柄"""
+        with self._lock:
+            for key in [key for key in self._stores if key[0] == knowledge_name]:
+                del self._stores[key]
+
+    def stats(self) -> Dict:
+        """返回当前打开的句柄数量及命中统计"""
+        with self._lock:
+            return {
+                "open_handles": len(self._stores),
+                "max_size": self.max_size,
+                "knowledge_names": [key[0] for key in self._stores],
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
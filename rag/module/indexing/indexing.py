@@ -1,18 +1,21 @@
 from abc import ABC
+from collections import defaultdict
 from dataclasses import dataclass
 import os
 import uuid
-from typing import List, Union, Tuple, Dict
+from typing import List, Union, Tuple, Dict, Optional, Iterable
 
 from langchain_core.documents import Document
 from langchain_text_splitters import TextSplitter
 
 from comps import CustomLogger
-from rag.common.utils import run_in_thread_pool
+from rag.common.configuration import config
+from rag.common.utils import md5_encryption
 from rag.connector.database.service.knowledge_file_service import KnowledgeFileService
 from rag.connector.vectorstore.base import VectorStore
 from rag.module.knowledge_file import KnowledgeFile
 from rag.module.indexing.multi_vector import split_smaller_chunks
+from rag.module.indexing.pipeline import IndexingPipeline
 from rag.module.indexing.splitter import DOCUMENTS_SPLITER_MAPPING
 
 logger = CustomLogger("Indexing")
@@ -28,17 +31,16 @@ class Indexing(ABC):
 
     def load(self,
              file: KnowledgeFile,
-             loader: None):
+             loader: None) -> Iterable[Document]:
         if loader is None:
             loader_class = file.document_loader
         else:
             loader_class = loader   
         if file.type == 'file':
             file_path = file.filename if os.path.exists(file.filename) else file.filepath
-        else:
-            file_path = file.filename
-        docs = loader_class(file_path).load()
-        return docs
+            # 文件按页惰性加载，切分与后续页面的解析/OCR 重叠进行
+            return loader_class(file_path).lazy_load()
+        return loader_class(file.filename).load()
 
     def split(self,
               docs: List[Document],
@@ -52,48 +54,181 @@ class Indexing(ABC):
         for chunk in chunks:
             chunk.metadata["id"] = str(uuid.uuid4())
             chunk.metadata["index"] = index
+            chunk.metadata["chunk_hash"] = md5_encryption(chunk.page_content)
             index += 1
 
         multi_vector_chunks = []
         if self.smaller_chunk_size is not None and int(self.smaller_chunk_size) > 0:
             multi_vector_chunks.extend(split_smaller_chunks(chunks, self.smaller_chunk_size))
+            # 子文档哈希包含父文档哈希，父文档变化时子文档一并重新索引
+            parent_hashes = {chunk.metadata["id"]: chunk.metadata["chunk_hash"] for chunk in chunks}
+            for chunk in multi_vector_chunks:
+                chunk.metadata["chunk_hash"] = md5_encryption(
+                    parent_hashes[chunk.metadata["parent_id"]] + chunk.page_content)
 
         return chunks + multi_vector_chunks
 
-    def file2chunks(self, file, **kwargs) -> Tuple[bool, Tuple[KnowledgeFile, List[Document]]]:
+    def content_hash(self,
+                     file: KnowledgeFile,
+                     docs: Optional[List[Document]] = None) -> str:
+        """
+        计算文件的内容哈希。
+
+        文件类型直接对文件字节做哈希，无需加载；url 类型需要先加载，对加载后的文本做哈希。
+        切分参数同样参与哈希，切分参数变化时即使内容未变也会重新切分。
+        """
+        file_hash = file.get_hash()
+        if file_hash is None:
+            file_hash = md5_encryption("".join(doc.page_content for doc in docs or []))
+        splitter_name = getattr(file.text_splitter, "__name__", str(file.text_splitter))
+        return md5_encryption(f"{file_hash}:{splitter_name}:{self.chunk_size}:"
+                              f"{self.chunk_overlap}:{self.smaller_chunk_size}")
+
+    def is_unchanged(self, file: KnowledgeFile, content_hash: str) -> bool:
+        return content_hash == self.knowledge_file_service.get_file_content_hash(file.knowledge_name,
+                                                                                  file.filename)
+
+    def file2chunks(self, file, **kwargs) -> Tuple[bool, Tuple[KnowledgeFile, Optional[List[Document]], List[Document], str]]:
         try:
-            docs = self.load(file=file, loader=None)
+            content_hash = None
+            if file.get_type() == 'file':
+                content_hash = self.content_hash(file)
+                if self.is_unchanged(file, content_hash):
+                    logger.info(f"{file.filename} unchanged, skip indexing")
+                    return True, (file, None, [], content_hash)
+            # 调用方已获取内容时（如爬虫抓取的页面）直接使用，不再重复加载
+            docs = kwargs["docs"] if "docs" in kwargs else self.load(file=file, loader=None)
+            if content_hash is None:
+                content_hash = self.content_hash(file, docs)
+                if self.is_unchanged(file, content_hash):
+                    logger.info(f"{file.filename} unchanged, skip indexing")
+                    return True, (file, None, docs, content_hash)
             chunks = self.split(docs=docs, splitter=file.text_splitter)
-            return True, (file, chunks, docs)
+            return True, (file, chunks, docs, content_hash)
         except Exception as e:
             msg = f"load {file.filename} file error：{e}"
             logger.error(f'{e.__class__.__name__}: {msg}')
-            return False, (file, msg, [])
+            return False, (file, msg, [], "")
+
+    def diff_chunks(self,
+                    chunks: List[Document],
+                    old_docs: List[Dict]) -> Tuple[List[Dict], List[Document], List[str]]:
+        """
+        对比新切分的文档块与上次索引记录的文档块。
+
+        参数:
+        - chunks: 新切分的文档块，父文档在前、子文档在后。
+        - old_docs: 上次索引记录的文档信息，形式：[{"id": str, "metadata": dict, "chunk_hash": str}, ...]
+
+        返回:
+        - kept_doc_infos: 内容未变化、直接复用的文档信息。
+        - new_chunks: 需要重新向量化并写入向量库的文档块。
+        - stale_ids: 需要从向量库中删除的旧文档ID。
+        """
+        reusable = defaultdict(list)  # chunk_hash: [doc_info]
+        stale_ids = []
+        for doc in old_docs:
+            if doc.get("chunk_hash"):
+                reusable[doc["chunk_hash"]].append(doc)
+            else:
+                stale_ids.append(doc["id"])
+
+        id_map = {}  # new chunk id: reused doc id
+        kept_doc_infos, new_chunks = [], []
+        for chunk in chunks:
+            parent_id = chunk.metadata.get("parent_id")
+            if parent_id is not None:
+                chunk.metadata["parent_id"] = id_map.get(parent_id, parent_id)
+            candidates = reusable.get(chunk.metadata["chunk_hash"])
+            if candidates:
+                old_doc = candidates.pop()
+                id_map[chunk.metadata["id"]] = old_doc["id"]
+                kept_doc_infos.append({"id": old_doc["id"], "metadata": old_doc["metadata"]})
+            else:
+                new_chunks.append(chunk)
+
+        stale_ids.extend(doc["id"] for docs in reusable.values() for doc in docs)
+        return kept_doc_infos, new_chunks, stale_ids
+
+    def plan(self,
+             file: KnowledgeFile,
+             chunks: List[Document]) -> Tuple[List[Dict], List[Document], List[str]]:
+        """
+        确定文件需要写入向量库的文档块。
+
+        返回:
+        - kept_doc_infos: 内容未变化、直接复用的文档信息。
+        - new_chunks: 需要向量化并写入向量库的文档块。
+        - stale_ids: 新文档写入成功后需要从向量库删除的旧文档ID。
+        """
+        old_docs = self.knowledge_file_service.list_docs_from_db(kb_name=file.knowledge_name,
+                                                                 file_name=file.filename)
+        if any(doc.get("chunk_hash") for doc in old_docs):
+            # 增量更新：只删除变化的文档块，只向量化新增的文档块
+            kept_doc_infos, new_chunks, stale_ids = self.diff_chunks(chunks, old_docs)
+            logger.info(f"{file.filename} incremental indexing: kept {len(kept_doc_infos)}, "
+                        f"added {len(new_chunks)}, deleted {len(stale_ids)}")
+            return kept_doc_infos, new_chunks, stale_ids
+        # 没有可复用的记录，全量写入；旧文档在新文档写入成功后再删除，写入失败时旧文档仍可检索
+        new_ids = {chunk.metadata.get("id") for chunk in chunks}
+        stale_ids = [doc["id"] for doc in old_docs if doc["id"] not in new_ids]
+        logger.info(f"{file.filename} full indexing: added {len(chunks)}, deleted {len(stale_ids)}")
+        return [], chunks, stale_ids
+
+    def commit(self,
+               file: KnowledgeFile,
+               docs_count: int,
+               content_hash: str,
+               doc_infos: List[Dict],
+               stale_ids: List[str]):
+        """删除过期文档并更新数据库中的文件与文档记录"""
+        self.vectorstore.delete_doc_by_ids(stale_ids)
+        # 文件记录与文档记录在同一个事务中替换
+        return self.knowledge_file_service.replace_file_in_db(file,
+                                                              docs_count=docs_count,
+                                                              doc_infos=doc_infos,
+                                                              content_hash=content_hash)
 
     def store(self,
               file: KnowledgeFile,
-              chunks: List[Document]):
-
-        del_status = self.knowledge_file_service.delete_file_from_db(file)
-        doc_infos = self.vectorstore.update_doc(file=file, docs=chunks)
-        add_db_status = self.knowledge_file_service.add_file_to_db(file, docs_count=len(chunks)) and \
-                        self.knowledge_file_service.add_docs_to_db(file.knowledge_name,
-                                       file.filename,
-                                       doc_infos=doc_infos)
-        return del_status and add_db_status
+              chunks: List[Document],
+              content_hash: str = ""):
+        kept_doc_infos, new_chunks, stale_ids = self.plan(file, chunks)
+        parents, new_chunks = self.vectorstore.split_parent_docs(new_chunks)
+        doc_infos = kept_doc_infos + (self.vectorstore.add_parent_docs(file, parents) if parents else [])
+        doc_infos += self.vectorstore.add_doc(file=file, docs=new_chunks) if new_chunks else []
+        return self.commit(file,
+                           docs_count=len(chunks),
+                           content_hash=content_hash,
+                           doc_infos=doc_infos,
+                           stale_ids=stale_ids)
 
     def index(self,
               files: List[Union[KnowledgeFile, Tuple[str, str], Dict]], ):
-        failed_files = {}
-        kwargs_list = []
-        for i, file in enumerate(files):
-            kwargs = {"file": file}
-            kwargs_list.append(kwargs)
-        for status, result in run_in_thread_pool(func=self.file2chunks, params=kwargs_list):
-            if status:
-                file, chunks, docs = result
-                self.store(file, chunks)
-            else:
-                file, error = result
-                failed_files[file.filename] = error
-        return failed_files
+        pipeline = IndexingPipeline(self,
+                                    load_workers=config.indexing.load_workers,
+                                    embed_workers=config.indexing.embed_workers,
+                                    upsert_workers=config.indexing.upsert_workers,
+                                    embed_batch_size=config.indexing.embed_batch_size,
+                                    queue_size=config.indexing.queue_size)
+        return pipeline.run(files)
+
+    def index_docs(self,
+                   file: KnowledgeFile,
+                   docs: List[Document]) -> Dict[str, str]:
+        """
+        索引已加载的文档，返回失败文件及错误信息：{filename: error}
+        """
+        status, result = self.file2chunks(file, docs=docs)
+        if not status:
+            return {file.filename: result[1]}
+        file, chunks, _, content_hash = result
+        if chunks is None:
+            return {}
+        try:
+            self.store(file, chunks, content_hash=content_hash)
+        except Exception as e:
+            msg = f"index {file.filename} file error：{e}"
+            logger.error(f'{e.__class__.__name__}: {msg}')
+            return {file.filename: msg}
+        return {}
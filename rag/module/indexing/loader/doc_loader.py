@@ -10,7 +10,7 @@ from docx.text.paragraph import Paragraph
 from docx import Document, ImagePart
 from PIL import Image
 from io import BytesIO
-from rag.module.indexing.loader.ocr import get_rapid_ocr
+from rag.module.indexing.loader.ocr import get_ocr_service
 import numpy as np
 
 
@@ -23,9 +23,11 @@ class CustomizedOcrDocLoader(UnstructuredFileLoader):
     def _get_elements(self) -> List:
         def doc2text(filepath):
 
-            ocr = get_rapid_ocr()
+            ocr_service = get_ocr_service()
             doc = Document(filepath)
-            resp = ""
+            # 文本片段，图片位置先放入图片序号，全部图片并行 OCR 后再替换
+            parts = []
+            images = []
 
             def iter_block_items(parent):
                 from docx.document import Document
@@ -49,27 +51,27 @@ class CustomizedOcrDocLoader(UnstructuredFileLoader):
                     "CustomizedOcrDocLoader block dataprep: {}".format(i))
                 b_unit.refresh()
                 if isinstance(block, Paragraph):
-                    resp += block.text.strip() + "\n"
+                    parts.append(block.text.strip() + "\n")
 
-                    images = block._element.xpath('.//pic:pic')  # 获取所有图片
-                    for image in images:
-                        for img_id in image.xpath('.//a:blip/@r:embed'):  # 获取图片id
+                    pics = block._element.xpath('.//pic:pic')  # 获取所有图片
+                    for pic in pics:
+                        for img_id in pic.xpath('.//a:blip/@r:embed'):  # 获取图片id
                             part = doc.part.related_parts[img_id]  # 根据图片id获取对应的图片
                             if isinstance(part, ImagePart):
                                 image = Image.open(BytesIO(part._blob))
-                                result, _ = ocr(np.array(image))
-                                if result:
-                                    ocr_result = [line[1] for line in result]
-                                    resp += "\n".join(ocr_result)
+                                parts.append(len(images))
+                                images.append(np.array(image))
 
                 elif isinstance(block, Table):
                     for row in block.rows:
                         for cell in row.cells:
                             for paragraph in cell.paragraphs:
-                                resp += paragraph.text.strip() + "\n"
+                                parts.append(paragraph.text.strip() + "\n")
 
                 b_unit.update(1)
-            return resp
+
+            ocr_texts = ocr_service.ocr_images(images)
+            return "".join(ocr_texts[part] if isinstance(part, int) else part for part in parts)
 
         text = doc2text(self.file_path)
         from unstructured.partition.text import partition_text
@@ -1,5 +1,13 @@
-from typing import TYPE_CHECKING
+import atexit
+import multiprocessing
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import TYPE_CHECKING, List, Union
 
+import numpy as np
+
+from rag.common.configuration import config
 
 if TYPE_CHECKING:
     try:
@@ -16,3 +24,150 @@ def get_rapid_ocr(use_cuda: bool = True) -> "RapidOCR":
         from rapidocr_onnxruntime import RapidOCR
         ocr = RapidOCR()
     return ocr
+
+
+def _result_to_text(result) -> str:
+    if not result:
+        return ""
+    return "\n".join(line[1] for line in result)
+
+
+# OCR 子进程中常驻的模型，进程启动时加载一次
+_worker_ocr = None
+
+
+def _init_worker(use_cuda: bool):
+    global _worker_ocr
+    _worker_ocr = get_rapid_ocr(use_cuda=use_cuda)
+
+
+def _ocr_shared_memory(name: str, shape, dtype: str) -> str:
+    # 共享内存由主进程创建并负责释放，子进程只读取后关闭
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        image = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+        result, _ = _worker_ocr(image)
+        del image
+        return _result_to_text(result)
+    finally:
+        shm.close()
+
+
+def _ocr_bytes(image_bytes: bytes) -> str:
+    result, _ = _worker_ocr(image_bytes)
+    return _result_to_text(result)
+
+
+class OcrService:
+    """
+    OCR 服务。
+
+    在进程池中执行 OCR，每个子进程启动时加载一次 RapidOCR 模型并常驻，避免每个加载器重复初始化模型，
+    同时绕开 GIL 让多张图片在多个 CPU 核上并行识别。图片数组通过共享内存传给子进程，不做 pickle 拷贝。
+    workers 为 0 时退化为在当前进程中使用单个常驻模型。
+    """
+
+    def __init__(self, workers: int, use_cuda: bool = True):
+        self.workers = workers
+        self.use_cuda = use_cuda
+        self._pool = None
+        self._local_ocr = None
+        self._lock = threading.Lock()
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                # 使用 spawn 避免在多线程进程中 fork
+                self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context("spawn"),
+                                                 initializer=_init_worker,
+                                                 initargs=(self.use_cuda,))
+            return self._pool
+
+    def _ocr_local(self, images: List[Union[np.ndarray, bytes]]) -> List[str]:
+        with self._lock:
+            if self._local_ocr is None:
+                self._local_ocr = get_rapid_ocr(use_cuda=self.use_cuda)
+            return [_result_to_text(self._local_ocr(image)[0]) for image in images]
+
+    def submit_images(self, images: List[Union[np.ndarray, bytes]]) -> "OcrBatch":
+        """
+        提交一批图片进行 OCR，立即返回，调用 OcrBatch.result() 获取与输入一一对应的文本。
+
+        参数:
+        - images: 图片列表，元素为 HWC 格式的 numpy 数组或编码后的图片字节。
+        """
+        if not images:
+            return OcrBatch(texts=[])
+        if self.workers <= 0:
+            return OcrBatch(texts=self._ocr_local(images))
+
+        pool = self._get_pool()
+        futures, blocks = [], []
+        try:
+            for image in images:
+                if isinstance(image, np.ndarray):
+                    image = np.ascontiguousarray(image)
+                    shm = shared_memory.SharedMemory(create=True, size=max(image.nbytes, 1))
+                    blocks.append(shm)
+                    np.ndarray(image.shape, dtype=image.dtype, buffer=shm.buf)[:] = image
+                    futures.append(pool.submit(_ocr_shared_memory, shm.name, image.shape, image.dtype.str))
+                else:
+                    futures.append(pool.submit(_ocr_bytes, image))
+        except Exception:
+            OcrBatch(futures=futures, blocks=blocks).release()
+            raise
+        return OcrBatch(futures=futures, blocks=blocks)
+
+    def ocr_images(self, images: List[Union[np.ndarray, bytes]]) -> List[str]:
+        """识别一批图片，返回与输入一一对应的文本"""
+        return self.submit_images(images).result()
+
+    def ocr_image(self, image: Union[np.ndarray, bytes]) -> str:
+        return self.ocr_images([image])[0]
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+
+class OcrBatch:
+    """已提交的一批 OCR 任务，result() 等待全部完成并释放共享内存"""
+
+    def __init__(self, texts: List[str] = None, futures: List[Future] = None,
+                 blocks: List[shared_memory.SharedMemory] = None):
+        self._texts = texts
+        self._futures = futures or []
+        self._blocks = blocks or []
+
+    def release(self):
+        for future in self._futures:
+            future.cancel()
+        for shm in self._blocks:
+            shm.close()
+            shm.unlink()
+        self._blocks = []
+
+    def result(self) -> List[str]:
+        if self._texts is None:
+            try:
+                self._texts = [future.result() for future in self._futures]
+            finally:
+                self.release()
+        return self._texts
+
+
+_ocr_service = None
+_ocr_service_lock = threading.Lock()
+
+
+def get_ocr_service() -> OcrService:
+    """获取进程内共享的 OCR 服务"""
+    global _ocr_service
+    with _ocr_service_lock:
+        if _ocr_service is None:
+            _ocr_service = OcrService(workers=config.ocr.workers, use_cuda=config.ocr.use_cuda)
+            atexit.register(_ocr_service.shutdown)
+        return _ocr_service
@@ -4,7 +4,7 @@ from langchain_core.documents import Document
 from langchain_community.document_loaders.base import BaseLoader
 
 from comps import CustomLogger
-from rag.module.indexing.loader.ocr import get_rapid_ocr
+from rag.module.indexing.loader.ocr import get_ocr_service
 
 logger = CustomLogger("pptx_loader")
 # 设置图片 OCR 阈值比例
@@ -13,7 +13,7 @@ TEXT_LENGTH_THRESHOLD = 500
 class CustomizedPPTXLoader(BaseLoader, ABC):
     def __init__(self, file_path):
         self.file_path = file_path
-        self.ocr = get_rapid_ocr()  # OCR 模块
+        self.ocr_service = get_ocr_service()  # OCR 服务
 
     def load(self):
         ppt = Presentation(self.file_path)
@@ -67,12 +67,10 @@ class CustomizedPPTXLoader(BaseLoader, ABC):
             height_ratio = display_height / slide_height
             # # 判断图片大小是否超过阈值
             if width_ratio >= PPTX_OCR_THRESHOLD[0] or height_ratio >= PPTX_OCR_THRESHOLD[1]:
-                # 保存图片到本地
-                result, _ = self.ocr(image_bytes)
-                if result:
-                    ocr_result = [line[1] for line in result]
-                    logger.info("ocr result:", ocr_result)
-                    return "\n".join(ocr_result)
+                text = self.ocr_service.ocr_image(image_bytes)
+                if text:
+                    logger.info(f"ocr result: {text}")
+                    return text
         return None  # 如果不满足阈值条件，则返回 None
 
 
@@ -240,6 +240,54 @@ class CustomizedWebBaseLoader(BaseLoader):
         # 默认返回英语
         return 'en'
 
+    def parse(self, url: str, html_content: str, encoding: Optional[str] = None) -> Document:
+        """
+        从已获取的页面内容中提取正文和元数据，爬虫抓取一次页面后可直接复用页面内容
+        Args:
+            url: 页面URL
+            html_content: 页面HTML
+            encoding: 页面编码
+        Returns:
+            Document: 文档对象
+        """
+        # 检测语言
+        logger.info("检测页面语言...")
+        soup = BeautifulSoup(html_content, 'html.parser', from_encoding=encoding)
+        target_lang = self._detect_language(soup)
+        logger.info(f"检测到语言: {target_lang}")
+        
+        # 提取内容
+        if self.custom_parser:
+            logger.info("使用trafilatura提取主要内容...")
+            text = trafilatura.extract(
+                html_content,
+                include_links=True,
+                include_images=True,
+                include_formatting=True,
+                target_language=target_lang
+            )
+            if not text:
+                logger.warning("trafilatura提取失败，回退到BeautifulSoup")
+                text = self._extract_text(soup)
+        else:
+            logger.info("使用BeautifulSoup提取内容...")
+            cleaned_html = self._clean_html(html_content)
+            soup = BeautifulSoup(cleaned_html, 'html.parser', from_encoding=encoding)
+            text = self._extract_text(soup)
+        
+        # 提取元数据
+        logger.info("提取页面元数据...")
+        metadata = self._extract_metadata(soup, url)
+        metadata['language'] = target_lang
+        
+        # 创建文档
+        logger.info("创建文档对象...")
+        doc = Document(
+            page_content=text,
+            metadata=metadata
+        )
+        return doc
+
     def load(self) -> List[Document]:
         """
         加载网页内容
@@ -257,46 +305,11 @@ class CustomizedWebBaseLoader(BaseLoader):
                 html_content = response.text
                 logger.info(f"页面编码: {response.encoding}")
                 
-                # 检测语言
-                logger.info("检测页面语言...")
-                soup = BeautifulSoup(html_content, 'html.parser', from_encoding=response.encoding)
-                target_lang = self._detect_language(soup)
-                logger.info(f"检测到语言: {target_lang}")
-                
-                # 提取内容
-                if self.custom_parser:
-                    logger.info("使用trafilatura提取主要内容...")
-                    text = trafilatura.extract(
-                        html_content,
-                        include_links=True,
-                        include_images=True,
-                        include_formatting=True,
-                        target_language=target_lang
-                    )
-                    if not text:
-                        logger.warning("trafilatura提取失败，回退到BeautifulSoup")
-                        text = self._extract_text(soup)
-                else:
-                    logger.info("使用BeautifulSoup提取内容...")
-                    cleaned_html = self._clean_html(html_content)
-                    soup = BeautifulSoup(cleaned_html, 'html.parser', from_encoding=response.encoding)
-                    text = self._extract_text(soup)
-                
-                # 提取元数据
-                logger.info("提取页面元数据...")
-                metadata = self._extract_metadata(soup, url)
-                metadata['language'] = target_lang
-                
-                # 创建文档
-                logger.info("创建文档对象...")
-                doc = Document(
-                    page_content=text,
-                    metadata=metadata
-                )
+                doc = self.parse(url, html_content, response.encoding)
                 docs.append(doc)
                 
-                logger.info(f"成功加载文档，内容长度: {len(text)}")
-                logger.debug(f"元数据: {metadata}")
+                logger.info(f"成功加载文档，内容长度: {len(doc.page_content)}")
+                logger.debug(f"元数据: {doc.metadata}")
                 
             except requests.RequestException as e:
                 logger.error(f"获取 {url} 失败 (重试 {self.max_retries} 次): {str(e)}")
@@ -1,6 +1,7 @@
 import uuid
 from typing import List
 from langchain_core.documents import Document
+from rag.connector.vectorstore.parent_store import PARENT_CHUNK_TYPE
 from rag.module.indexing.splitter.chinese_recursive_text_splitter import ChineseRecursiveTextSplitter
 
 
@@ -15,6 +16,8 @@ def split_smaller_chunks(documents: List[Document], smaller_chunk_size: int):
     for i, doc in enumerate(documents):
         parent_id = doc_ids[i]
         sub_docs = child_splitter.split_documents([doc])
+        # 父块只用于召回后替换子块，写入父块存储，不做向量化
+        doc.metadata['multi_vector_type'] = PARENT_CHUNK_TYPE
         for sub_doc in sub_docs:
             sub_doc.metadata['parent_id'] = parent_id
             sub_doc.metadata['id'] = str(uuid.uuid4())
@@ -0,0 +1,220 @@
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from comps import CustomLogger
+from rag.module.knowledge_file import KnowledgeFile
+
+logger = CustomLogger("IndexingPipeline")
+
+# 队列结束标记
+_STOP = object()
+
+
+@dataclass
+class FileTask:
+    """流水线中单个文件的处理状态"""
+    file: KnowledgeFile
+    docs_count: int
+    content_hash: str
+    doc_infos: List[Dict]
+    stale_ids: List[str]
+    inserted_ids: List[str] = field(default_factory=list)
+    pending_batches: int = 0
+    error: Optional[str] = None
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+
+class IndexingPipeline:
+    """
+    分阶段流水线索引：加载/切分 → 向量化 → 写入向量库 → 数据库记录。
+
+    各阶段使用独立的线程池，阶段之间通过有界队列连接：向量化或写入跟不上时，
+    加载线程会阻塞在队列上，内存中只保留有限数量的待处理批次；
+    文件解析与向量化并行进行，使 embedding 服务保持满载。
+    数据库记录阶段只有一个线程，避免 SQLite 写锁竞争。
+    """
+
+    def __init__(self,
+                 indexing,
+                 load_workers: int = 4,
+                 embed_workers: int = 4,
+                 upsert_workers: int = 2,
+                 embed_batch_size: int = 16,
+                 queue_size: int = 8):
+        self.indexing = indexing
+        self.vectorstore = indexing.vectorstore
+        self.load_workers = max(1, load_workers)
+        self.embed_workers = max(1, embed_workers)
+        self.upsert_workers = max(1, upsert_workers)
+        self.embed_batch_size = max(1, embed_batch_size)
+        self.queue_size = max(1, queue_size)
+        self._failed_files = {}
+        self._failed_lock = threading.Lock()
+
+    def run(self, files: List[KnowledgeFile]) -> Dict[str, str]:
+        """
+        索引文件列表，返回失败文件及错误信息：{filename: error}
+        """
+        start = time.time()
+        self._failed_files = {}
+        self._file_queue = queue.Queue()
+        self._embed_queue = queue.Queue(maxsize=self.queue_size)
+        self._upsert_queue = queue.Queue(maxsize=self.queue_size)
+        self._commit_queue = queue.Queue()
+
+        for file in files:
+            self._file_queue.put(file)
+
+        loaders = self._start(self._load_worker, self.load_workers, "load")
+        embedders = self._start(self._embed_worker, self.embed_workers, "embed")
+        upserters = self._start(self._upsert_worker, self.upsert_workers, "upsert")
+        committers = self._start(self._commit_worker, 1, "commit")
+
+        # 上游阶段全部结束后，再向下游发送结束标记
+        self._stop(self._file_queue, loaders)
+        self._stop(self._embed_queue, embedders)
+        self._stop(self._upsert_queue, upserters)
+        self._stop(self._commit_queue, committers)
+
+        logger.info(f"indexing {len(files)} files done in {time.time() - start:.2f}s, "
+                    f"failed: {len(self._failed_files)}")
+        return self._failed_files
+
+    @staticmethod
+    def _start(target, workers: int, name: str) -> List[threading.Thread]:
+        threads = [threading.Thread(target=target, name=f"indexing-{name}-{i}", daemon=True)
+                   for i in range(workers)]
+        for thread in threads:
+            thread.start()
+        return threads
+
+    @staticmethod
+    def _stop(q: queue.Queue, threads: List[threading.Thread]):
+        for _ in threads:
+            q.put(_STOP)
+        for thread in threads:
+            thread.join()
+
+    def _fail(self, task: FileTask, e: Exception):
+        msg = f"index {task.file.filename} file error：{e}"
+        logger.error(f'{e.__class__.__name__}: {msg}')
+        with task.lock:
+            if task.error is None:
+                task.error = msg
+
+    def _batch_done(self, task: FileTask):
+        with task.lock:
+            task.pending_batches -= 1
+            done = task.pending_batches == 0
+        if done:
+            self._commit_queue.put(task)
+
+    def _load_worker(self):
+        while True:
+            file = self._file_queue.get()
+            if file is _STOP:
+                return
+            status, result = self.indexing.file2chunks(file)
+            if not status:
+                file, error, _, _ = result
+                with self._failed_lock:
+                    self._failed_files[file.filename] = error
+                continue
+            file, chunks, _, content_hash = result
+            if chunks is None:
+                continue
+            try:
+                kept_doc_infos, new_chunks, stale_ids = self.indexing.plan(file, chunks)
+            except Exception as e:
+                msg = f"index {file.filename} file error：{e}"
+                logger.error(f'{e.__class__.__name__}: {msg}')
+                with self._failed_lock:
+                    self._failed_files[file.filename] = msg
+                continue
+
+            task = FileTask(file=file,
+                            docs_count=len(chunks),
+                            content_hash=content_hash,
+                            doc_infos=kept_doc_infos,
+                            stale_ids=stale_ids)
+            # small-to-big 的父块直接写入父块存储，只有子块进入向量化阶段
+            parents, new_chunks = self.vectorstore.split_parent_docs(new_chunks)
+            if parents:
+                try:
+                    doc_infos = self.vectorstore.add_parent_docs(file, parents)
+                except Exception as e:
+                    msg = f"index {file.filename} file error：{e}"
+                    logger.error(f'{e.__class__.__name__}: {msg}')
+                    with self._failed_lock:
+                        self._failed_files[file.filename] = msg
+                    continue
+                task.doc_infos.extend(doc_infos)
+                task.inserted_ids.extend(info["id"] for info in doc_infos)
+            batches = [new_chunks[i:i + self.embed_batch_size]
+                       for i in range(0, len(new_chunks), self.embed_batch_size)]
+            if not batches:
+                self._commit_queue.put(task)
+                continue
+            task.pending_batches = len(batches)
+            for batch in batches:
+                # 队列已满时阻塞，形成背压
+                self._embed_queue.put((task, batch))
+
+    def _embed_worker(self):
+        while True:
+            item = self._embed_queue.get()
+            if item is _STOP:
+                return
+            task, batch = item
+            if task.error is not None:
+                self._batch_done(task)
+                continue
+            try:
+                vectors = self.vectorstore.embed_docs(batch)
+            except Exception as e:
+                self._fail(task, e)
+                self._batch_done(task)
+                continue
+            self._upsert_queue.put((task, batch, vectors))
+
+    def _upsert_worker(self):
+        while True:
+            item = self._upsert_queue.get()
+            if item is _STOP:
+                return
+            task, batch, vectors = item
+            if task.error is None:
+                try:
+                    doc_infos = self.vectorstore.add_doc(task.file, batch, embeddings=vectors)
+                    with task.lock:
+                        task.doc_infos.extend(doc_infos)
+                        task.inserted_ids.extend(info["id"] for info in doc_infos)
+                except Exception as e:
+                    self._fail(task, e)
+            self._batch_done(task)
+
+    def _commit_worker(self):
+        while True:
+            task = self._commit_queue.get()
+            if task is _STOP:
+                return
+            try:
+                if task.error is not None:
+                    # 回滚本次已写入向量库的文档，数据库记录保持上一次索引的状态
+                    self.vectorstore.delete_doc_by_ids(task.inserted_ids)
+                    with self._failed_lock:
+                        self._failed_files[task.file.filename] = task.error
+                    continue
+                self.indexing.commit(task.file,
+                                     docs_count=task.docs_count,
+                                     content_hash=task.content_hash,
+                                     doc_infos=task.doc_infos,
+                                     stale_ids=task.stale_ids)
+            except Exception as e:
+                msg = f"index {task.file.filename} file error：{e}"
+                logger.error(f'{e.__class__.__name__}: {msg}')
+                with self._failed_lock:
+                    self._failed_files[task.file.filename] = msg
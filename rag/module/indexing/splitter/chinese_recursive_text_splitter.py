@@ -1,24 +1,74 @@
 import re
-from typing import List, Optional, Any, Iterable
+from bisect import bisect_left, bisect_right
+from collections import deque
+from functools import lru_cache
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Any, Tuple
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_core.documents import Document
 
-def _split_text_with_regex_from_end(
-        text: str, separator: str, keep_separator: bool
-) -> List[str]:
-    if separator:
-        if keep_separator:
-            # 根据分隔符对文本进行拆分, 并且保留分隔符
-            _splits = re.split(f"({separator})", text)
-            splits = ["".join(i) for i in zip(_splits[0::2], _splits[1::2])]
-            if len(_splits) % 2 == 1:
-                splits += _splits[-1:]
-            # splits = [_splits[0]] + splits
-        else:
-            splits = re.split(separator, text)
-    else:
-        splits = list(text)
-    return [s for s in splits if s != ""]
+from rag.common.configuration import config
+
+DEFAULT_SEPARATORS = [
+    "\n\n",
+    "\n",
+    "。|！|？",
+    r"\.\s|\!\s|\?\s",
+    r"；|;\s",
+    r"，|,\s"
+]
+_MULTI_NEWLINES = re.compile(r"\n{2,}")
+
+
+@lru_cache(maxsize=None)
+def token_length_function(tokenizer: str) -> Callable[[str], int]:
+    """
+    按 token 数计算文本长度，tokenizer 为 HuggingFace 分词器的名称或本地路径。
+
+    分词器与每段文本的 token 数在进程内缓存：Indexing 每个文件新建一个切分器，不会重复加载分词器；
+    切分时同一段文本的长度会被计算多次，只需分词一次。
+    """
+    from transformers import AutoTokenizer
+
+    encoder = AutoTokenizer.from_pretrained(tokenizer)
+
+    @lru_cache(maxsize=65536)
+    def length(text: str) -> int:
+        return len(encoder.encode(text, add_special_tokens=False))
+
+    return length
+
+
+class _SeparatorMatches:
+    """
+    一段文本中各级分隔符的匹配位置。
+
+    每级分隔符在首次用到时对整段文本扫描一次，之后递归切分只按位置二分查找，不再对子串重复匹配。
+    """
+
+    def __init__(self, text: str, patterns: List[Optional[re.Pattern]]):
+        self.text = text
+        self.patterns = patterns
+        self._matches: Dict[int, Tuple[List[int], List[int]]] = {}
+
+    def _level(self, level: int) -> Tuple[List[int], List[int]]:
+        matches = self._matches.get(level)
+        if matches is None:
+            spans = [span for span in map(re.Match.span, self.patterns[level].finditer(self.text))
+                     if span[1] > span[0]]
+            matches = self._matches[level] = ([start for start, _ in spans], [end for _, end in spans])
+        return matches
+
+    def find(self, level: int, start: int, end: int) -> Tuple[List[int], List[int]]:
+        """[start, end) 内匹配的起点与终点，按位置排列"""
+        starts, ends = self._level(level)
+        # 匹配互不重叠，起点与终点都是递增的
+        lo, hi = bisect_left(starts, start), bisect_right(ends, end)
+        return starts[lo:hi], ends[lo:hi]
+
+    def contains(self, level: int, start: int, end: int) -> bool:
+        starts, ends = self._level(level)
+        i = bisect_left(starts, start)
+        return i < len(starts) and ends[i] <= end
 
 
 class ChineseRecursiveTextSplitter(RecursiveCharacterTextSplitter):
@@ -27,66 +77,135 @@ class ChineseRecursiveTextSplitter(RecursiveCharacterTextSplitter):
             separators: Optional[List[str]] = None,
             keep_separator: bool = True,
             is_separator_regex: bool = True,
+            tokenizer: Optional[str] = None,
             **kwargs: Any,
     ) -> None:
-        """Create a new TextSplitter."""
+        """
+        Create a new TextSplitter.
+
+        tokenizer 不为空时按 token 数计算 chunk_size 与 chunk_overlap，默认取 SPLITTER_TOKENIZER，
+        为空时按字符数计算。
+        """
+        tokenizer = config.splitter.tokenizer if tokenizer is None else tokenizer
+        if tokenizer and "length_function" not in kwargs:
+            kwargs["length_function"] = token_length_function(tokenizer)
         super().__init__(keep_separator=keep_separator, **kwargs)
-        self._separators = separators or [
-            "\n\n",
-            "\n",
-            "。|！|？",
-            "\.\s|\!\s|\?\s",
-            "；|;\s",
-            "，|,\s"
-        ]
+        self._separators = separators or DEFAULT_SEPARATORS
         self._is_separator_regex = is_separator_regex
+        # 分隔符只编译一次
+        self._patterns = self._compile(self._separators)
+
+    def _compile(self, separators: List[str]) -> List[Optional[re.Pattern]]:
+        return [re.compile(s if self._is_separator_regex else re.escape(s)) if s else None for s in separators]
 
     def _split_text(self, text: str, separators: List[str]) -> List[str]:
         """Split incoming text and return chunks."""
+        patterns = self._patterns if separators is self._separators else self._compile(separators)
+        matches = _SeparatorMatches(text, patterns)
+        chunks = self._split_range(matches, separators, 0, len(text), 0)
+        return [_MULTI_NEWLINES.sub("\n", chunk) for chunk in (chunk.strip() for chunk in chunks) if chunk]
+
+    def _split_range(self, matches: _SeparatorMatches, separators: List[str],
+                     start: int, end: int, level: int) -> List[str]:
+        """切分 text[start:end]，从第 level 级分隔符开始尝试"""
         final_chunks = []
-        # 取第一个为默认分隔符，剩余为候选分隔符
-        separator = separators[-1]
-        new_separators = []
-        for i, _s in enumerate(separators):
-            _separator = _s if self._is_separator_regex else re.escape(_s)
-            if _s == "":
-                separator = _s
+        # 取第一个在文本中出现的分隔符，其后的为候选分隔符；都不出现时取最后一个
+        separator, next_level = len(separators) - 1, len(separators)
+        for i in range(level, len(separators)):
+            if separators[i] == "":
+                separator = i
                 break
-            if re.search(_separator, text):
-                separator = _s
-                new_separators = separators[i + 1:]
+            if matches.contains(i, start, end):
+                separator, next_level = i, i + 1
                 break
 
-        _separator = separator if self._is_separator_regex else re.escape(separator)
-        splits = _split_text_with_regex_from_end(text, _separator, self._keep_separator)
-
-        _good_splits = []
-        _separator = "" if self._keep_separator else separator
-        for s in splits:
-            if self._length_function(s) < self._chunk_size:
-                _good_splits.append(s)
+        pieces = self._pieces(matches, separators, separator, start, end)
+        text = matches.text
+        _separator = "" if self._keep_separator else separators[separator]
+        # 默认按字符数计算长度时不需要为每一段创建子串
+        by_chars = self._length_function is len
+        good_pieces = []  # [(起点, 终点, 长度)]
+        for piece_start, piece_end in pieces:
+            length = piece_end - piece_start if by_chars else self._length_function(text[piece_start:piece_end])
+            if length < self._chunk_size:
+                good_pieces.append((piece_start, piece_end, length))
             else:
-                if _good_splits:
-                    merged_text = self._merge_splits(_good_splits, _separator)
-                    final_chunks.extend(merged_text)
-                    _good_splits = []
-                if not new_separators:
-                    final_chunks.append(s)
+                if good_pieces:
+                    final_chunks.extend(self._merge(text, good_pieces, _separator))
+                    good_pieces = []
+                if next_level >= len(separators):
+                    final_chunks.append(text[piece_start:piece_end])
                 else:
-                    other_info = self._split_text(s, new_separators)
-                    final_chunks.extend(other_info)
-        if _good_splits:
-            merged_text = self._merge_splits(_good_splits, _separator)
-            final_chunks.extend(merged_text)
-        return [re.sub(r"\n{2,}", "\n", chunk.strip()) for chunk in final_chunks if chunk.strip()!=""]
+                    final_chunks.extend(self._split_range(matches, separators, piece_start, piece_end, next_level))
+        if good_pieces:
+            final_chunks.extend(self._merge(text, good_pieces, _separator))
+        return final_chunks
+
+    def _pieces(self, matches: _SeparatorMatches, separators: List[str],
+                level: int, start: int, end: int) -> List[Tuple[int, int]]:
+        """按第 level 级分隔符切分 text[start:end]，保留分隔符时分隔符归入前一段"""
+        if separators[level] == "":
+            return [(i, i + 1) for i in range(start, end)]
+        starts, ends = matches.find(level, start, end)
+        if self._keep_separator:
+            bounds = [start] + ends
+            if bounds[-1] < end:
+                bounds.append(end)
+            return list(zip(bounds, bounds[1:]))
+        pieces = list(zip([start] + ends, starts + [end]))
+        return [(a, b) for a, b in pieces if b > a]
+
+    def _merge(self, text: str, pieces: List[Tuple[int, int, int]], separator: str) -> List[str]:
+        """
+        与 _merge_splits 相同，把相邻的小段合并为不超过 chunk_size 的块并保留 chunk_overlap 的重叠。
+
+        每段的长度只计算一次，移出重叠窗口用 deque，合并的耗时与段数成线性关系；
+        保留分隔符时相邻的段在原文中首尾相接，合并后的块直接从原文截取。
+        """
+        separator_len = self._length_function(separator) if separator else 0
+        docs = []
+        current, total = deque(), 0  # current: [(起点, 终点, 长度)]
+        for piece in pieces:
+            length = piece[2]
+            if total + length + (separator_len if current else 0) > self._chunk_size:
+                if current:
+                    doc = self._join_pieces(text, current, separator)
+                    if doc is not None:
+                        docs.append(doc)
+                    while total > self._chunk_overlap or (
+                            total + length + (separator_len if current else 0) > self._chunk_size and total > 0):
+                        total -= current[0][2] + (separator_len if len(current) > 1 else 0)
+                        current.popleft()
+            current.append(piece)
+            total += length + (separator_len if len(current) > 1 else 0)
+        doc = self._join_pieces(text, current, separator)
+        if doc is not None:
+            docs.append(doc)
+        return docs
+
+    def _join_pieces(self, text: str, pieces: deque, separator: str) -> Optional[str]:
+        if not pieces:
+            return None
+        if separator:
+            return self._join_docs([text[start:end] for start, end, _ in pieces], separator)
+        doc = text[pieces[0][0]:pieces[-1][1]]
+        if self._strip_whitespace:
+            doc = doc.strip()
+        return doc or None
+
+    def lazy_split_documents(self, documents: Iterable[Document]) -> Iterator[Document]:
+        """逐个切分并逐块产出，documents 为按页产出的迭代器时可以边加载边切分"""
+        for doc in documents:
+            if self._add_start_index:
+                yield from self.create_documents([doc.page_content], metadatas=[doc.metadata])
+                continue
+            # 各块的 metadata 为浅拷贝，不逐块深拷贝
+            for chunk in self.split_text(doc.page_content):
+                yield Document(page_content=chunk, metadata=dict(doc.metadata))
 
     def split_documents(self, documents: Iterable[Document]) -> List[Document]:
         """Split documents."""
-        texts, metadatas = [], []
-        for doc in documents[:1]:
-            texts.append(doc.page_content)
-            metadatas.append(doc.metadata)
-        return self.create_documents(texts, metadatas=metadatas) + documents[1:]
+        return list(self.lazy_split_documents(documents))
 
 def test_splitter():
     """
@@ -1,3 +1,4 @@
+import hashlib
 import os
 import shutil
 from pathlib import Path
@@ -100,4 +101,18 @@ class KnowledgeFile:
     def get_size(self):
         if self.type == 'url':
             return 0
-        return os.path.getsize(self.filepath)
\ No newline at end of file
+        return os.path.getsize(self.filepath)
+
+    def get_hash(self):
+        """
+        计算知识文件内容的 sha256 哈希
+        Returns:
+            str: 文件内容哈希；url 类型需加载后才能确定内容，返回 None
+        """
+        if self.type == 'url':
+            return None
+        sha256 = hashlib.sha256()
+        with open(self.filepath, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                sha256.update(block)
+        return sha256.hexdigest()
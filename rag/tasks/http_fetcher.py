@@ -0,0 +1,191 @@
+import asyncio
+import random
+import time
+from dataclasses import dataclass, field
+from functools import partial
+from typing import Dict, Optional
+from urllib.parse import urlparse
+from urllib.robotparser import RobotFileParser
+
+import aiohttp
+import chardet
+
+from comps.cores.mega.logger import CustomLogger
+
+logger = CustomLogger("http_fetcher")
+
+# 这些状态码视为临时错误，会按退避策略重试
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+@dataclass
+class FetchResult:
+    """单个 URL 的抓取结果"""
+    url: str
+    status: int
+    text: str = ""
+    encoding: str = "utf-8"
+    content_type: str = ""
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+
+    @property
+    def not_modified(self) -> bool:
+        return self.status == 304
+
+
+@dataclass
+class _HostState:
+    """单个站点的并发与访问间隔控制"""
+    semaphore: asyncio.Semaphore
+    delay: float
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    next_request_time: float = 0.0
+    robots: Optional[RobotFileParser] = None
+
+    async def wait_turn(self):
+        # 保证同一站点相邻两次请求的开始时间间隔不小于 delay
+        async with self.lock:
+            now = time.monotonic()
+            if self.next_request_time > now:
+                await asyncio.sleep(self.next_request_time - now)
+                now = self.next_request_time
+            self.next_request_time = now + self.delay
+
+
+class AsyncFetcher:
+    """
+    异步 HTTP 抓取器。
+
+    所有请求共用一个带连接池的 aiohttp 会话（keep-alive 复用连接）；
+    通过全局信号量和每个站点的信号量限制并发，并遵守 robots.txt 的禁止规则与 Crawl-delay。
+    传入上次抓取记录的 ETag / Last-Modified 时发送条件请求，页面未变化时服务端返回 304，不再下载页面内容。
+    必须在同一个事件循环中创建和使用。
+    """
+
+    def __init__(self,
+                 concurrency: int = 16,
+                 per_host_concurrency: int = 4,
+                 crawl_delay: float = 0.0,
+                 respect_robots: bool = True,
+                 user_agent: str = "Mozilla/5.0 (compatible; LiteRAGBot/1.0)",
+                 timeout: int = 20,
+                 max_retries: int = 3,
+                 verify_ssl: bool = True):
+        self.per_host_concurrency = max(1, per_host_concurrency)
+        self.crawl_delay = crawl_delay
+        self.respect_robots = respect_robots
+        self.user_agent = user_agent
+        self.max_retries = max(1, max_retries)
+        self._semaphore = asyncio.Semaphore(max(1, concurrency))
+        # 每个站点一个创建 _HostState 的任务，同一站点的请求共同等待它，不阻塞其他站点
+        self._hosts: Dict[str, asyncio.Task] = {}
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=max(1, concurrency),
+                                           limit_per_host=self.per_host_concurrency,
+                                           ssl=None if verify_ssl else False),
+            timeout=aiohttp.ClientTimeout(total=timeout),
+            headers={"User-Agent": user_agent})
+
+    async def close(self):
+        await self._session.close()
+
+    async def _host_state(self, url: str) -> _HostState:
+        parsed = urlparse(url)
+        host = f"{parsed.scheme}://{parsed.netloc}"
+        task = self._hosts.get(host)
+        if task is None:
+            task = self._hosts[host] = asyncio.create_task(self._create_host_state(host))
+            task.add_done_callback(partial(self._forget_failed_host, host))
+        # 单个请求被取消时不取消共享的任务
+        return await asyncio.shield(task)
+
+    def _forget_failed_host(self, host: str, task: asyncio.Task):
+        # 创建失败时移除，下次请求重新获取
+        if (task.cancelled() or task.exception() is not None) and self._hosts.get(host) is task:
+            del self._hosts[host]
+
+    async def _create_host_state(self, host: str) -> _HostState:
+        robots = await self._load_robots(host) if self.respect_robots else None
+        delay = self.crawl_delay
+        if robots is not None:
+            delay = max(delay, float(robots.crawl_delay(self.user_agent) or 0))
+        return _HostState(semaphore=asyncio.Semaphore(self.per_host_concurrency),
+                          delay=delay,
+                          robots=robots)
+
+    async def _load_robots(self, host: str) -> Optional[RobotFileParser]:
+        robots = RobotFileParser(f"{host}/robots.txt")
+        try:
+            async with self._session.get(f"{host}/robots.txt") as response:
+                if response.status in (401, 403):
+                    robots.disallow_all = True
+                elif response.status >= 400:
+                    robots.allow_all = True
+                else:
+                    robots.parse((await response.text(errors="ignore")).splitlines())
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.warning(f"获取 {host}/robots.txt 失败，按允许抓取处理: {e}")
+            return None
+        return robots
+
+    async def allowed(self, url: str) -> bool:
+        """robots.txt 是否允许抓取该 URL"""
+        state = await self._host_state(url)
+        return state.robots is None or state.robots.can_fetch(self.user_agent, url)
+
+    async def fetch(self,
+                    url: str,
+                    etag: Optional[str] = None,
+                    last_modified: Optional[str] = None) -> FetchResult:
+        """
+        抓取 URL，临时错误按指数退避重试。
+
+        参数:
+        - etag / last_modified: 上次抓取时服务端返回的校验信息，用于条件请求。
+
+        返回:
+        - FetchResult，status 为 304 时表示页面未变化，text 为空。
+        """
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+
+        state = await self._host_state(url)
+        last_error: Optional[Exception] = None
+        for attempt in range(self.max_retries):
+            if attempt:
+                await asyncio.sleep(min(2 ** attempt, 30) + random.random())
+                logger.warning(f"获取失败，准备第 {attempt + 1} 次重试 {url}: {last_error}")
+            try:
+                async with self._semaphore, state.semaphore:
+                    await state.wait_turn()
+                    async with self._session.get(url, headers=headers) as response:
+                        if response.status in RETRY_STATUS:
+                            last_error = aiohttp.ClientResponseError(response.request_info, response.history,
+                                                                     status=response.status,
+                                                                     message=response.reason or "")
+                            continue
+                        response.raise_for_status()
+                        result = FetchResult(url=url,
+                                             status=response.status,
+                                             content_type=response.headers.get("Content-Type", ""),
+                                             etag=response.headers.get("ETag"),
+                                             last_modified=response.headers.get("Last-Modified"))
+                        if response.status == 304:
+                            return result
+                        body = await response.read()
+                        result.encoding = response.charset or chardet.detect(body)["encoding"] or "utf-8"
+                        try:
+                            result.text = body.decode(result.encoding, errors="replace")
+                        except LookupError:
+                            result.encoding = "utf-8"
+                            result.text = body.decode(result.encoding, errors="replace")
+                        return result
+            except aiohttp.ClientResponseError:
+                raise
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                last_error = e
+        raise last_error or aiohttp.ClientError(f"重试 {self.max_retries} 次后失败: {url}")
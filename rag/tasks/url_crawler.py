@@ -1,6 +1,11 @@
+import asyncio
+import os
+import socket
 import time
-from typing import List, Set
-import requests
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+import aiohttp
 from bs4 import BeautifulSoup
 from urllib.parse import urljoin, urlparse
 from comps.cores.mega.logger import CustomLogger
@@ -9,9 +14,11 @@ from rag.connector.database.service.url_queue_service import URLQueueService
 from rag.connector.database.models.url_queue_model import URLStatus
 from rag.connector.utils import get_embedding_model, get_vectorstore
 from rag.module.indexing.indexing import Indexing
+from rag.module.indexing.loader.web_loader import CustomizedWebBaseLoader
 from rag.module.knowledge_file import KnowledgeFile
 from rag.connector.database.service.knowledge_file_service import KnowledgeFileService
 from rag.common.configuration import config
+from rag.tasks.http_fetcher import AsyncFetcher, FetchResult
 
 logger = CustomLogger("url_crawler")
 
@@ -26,9 +33,27 @@ embedding_model = get_embedding_model(embedding_type=config.embedding.embedding_
 
 
 class URLCrawler:
+    """
+    URL 爬虫。
+
+    每批待处理 URL 在事件循环中并发抓取，所有请求共用 AsyncFetcher 的连接池，
+    并受全局/单站点并发数、robots.txt 与 Crawl-delay 限制。
+    每个页面只抓取一次，同一份页面内容同时用于正文提取索引和站内链接发现；
+    解析、向量化等阻塞操作在线程池中执行，不阻塞抓取。
+    URL 通过带租约的方式从队列领取，多个爬虫进程可以同时运行而不会重复处理同一个 URL。
+    """
+
     def __init__(self):
+        self.worker_id = config.crawler.worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
         self.url_queue_service = URLQueueService()
         self.file_service = KnowledgeFileService()
+        self.page_parser = CustomizedWebBaseLoader(web_path="")
+        self._loop = asyncio.new_event_loop()
+        self._fetcher: Optional[AsyncFetcher] = None
+        self._executor = ThreadPoolExecutor(max_workers=config.crawler.index_workers,
+                                            thread_name_prefix="crawler-index")
+        self._indexings: Dict[str, Indexing] = {}
+        self._last_recrawl = 0.0
 
     def get_internal_links(self, base_url: str, link_tags: str, html_content: str) -> List[str]:
         """
@@ -96,69 +121,85 @@ class URLCrawler:
                 
         return list(internal_links)
 
-    def process_url(self, url_info: dict) -> None:
-        """处理单个URL"""
-        logger.info(f"开始处理 URL: {url_info['url']}")
+    def _get_fetcher(self) -> AsyncFetcher:
+        # aiohttp 会话需要在事件循环内创建，之后各批次复用同一个连接池
+        if self._fetcher is None:
+            self._fetcher = AsyncFetcher(concurrency=config.crawler.concurrency,
+                                         per_host_concurrency=config.crawler.per_host_concurrency,
+                                         crawl_delay=config.crawler.crawl_delay,
+                                         respect_robots=config.crawler.respect_robots,
+                                         user_agent=config.crawler.user_agent,
+                                         timeout=config.crawler.timeout,
+                                         max_retries=config.crawler.max_retries)
+        return self._fetcher
+
+    async def process_url(self, url_info: dict) -> dict:
+        """处理单个URL，返回处理结果，由批次结束时统一更新队列状态"""
+        url = url_info['url']
+        logger.info(f"开始处理 URL: {url}")
         logger.info(f"知识库: {url_info['kb_name']}, 剩余深度: {url_info['scraping_level']}")
-        
+        fetcher = self._get_fetcher()
+        loop = asyncio.get_running_loop()
+
         try:
-            # 更新状态为处理中
-            logger.debug("更新状态为处理中...")
-            self.url_queue_service.update_url_status(url_info['id'], URLStatus.RUNNING)
-            
-            # 创建KnowledgeFile实例
-            logger.debug("创建知识库文件...")
-            self.process_vector_store(url_info)
-            # 如果还有爬取深度，获取并添加内部链接
-            if url_info['scraping_level'] > 0:
-                logger.info(f"获取页面内容: {url_info['url']}")
-                response = requests.get(url_info['url'])
-                response.encoding = response.apparent_encoding
-                
-                logger.info("提取内部链接...")
-                internal_links = self.get_internal_links(
-                    url_info['url'], 
-                    url_info['link_tags'],
-                    response.text
-                )
-                
-                # 添加新的URL到队列
-                logger.info(f"添加 {len(internal_links)} 个新URL到队列")
-                for link in internal_links:
-                    self.url_queue_service.add_url_to_queue(
-                        url_info['kb_name'],
-                        link,
-                        url_info['scraping_level'] - 1,
-                        url_info['link_tags']
-                    )
-            
-            # 更新状态为完成
+            if not await fetcher.allowed(url):
+                logger.info(f"robots.txt 禁止抓取: {url}")
+                return {'id': url_info['id'], 'status': URLStatus.FAILED,
+                        'error_msg': "disallowed by robots.txt", 'retry': False}
+
+            logger.info(f"获取页面内容: {url}")
+            result = await fetcher.fetch(url,
+                                         etag=url_info.get('etag'),
+                                         last_modified=url_info.get('last_modified'))
+            if result.not_modified:
+                # 页面未变化，之前发现的链接已在队列中
+                logger.info(f"页面未变化，跳过索引: {url}")
+            else:
+                await loop.run_in_executor(self._executor, self.process_page, url_info, result)
+
             logger.info("处理完成")
-            self.url_queue_service.update_url_status(url_info['id'], URLStatus.COMPLETED)
-            
+            return {'id': url_info['id'], 'status': URLStatus.COMPLETED,
+                    'etag': result.etag or url_info.get('etag'),
+                    'last_modified': result.last_modified or url_info.get('last_modified')}
+
         except Exception as e:
-            # 更新状态为失败
             logger.error(f"处理失败: {str(e)}", exc_info=True)
-            self.url_queue_service.update_url_status(
-                url_info['id'],
-                URLStatus.FAILED,
-                str(e)
+            # 4xx 错误（429 除外）重试也不会成功
+            retry = not (isinstance(e, aiohttp.ClientResponseError) and 400 <= e.status < 500 and e.status != 429)
+            return {'id': url_info['id'], 'status': URLStatus.FAILED, 'error_msg': str(e), 'retry': retry}
+
+    def process_page(self, url_info: dict, result: FetchResult) -> None:
+        """使用已抓取的页面内容索引正文并发现站内链接"""
+        logger.debug("创建知识库文件...")
+        doc = self.page_parser.parse(url_info['url'], result.text, result.encoding)
+        failed_files = self.process_vector_store(url_info, [doc])
+        if failed_files:
+            raise RuntimeError(failed_files.get(url_info['url'], str(failed_files)))
+
+        # 如果还有爬取深度，获取并添加内部链接
+        if url_info['scraping_level'] > 0:
+            logger.info("提取内部链接...")
+            internal_links = self.get_internal_links(
+                url_info['url'],
+                url_info['link_tags'],
+                result.text
             )
-            
-    def process_vector_store(self, url_info: dict):
-        """处理单个URL"""
+
+            # 批量添加新的URL到队列
+            logger.info(f"添加 {len(internal_links)} 个新URL到队列")
+            self.url_queue_service.add_urls_to_queue(
+                url_info['kb_name'],
+                internal_links,
+                url_info['scraping_level'] - 1,
+                url_info['link_tags']
+            )
+
+    def process_vector_store(self, url_info: dict, docs: List) -> Dict[str, str]:
+        """索引单个URL的页面内容，返回失败文件信息"""
         logger.info(f"开始索引 URL vector store: {url_info['url']} in kb_name: {url_info['kb_name']}")
-        try:
-            # 更新状态为处理中
-            logger.info("索引处理中...")
-            # 初始化失败文件字典和知识库文件列表
-            failed_files = {}
-            kb_files = []
-            knowledge_name = url_info['kb_name']
-            # 遍历文件名列表，尝试将每个文件加载为KnowledgeFile对象
-            # 将文件加载到知识库文件列表中
-            kb_files.append(KnowledgeFile(filename=url_info['url'], knowledge_name=url_info['kb_name'], file_type='url'))
-            # 如果加载过程中出现异常，记录错误信息并将文件名添加到失败文件字典中
+        knowledge_name = url_info['kb_name']
+        indexing = self._indexings.get(knowledge_name)
+        if indexing is None:
             # 获取指定知识库的向量存储对象
             vs = get_vectorstore(knowledge_name=knowledge_name,
                                 vs_type=config.vector_store.vector_store_type,
@@ -168,38 +209,69 @@ class URLCrawler:
                                 chunk_size=config.splitter.chunk_size,
                                 chunk_overlap=config.splitter.chunk_overlap,
                                 smaller_chunk_size=config.splitter.smaller_chunk_size)
+            self._indexings[knowledge_name] = indexing
 
-            # 使用索引对象对知识库文件进行索引，并获取失败的文件信息
-            failed_files = indexing.index(kb_files)
-            logger.info(f"索引完成，失败文件: {failed_files}")
-            
-        except Exception as e:
-            logger.error(f"处理失败: {str(e)}", exc_info=True)
+        kb_file = KnowledgeFile(filename=url_info['url'], knowledge_name=knowledge_name, file_type='url')
+        failed_files = indexing.index_docs(kb_file, docs)
+        logger.info(f"索引完成，失败文件: {failed_files}")
+        return failed_files
+
+    async def _process_batch(self, pending_urls: List[dict]) -> List[dict]:
+        async def timed(url_info: dict) -> dict:
+            url_start_time = time.time()
+            result = await self.process_url(url_info)
+            logger.info(f"处理URL耗时: {time.time() - url_start_time:.2f}秒")
+            return result
+
+        return await asyncio.gather(*(timed(url_info) for url_info in pending_urls))
 
+    def requeue_for_recrawl(self):
+        """按 CRAWLER_RECRAWL_INTERVAL 把完成时间较早的URL重新排队，最多每分钟检查一次"""
+        interval = config.crawler.recrawl_interval
+        now = time.monotonic()
+        if interval <= 0 or now - self._last_recrawl < min(interval, 60):
+            return
+        self._last_recrawl = now
+        count = self.url_queue_service.requeue_completed_urls(older_than=interval)
+        if count:
+            logger.info(f"{count} 个URL重新排队爬取")
 
-    def run(self, batch_size: int = 5):
+    def run(self, batch_size: Optional[int] = None):
         """运行爬虫任务"""
+        batch_size = batch_size or config.crawler.batch_size
         start_time = time.time()
         logger.info(f"启动爬虫 (批次大小: {batch_size})")
-        
-        logger.debug("获取待处理URL...")
-        pending_urls = self.url_queue_service.get_pending_urls(limit=batch_size)
-        logger.info(f"获取到 {len(pending_urls)} 个待处理URL")
+        self.requeue_for_recrawl()
+
+        logger.debug("领取待处理URL...")
+        pending_urls = self.url_queue_service.claim_urls(worker_id=self.worker_id,
+                                                         limit=batch_size,
+                                                         lease_seconds=config.crawler.lease_seconds,
+                                                         max_retries=config.crawler.url_max_retries)
+        logger.info(f"{self.worker_id} 领取到 {len(pending_urls)} 个待处理URL")
         
         if len(pending_urls) == 0:
             logger.info("没有待处理的URL，等待5秒...")
             return False
         
-        # 处理每个URL
-        for url_info in pending_urls:
-            url_start_time = time.time()
-            self.process_url(url_info)
-            url_end_time = time.time()
-            logger.info(f"处理URL耗时: {url_end_time - url_start_time:.2f}秒")
+        # 并发处理本批次URL，结束后批量更新状态
+        results = self._loop.run_until_complete(self._process_batch(pending_urls))
+        self.url_queue_service.finish_urls(results,
+                                           worker_id=self.worker_id,
+                                           max_retries=config.crawler.url_max_retries,
+                                           retry_backoff=config.crawler.retry_backoff)
 
         end_time = time.time()
         logger.info(f"本批次处理完成，总耗时: {end_time - start_time:.2f}秒")
         return True
+
+    def close(self):
+        """关闭连接池与线程池"""
+        if self._fetcher is not None:
+            self._loop.run_until_complete(self._fetcher.close())
+            self._fetcher = None
+        self._loop.close()
+        self._executor.shutdown(wait=False)
             
 
 def test_crawler():
@@ -2,6 +2,8 @@
 # SPDX-License-Identifier: Apache-2.0
 
 import argparse
+import functools
+import hashlib
 import json
 import multiprocessing
 import os
@@ -14,8 +16,8 @@ logger = CustomLogger("chatqna")
 class ChatTemplate:
     @staticmethod
     def generate_rag_prompt(question, documents):
-        context_str = "\n".join(documents)
-        if context_str and len(re.findall("[\u4E00-\u9FFF]", context_str)) / len(context_str) >= 0.3:
+        context_str = documents if isinstance(documents, str) else ContextPacker().pack(documents)
+        if is_chinese(context_str):
             # chinese context
             template = """
 ### 你将扮演一个乐于助人、尊重他人并诚实的助手，你的目标是帮助用户解答问题。有效地利用来自本地知识库的搜索结果。确保你的回答中只包含相关信息。如果你不确定问题的答案，请避免分享不准确的信息。
@@ -49,6 +51,152 @@ RERANK_SERVER_PORT = int(os.getenv("RERANK_SERVER_PORT", 80))
 LLM_SERVER_HOST_IP = os.getenv("LLM_SERVER_HOST_IP", "0.0.0.0")
 LLM_SERVER_PORT = int(os.getenv("LLM_SERVER_PORT", 80))
 LLM_MODEL = os.getenv("LLM_MODEL", "Intel/neural-chat-7b-v3-3")
+# 上下文的 token 预算，<= 0 表示不限制
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 3072))
+# 计算 token 数的分词器，默认与 LLM 一致，加载失败时按字符估算
+CONTEXT_TOKENIZER = os.getenv("CONTEXT_TOKENIZER", LLM_MODEL)
+
+CJK_PATTERN = re.compile("[\u4E00-\u9FFF]")
+# 判断中英文只看上下文开头的一段，不再扫描全文
+CJK_SAMPLE_CHARS = 2000
+# 相邻块首尾重叠（切分时的 chunk_overlap）至少这么长才去掉，避免误删
+MIN_MERGE_OVERLAP = 16
+
+
+def is_chinese(text):
+    sample = text[:CJK_SAMPLE_CHARS]
+    return bool(sample) and len(CJK_PATTERN.findall(sample)) / len(sample) >= 0.3
+
+
+@functools.lru_cache(maxsize=None)
+def get_tokenizer(name):
+    """每个进程只加载一次分词器，失败时返回 None"""
+    if not name:
+        return None
+    try:
+        from transformers import AutoTokenizer
+        return AutoTokenizer.from_pretrained(name)
+    except Exception as e:
+        logger.warning(f"load tokenizer {name} failed, estimate tokens by characters instead: {e}")
+        return None
+
+
+@functools.lru_cache(maxsize=8192)
+def count_tokens(text):
+    # 父块会被反复召回，按文本缓存 token 数
+    tokenizer = get_tokenizer(CONTEXT_TOKENIZER)
+    if tokenizer is not None:
+        return len(tokenizer.encode(text, add_special_tokens=False))
+    # 中文约一字一个 token，其它约四个字符一个 token
+    cjk = len(CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def truncate_tokens(text, max_tokens):
+    if max_tokens <= 0:
+        return ""
+    tokenizer = get_tokenizer(CONTEXT_TOKENIZER)
+    if tokenizer is not None:
+        ids = tokenizer.encode(text, add_special_tokens=False)
+        return text if len(ids) <= max_tokens else tokenizer.decode(ids[:max_tokens])
+    tokens = count_tokens(text)
+    return text if tokens <= max_tokens else text[:len(text) * max_tokens // tokens]
+
+
+class ContextPacker:
+    """把检索/重排结果拼装成 prompt 的上下文。
+
+    documents 中的元素可以是字符串，也可以是 {"text", "metadata", "score"} 字典：
+    1. 按父块/块 id 去重（没有 id 时按文本），子块与其父块同时出现时保留父块；
+    2. 同一文件中位置相邻的块合并为一段，并去掉切分时的重叠部分；
+    3. 有重排分数时按分数从高到低排序，否则保持检索顺序；
+    4. 按 token 预算依次放入，放不下的跳过，第一段就超出预算时截断。
+    """
+
+    def __init__(self, token_budget=None, separator="\n"):
+        self.token_budget = CONTEXT_TOKEN_BUDGET if token_budget is None else token_budget
+        self.separator = separator
+
+    def pack(self, documents):
+        chunks = self._merge_adjacent(self._dedupe(documents))
+        if chunks and all(chunk["score"] is not None for chunk in chunks):
+            chunks.sort(key=lambda chunk: (-chunk["score"], chunk["rank"]))
+        else:
+            chunks.sort(key=lambda chunk: chunk["rank"])
+        return self.separator.join(self._fit([chunk["text"] for chunk in chunks]))
+
+    @staticmethod
+    def _dedupe(documents):
+        chunks = {}
+        for rank, doc in enumerate(documents):
+            if isinstance(doc, str):
+                doc = {"text": doc}
+            text, metadata = doc["text"], doc.get("metadata") or {}
+            if not text:
+                continue
+            score = doc.get("score")
+            key = metadata.get("parent_id") or metadata.get("id") or hashlib.md5(text.encode("utf-8")).hexdigest()
+            chunk = chunks.get(key)
+            if chunk is None:
+                chunks[key] = {"text": text, "metadata": metadata, "score": score, "rank": rank}
+                continue
+            if chunk["metadata"].get("parent_id") and not metadata.get("parent_id"):
+                # 父块包含子块的内容
+                chunk["text"], chunk["metadata"] = text, metadata
+            if score is not None and (chunk["score"] is None or score > chunk["score"]):
+                chunk["score"] = score
+        return list(chunks.values())
+
+    def _merge_adjacent(self, chunks):
+        by_file, merged = {}, []
+        for chunk in chunks:
+            metadata = chunk["metadata"]
+            file = metadata.get("source") or metadata.get("filename")
+            try:
+                index = int(metadata["index"])
+            except (KeyError, TypeError, ValueError):
+                index = None
+            # 未展开的子块与父块共用位置，不参与合并
+            if file is None or index is None or metadata.get("parent_id"):
+                merged.append(chunk)
+            else:
+                # 联合检索多个知识库时，不同知识库中的同名文件不合并
+                by_file.setdefault((metadata.get("knowledge_name"), file), []).append((index, chunk))
+        for items in by_file.values():
+            items.sort(key=lambda item: item[0])
+            last_index, block = None, None
+            for index, chunk in items:
+                if block is not None and index == last_index + 1:
+                    block["text"] = self._concat(block["text"], chunk["text"])
+                    block["rank"] = min(block["rank"], chunk["rank"])
+                    if chunk["score"] is not None:
+                        block["score"] = chunk["score"] if block["score"] is None else max(block["score"], chunk["score"])
+                else:
+                    block = dict(chunk)
+                    merged.append(block)
+                last_index = index
+        return merged
+
+    def _concat(self, head, tail):
+        for size in range(min(len(head), len(tail), 500), MIN_MERGE_OVERLAP - 1, -1):
+            if head.endswith(tail[:size]):
+                return head + tail[size:]
+        return head + self.separator + tail
+
+    def _fit(self, texts):
+        if self.token_budget <= 0:
+            return texts
+        packed, used = [], 0
+        separator_tokens = count_tokens(self.separator) if self.separator.strip() else 0
+        for text in texts:
+            tokens = count_tokens(text) + (separator_tokens if packed else 0)
+            if used + tokens <= self.token_budget:
+                packed.append(text)
+                used += tokens
+            elif not packed:
+                packed.append(truncate_tokens(text, self.token_budget))
+                used = self.token_budget
+        return packed
 
 
 def align_inputs(self, inputs, cur_node, runtime_graph, llm_parameters_dict, **kwargs):
@@ -84,13 +232,17 @@ def align_outputs(self, data, cur_node, inputs, runtime_graph, llm_parameters_di
     elif self.services[cur_node].service_type == ServiceType.RETRIEVER:
 
         docs = [doc["text"] for doc in data["retrieved_docs"]]
+        metadata = data.get("metadata") or [{}] * len(docs)
+        contexts = [{"text": text, "metadata": meta} for text, meta in zip(docs, metadata)]
 
         with_rerank = runtime_graph.downstream(cur_node)[0].startswith("rerank")
         if with_rerank and docs:
             # forward to rerank
             # prepare inputs for rerank
             next_data["query"] = data["initial_query"]
-            next_data["texts"] = [doc["text"] for doc in data["retrieved_docs"]]
+            next_data["texts"] = docs
+            # rerank 只返回下标和分数，元数据留给 rerank 节点拼装上下文时使用
+            runtime_graph.context["retrieved_contexts"] = contexts
         else:
             # forward to llm
             if not docs and with_rerank:
@@ -109,14 +261,15 @@ def align_outputs(self, data, cur_node, inputs, runtime_graph, llm_parameters_di
                 prompt_template = PromptTemplate.from_template(chat_template)
                 input_variables = prompt_template.input_variables
                 if sorted(input_variables) == ["context", "question"]:
-                    prompt = prompt_template.format(question=data["initial_query"], context="\n".join(docs))
+                    prompt = prompt_template.format(question=data["initial_query"],
+                                                    context=ContextPacker().pack(contexts))
                 elif input_variables == ["question"]:
                     prompt = prompt_template.format(question=data["initial_query"])
                 else:
                     print(f"{prompt_template} not used, we only support 2 input variables ['question', 'context']")
-                    prompt = ChatTemplate.generate_rag_prompt(data["initial_query"], docs)
+                    prompt = ChatTemplate.generate_rag_prompt(data["initial_query"], contexts)
             else:
-                prompt = ChatTemplate.generate_rag_prompt(data["initial_query"], docs)
+                prompt = ChatTemplate.generate_rag_prompt(data["initial_query"], contexts)
 
             next_data["inputs"] = prompt
 
@@ -125,13 +278,14 @@ def align_outputs(self, data, cur_node, inputs, runtime_graph, llm_parameters_di
         reranker_parameters = kwargs.get("reranker_parameters", None)
         top_n = reranker_parameters.top_n if reranker_parameters else 1
         docs = inputs["texts"]
+        contexts = runtime_graph.context.get("retrieved_contexts") or [{"text": text} for text in docs]
         reranked_docs = []
         logger.info("docs========")
         logger.info(json.dumps(docs, indent=2))
         logger.info("data========")
         logger.info(json.dumps(data, indent=2))
         for best_response in data[:top_n]:
-            reranked_docs.append(docs[best_response['index']])
+            reranked_docs.append(dict(contexts[best_response['index']], score=best_response.get('score')))
 
         # handle template
         # if user provides template, then format the prompt with it
@@ -142,7 +296,7 @@ def align_outputs(self, data, cur_node, inputs, runtime_graph, llm_parameters_di
             prompt_template = PromptTemplate.from_template(chat_template)
             input_variables = prompt_template.input_variables
             if sorted(input_variables) == ["context", "question"]:
-                prompt = prompt_template.format(question=prompt, context="\n".join(reranked_docs))
+                prompt = prompt_template.format(question=prompt, context=ContextPacker().pack(reranked_docs))
             elif input_variables == ["question"]:
                 prompt = prompt_template.format(question=prompt)
             else:
@@ -161,10 +315,10 @@ def align_outputs(self, data, cur_node, inputs, runtime_graph, llm_parameters_di
     return next_data
 
 
-def align_generator(self, gen, **kwargs):
+async def align_generator(self, gen, **kwargs):
     # openai reaponse format
     # b'data:{"id":"","object":"text_completion","created":1725530204,"model":"meta-llama/Meta-Llama-3-8B-Instruct","system_fingerprint":"2.0.1-native","choices":[{"dataprep":0,"delta":{"role":"assistant","content":"?"},"logprobs":null,"finish_reason":null}]}\n\n'
-    for line in gen:
+    async for line in gen:
         line = line.decode("utf-8")
         start = line.find("{")
         end = line.rfind("}") + 1
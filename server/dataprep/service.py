@@ -1,3 +1,4 @@
+import asyncio
 import os
 import urllib
 from typing import List, Optional, Union
@@ -9,7 +10,9 @@ from rag.connector.database.service.knowledge_file_service import KnowledgeFileS
 from rag.connector.database.service.knowledge_service import KnowledgeService
 from rag.common.configuration import config
 from rag.connector.database.service.url_queue_service import URLQueueService
-from rag.connector.utils import get_embedding_model, get_vectorstore
+from rag.connector.database.session import transaction_scope
+from rag.connector.utils import get_embedding_model, get_vectorstore, invalidate_vectorstore
+from rag.connector.vectorstore.quantization import normalize_quantization
 from rag.module.indexing.indexing import Indexing
 from rag.module.knowledge_file import get_file_path, KnowledgeFile, clear_kb_folder, delete_kb_folder
 from rag.common.api import BaseResponse, ListResponse
@@ -19,6 +22,8 @@ import time
 import threading
 from concurrent.futures import ThreadPoolExecutor
 
+import aiohttp
+
 
 
 logger = CustomLogger("prepare_doc_milvus")
@@ -59,6 +64,26 @@ def run_crawler():
             logger.error(f"爬虫运行出错: {str(e)}", exc_info=True)
             time.sleep(30)  # 出错后等待30秒再重试
 
+async def invalidate_answer_cache(knowledge_name: str):
+    """
+    知识库文件变化后，通知 ChatQnA 网关丢弃该知识库的缓存答案。
+
+    通知失败只记录日志，缓存答案最迟在 TTL 到期后失效。
+    """
+    urls = config.server.answer_cache_invalidate_urls
+    if not urls:
+        return
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=5)) as session:
+        async def notify(url):
+            try:
+                async with session.delete(url, params={"knowledge_name": knowledge_name}) as response:
+                    response.raise_for_status()
+            except Exception as e:
+                logger.warning(f"invalidate answer cache {url} for {knowledge_name} failed: {e}")
+
+        await asyncio.gather(*(notify(url) for url in urls))
+
+
 def start_background_tasks():
     """
     启动后台任务
@@ -111,6 +136,7 @@ async def upload_docs(
         smaller_chunk_size=smaller_chunk_size,
     )
     failed_files.update(result.data["failed_files"])
+    await invalidate_answer_cache(knowledge_name)
 
     return BaseResponse(status="success", msg="upload files and vector embedding done", data={"failed_files": failed_files})
 
@@ -127,8 +153,9 @@ async def create_knowledge(
         weburl: str = Form(""),
         scraping_level: int = Form(1),
         link_tags: str = Form(""),
+        quantization: str = Form(""),
 ):
-    logger.info(f"[ create ] knowledge_name:{knowledge_name}, weburl:{weburl},sraping_level:{scraping_level},link_tags:{link_tags}")
+    logger.info(f"[ create ] knowledge_name:{knowledge_name}, weburl:{weburl},sraping_level:{scraping_level},link_tags:{link_tags},quantization:{quantization}")
     # step 1. check knowledge name
     if not validate_knowledge_name(knowledge_name):
         raise HTTPException(status_code=403, detail="knowledge name format is forbidden")
@@ -136,6 +163,12 @@ async def create_knowledge(
     if knowledge_name is None or knowledge_name.strip() == "":
         raise HTTPException(status_code=404, detail="knowledge name can't be empty")
 
+    # 向量量化方式：int8 / pq 适合大型知识库，未指定时使用 VECTOR_STORE_QUANTIZATION
+    try:
+        quantization = normalize_quantization(quantization or config.vector_store.quantization)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
     # step 2. check knowledge name is existed or not
     kb = knowledge_service.load_kb_from_db(knowledge_name)
     if kb is not None:
@@ -145,7 +178,7 @@ async def create_knowledge(
     try:
         embed_type = config.embedding.embedding_type
         vector_store_type = config.vector_store.vector_store_type
-        res = knowledge_service.add_kb_to_db(knowledge_name, "", vector_store_type, embed_type, weburl=weburl, scraping_level=scraping_level, link_tags=link_tags)
+        res = knowledge_service.add_kb_to_db(knowledge_name, "", vector_store_type, embed_type, weburl=weburl, scraping_level=scraping_level, link_tags=link_tags, vs_quantization=quantization)
         if not res:
             raise HTTPException(status_code=500, detail="save knowledge name failed")
     except Exception as e:
@@ -208,12 +241,15 @@ async def delete_documents(
     try:
         # clear vectorstore
         vs.drop_vectorstore()
+        invalidate_vectorstore(knowledge_name)
         # clear files
         delete_kb_folder(knowledge_name)
-        # clear db
-        status = knowledge_file_service.delete_files_from_db(knowledge_name)
-        status2 = knowledge_service.delete_kb_from_db(knowledge_name)
-        status3 = url_queue_service.clear_queue(knowledge_name)
+        # clear db in one transaction
+        with transaction_scope():
+            status = knowledge_file_service.delete_files_from_db(knowledge_name)
+            status2 = knowledge_service.delete_kb_from_db(knowledge_name)
+            status3 = url_queue_service.clear_queue(knowledge_name)
+        await invalidate_answer_cache(knowledge_name)
         if status and status2 and status3:
             return BaseResponse(status="success", msg=f"delete knowledge success: {knowledge_name}")
     except Exception as e:
@@ -248,11 +284,14 @@ async def clear_documents(
     try:
         # clear vectorstore
         vs.clear_vectorstore()
+        invalidate_vectorstore(knowledge_name)
         # clear files
         clear_kb_folder(knowledge_name)
-        # clear db
-        status = knowledge_file_service.delete_files_from_db(knowledge_name)
-        status2 = url_queue_service.clear_queue(knowledge_name)
+        # clear db in one transaction
+        with transaction_scope():
+            status = knowledge_file_service.delete_files_from_db(knowledge_name)
+            status2 = url_queue_service.clear_queue(knowledge_name)
+        await invalidate_answer_cache(knowledge_name)
         if status and status2:
             return BaseResponse(status="success", msg=f"clear knowledge success: {knowledge_name}")
     except Exception as e:
@@ -263,6 +302,33 @@ async def clear_documents(
     return BaseResponse(status="fail", msg=f"clear knowledge fail: {knowledge_name}")
 
 
+@register_microservice(name="opea_service@prepare_doc_milvus", endpoint="/v1/knowledge/recrawl", host="0.0.0.0", port=6010)
+async def recrawl_urls(
+        knowledge_name: str = Form(""),
+        older_than: int = Form(0),
+):
+    """
+    把知识库已爬取完成的URL重新排队，由后台爬虫重新抓取。
+
+    重新抓取时带上次的 ETag / Last-Modified 发送条件请求，页面未变化的URL不再重新索引；
+    older_than 大于 0 时只重新爬取完成时间早于该秒数之前的URL。
+    """
+    logger.info(f"[ recrawl ] knowledge_name:{knowledge_name}, older_than:{older_than}")
+    if not validate_knowledge_name(knowledge_name):
+        raise HTTPException(status_code=403, detail="knowledge name format is forbidden")
+
+    if knowledge_name is None or knowledge_name.strip() == "":
+        raise HTTPException(status_code=404, detail="knowledge name can't be empty")
+
+    kb = knowledge_service.load_kb_from_db(knowledge_name)
+    if kb is None:
+        raise HTTPException(status_code=404, detail="knowledge name has not existed")
+
+    knowledge_name = urllib.parse.unquote(knowledge_name)
+    count = url_queue_service.requeue_completed_urls(knowledge_name, older_than=older_than)
+    return BaseResponse(status="success", msg=f"requeued {count} urls of {knowledge_name}", data={"requeued": count})
+
+
 
 
 def save_files_in_thread(files: List[UploadFile],
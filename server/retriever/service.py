@@ -1,10 +1,14 @@
+import asyncio
 import json
 import os
 import time
 from fastapi import HTTPException
 
 from rag.common.configuration import config
-from rag.connector.utils import get_embedding_model, get_vectorstore
+from rag.connector.utils import get_embedding_model, get_vectorstore, vectorstore_registry
+from rag.connector.vectorstore.executor import get_search_executor
+from rag.connector.vectorstore.federation import knowledge_names, merge_federated
+from rag.connector.vectorstore.parent_store import parent_store_stats
 from comps import (
     CustomLogger,
     EmbedDoc,
@@ -19,6 +23,9 @@ from comps import (
 
 logger = CustomLogger("retriever_milvus")
 
+# 随检索结果返回的元数据，供 chatqna 拼装上下文时去重、合并相邻块
+RETRIEVED_METADATA_KEYS = ("id", "parent_id", "source", "filename", "index", "knowledge_name")
+
 # get embedding model
 embedding_model = get_embedding_model(embedding_type=config.embedding.embedding_type,
                                         mosec_embedding_model=config.embedding.mosec_embedding_model,
@@ -27,6 +34,55 @@ embedding_model = get_embedding_model(embedding_type=config.embedding.embedding_
                                         local_embedding_model=config.embedding.local_embedding_model)
 
 
+async def search(vs, input: EmbedDoc):
+    if input.search_type == "similarity":
+        return await vs.asearch_docs_by_vector(input.embedding, input.k, None)
+    elif input.search_type == "similarity_distance_threshold":
+        if input.distance_threshold is None:
+            raise ValueError("distance_threshold must be provided for " + "similarity_distance_threshold retriever")
+        return await vs.asearch_docs_by_vector(input.embedding, input.k, input.distance_threshold)
+    elif input.search_type == "mmr":
+        # 直接使用请求中的查询向量，不再重复调用 embedding 服务
+        return await vs.asearch_docs_by_mmr_vector(input.embedding, input.k, input.fetch_k, input.lambda_mult)
+    elif input.search_type == "hybrid":
+        # 向量检索与 BM25 关键词检索并发执行，按倒数排名融合
+        return await vs.asearch_docs_hybrid(input.text, input.embedding, input.k, input.fetch_k)
+    else:
+        raise HTTPException(status_code=400, detail=f"search_type {input.search_type} not valid")
+
+
+async def search_scored(vs, input: EmbedDoc):
+    """联合检索时使用：相似度检索保留分数，便于跨知识库按分数合并；其他检索方式只有排名"""
+    if input.search_type == "similarity":
+        return await vs.asearch_docs_by_vector_with_score(input.embedding, input.k, None)
+    elif input.search_type == "similarity_distance_threshold" and input.distance_threshold is not None:
+        return await vs.asearch_docs_by_vector_with_score(input.embedding, input.k, input.distance_threshold)
+    return await search(vs, input)
+
+
+async def search_federated(stores, input: EmbedDoc):
+    """
+    用同一个查询向量并发检索多个知识库，按分数合并。
+
+    耗时取决于最慢的一个知识库；个别知识库检索失败时记录日志并返回其余知识库的结果，全部失败时抛出第一个异常。
+    """
+    results = await asyncio.gather(*(search_scored(vs, input) for vs in stores.values()), return_exceptions=True)
+    per_knowledge, errors = {}, []
+    for knowledge_name, result in zip(stores, results):
+        if isinstance(result, HTTPException):
+            raise result
+        if isinstance(result, Exception):
+            logger.warning(f"search knowledge {knowledge_name} failed: {result}")
+            errors.append(result)
+            continue
+        per_knowledge[knowledge_name] = result
+    if not per_knowledge:
+        raise errors[0]
+    return merge_federated(per_knowledge,
+                           normalization=config.vector_store.federated_normalization,
+                           rrf_k=config.vector_store.hybrid_rrf_k)
+
+
 @register_microservice(
     name="opea_service@retriever_milvus",
     service_type=ServiceType.RETRIEVER,
@@ -38,31 +94,79 @@ embedding_model = get_embedding_model(embedding_type=config.embedding.embedding_
 async def retrieve(input: EmbedDoc) -> SearchedDoc:
     logger.info(input)
     start = time.time()
-    knowledge_name = input.knowledge_name
-    if knowledge_name is None or knowledge_name.strip() == "":
+    statistics = statistics_dict["opea_service@retriever_milvus"]
+    # knowledge_name 可以是一个知识库，也可以是多个知识库的列表
+    try:
+        names = knowledge_names(input.knowledge_name, config.vector_store.federated_max_knowledge)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not names:
         raise HTTPException(status_code=404, detail="knowledge name can't be empty")
 
-    vs = get_vectorstore(knowledge_name=knowledge_name,
-                         vs_type=config.vector_store.vector_store_type,
-                         embedding_model=embedding_model)
+    # 首次获取某知识库的句柄需要连接并加载集合，不在事件循环中执行
+    handles = await asyncio.gather(*(asyncio.to_thread(get_vectorstore,
+                                                       knowledge_name=name,
+                                                       vs_type=config.vector_store.vector_store_type,
+                                                       embedding_model=embedding_model) for name in names))
 
-    if input.search_type == "similarity":
-        search_res = vs.search_docs_by_vector(input.embedding, input.k, None)
-    elif input.search_type == "similarity_distance_threshold":
-        if input.distance_threshold is None:
-            raise ValueError("distance_threshold must be provided for " + "similarity_distance_threshold retriever")
-        search_res = vs.search_docs_by_vector(input.embedding, input.k, input.distance_threshold)
-    elif input.search_type == "mmr":
-        search_res = vs.search_docs_by_mmr(input.text, input.k, input.fetch_k, input.lambda_mult)
+    # 检索及其内部的父块召回、向量化耗时分阶段统计
+    with statistics.activate(), statistics.stage("search"):
+        if len(names) == 1:
+            search_res = [(r[0] if isinstance(r, tuple) else r, None, names[0])
+                          for r in await search(handles[0], input)]
+        else:
+            search_res = await search_federated(dict(zip(names, handles)), input)
 
-    searched_docs = []
-    for r in search_res:
-        searched_docs.append(TextDoc(text=r.page_content))
-    result = SearchedDoc(retrieved_docs=searched_docs, initial_query=input.text)
-    statistics_dict["opea_service@retriever_milvus"].append_latency(time.time() - start, None)
+    searched_docs, metadata, seen = [], [], set()
+    for doc, _, knowledge_name in search_res:
+        if len(searched_docs) >= input.k:
+            break
+        # 多个子块召回同一个父块时只保留排名最高的一次
+        doc_id = (knowledge_name, doc.metadata.get("id") or doc.page_content)
+        if doc_id in seen:
+            continue
+        seen.add(doc_id)
+        searched_docs.append(TextDoc(text=doc.page_content))
+        doc_metadata = {key: doc.metadata[key] for key in RETRIEVED_METADATA_KEYS if key in doc.metadata}
+        doc_metadata["knowledge_name"] = knowledge_name
+        metadata.append(doc_metadata)
+    result = SearchedDoc(retrieved_docs=searched_docs, initial_query=input.text, metadata=metadata)
+    statistics.append_latency(time.time() - start, None)
     logger.info(result)
     return result
 
 
+@register_microservice(
+    name="opea_service@retriever_milvus",
+    endpoint="/v1/retrieval/vectorstores",
+    host="0.0.0.0",
+    port=7000,
+    methods=["GET"],
+)
+async def vectorstore_stats():
+    """Open vector store handles, search executor queue depth, parent chunk and embedding caches of this process"""
+    return {"handles": vectorstore_registry.stats(), "search": get_search_executor().stats(),
+            "parents": parent_store_stats(),
+            "embedding_cache": embedding_model.stats() if hasattr(embedding_model, "stats") else None}
+
+
+@register_microservice(
+    name="opea_service@retriever_milvus",
+    endpoint="/v1/retrieval/quantization",
+    host="0.0.0.0",
+    port=7000,
+    methods=["GET"],
+)
+async def quantization_stats(knowledge_name: str, evaluate: bool = False):
+    """Quantization mode, memory and recall of a knowledge base; evaluate=true also measures recall@k"""
+    if knowledge_name is None or knowledge_name.strip() == "":
+        raise HTTPException(status_code=404, detail="knowledge name can't be empty")
+    vs = await asyncio.to_thread(get_vectorstore,
+                                 knowledge_name=knowledge_name,
+                                 vs_type=config.vector_store.vector_store_type,
+                                 embedding_model=embedding_model)
+    return await asyncio.to_thread(vs.quantization_stats, evaluate)
+
+
 if __name__ == "__main__":
     opea_microservices["opea_service@retriever_milvus"].start()
\ No newline at end of file